@@ -0,0 +1,211 @@
+import numpy as np
+
+
+# Backend name -> function returning the `Backend`, see `register_backend`
+BACKENDS = {}
+
+
+class Backend:
+    def __init__(self, name, xp):
+        """ Array library a `Map` computes with. `xp` is its namespace following the array API standard
+        (https://data-apis.org/array-api/), the map only uses the functions of the standard on it, and the
+        methods below for what the standard doesn't cover (conversions, in-place updates).
+        The methods of this class only use the standard: a sub-class can override them with faster
+        library-specific versions """
+        self.name = name
+        self.xp = xp
+
+    def asarray(self, x, dtype=None):
+        """ `x` (numpy array, scalar...) as an array of the backend """
+        return self.xp.asarray(x, dtype=dtype)
+
+    def to_numpy(self, x):
+        return np.from_dlpack(x)
+
+    def put(self, x, indices, values):
+        """ `x[indices] = values` for 1d `x` and unique `indices`, returns the updated array
+        (updated in place or not, depending on the backend) """
+        xp = self.xp
+        if indices.shape[0] == 0:
+            return x
+        indices = xp.astype(indices, xp.int64)
+        values = xp.broadcast_to(xp.asarray(values, dtype=x.dtype), indices.shape)
+        order = xp.argsort(indices, stable=True)
+        indices, values = xp.take(indices, order), xp.take(values, order)
+        positions = xp.arange(x.shape[0], dtype=xp.int64)
+        inds = xp.clip(xp.searchsorted(indices, positions), max=indices.shape[0] - 1)
+        return xp.where(xp.take(indices, inds) == positions, xp.take(values, inds), x)
+
+    # Methods with an `out` argument: array to write the result in, if the backend supports it (see `supports_out`).
+    # Otherwise `out` is ignored, the result is a new array
+    supports_out = False
+
+    def take(self, x, indices, out=None):
+        """ `xp.take(x, indices, axis=0)` """
+        return self.xp.take(x, indices, axis=0)
+
+    def compress(self, mask, x, out=None):
+        """ `x[mask]` for 1d `mask` """
+        return x[mask]
+
+    def elementwise(self, func, x1, x2, out=None):
+        """ elementwise function `func` of the standard ('less', 'minimum'...) """
+        return getattr(self.xp, func)(x1, x2)
+
+    def count_true(self, mask, axis, out=None):
+        return self.xp.count_nonzero(mask, axis=axis)
+
+    def segment_max(self, data, starts):
+        """ max of each segment of `data`, the segments beginning at `starts` (non empty, in increasing order) """
+        xp = self.xp
+        counts = xp.diff(starts, append=xp.asarray([data.shape[0]], dtype=starts.dtype))
+        segments = xp.repeat(xp.arange(starts.shape[0]), counts)
+        # sort by value within segments: the max of a segment is its last element
+        order = xp.argsort(data, stable=True)
+        order = xp.take(order, xp.argsort(xp.take(segments, order), stable=True))
+        return xp.take(data, xp.take(order, starts + counts - 1))
+
+    def bincount(self, x, minlength):
+        """ number of occurrences of each value in range(minlength) in `x` (non-negative integers under `minlength`) """
+        xp = self.xp
+        return xp.sum(xp.astype(x[None, :] == xp.arange(minlength, dtype=x.dtype)[:, None], xp.int64), axis=1)
+
+    def counting_sort(self, keys, n_keys):
+        """ indices sorting `keys` (non-negative integers under `n_keys`), stable """
+        return self.xp.argsort(keys, stable=True)
+
+    def argsmallest(self, x, k):
+        """ indices of the `k` smallest values of 1d `x` (in any order) """
+        return self.xp.argsort(x)[:k]
+
+    def add_at(self, x, indices, value):
+        """ `x[indices] += value` for 1d `x`, scalar `value` and `indices` possibly repeated, returns the updated array """
+        xp = self.xp
+        indices, counts = xp.unique_counts(indices)
+        return self.put(x, indices, xp.take(x, indices) + xp.astype(counts, x.dtype) * value)
+
+    def update(self, arr, value):
+        """ copy `value` in `arr` if they have the same shape (no reallocation), otherwise return `value`
+        as an array of the backend with the dtype of `arr` """
+        if isinstance(value, np.ndarray):
+            value = self.asarray(value)
+        value = self.xp.astype(value, arr.dtype)
+        if arr.shape == value.shape:
+            arr[...] = value
+            return arr
+        return value
+
+
+class NumpyBackend(Backend):
+    supports_out = True
+
+    def __init__(self):
+        super().__init__('numpy', np)
+
+    def asarray(self, x, dtype=None):
+        return np.asarray(x, dtype=dtype)
+
+    def to_numpy(self, x):
+        return np.asarray(x)
+
+    def take(self, x, indices, out=None):
+        if out is None:
+            return np.take(x, indices, axis=0)
+        return take_into(x, indices, out)
+
+    def compress(self, mask, x, out=None):
+        return np.compress(mask, x, axis=0, out=out)
+
+    def elementwise(self, func, x1, x2, out=None):
+        return getattr(np, func)(x1, x2, out=out)
+
+    def count_true(self, mask, axis, out=None):
+        if out is None:
+            return np.count_nonzero(mask, axis=axis)
+        return np.sum(mask, axis=axis, out=out)
+
+    def put(self, x, indices, values):
+        x[indices] = values
+        return x
+
+    def segment_max(self, data, starts):
+        return np.maximum.reduceat(data, starts)
+
+    def bincount(self, x, minlength):
+        return np.bincount(x, minlength=minlength)
+
+    def counting_sort(self, keys, n_keys):
+        # least significant digit radix sort by 16 bits digits: numpy sorts 16 bits integers stably by counting
+        order = np.argsort(keys.astype(np.uint16), kind='stable')
+        for shift in range(16, max(int(n_keys) - 1, 1).bit_length(), 16):
+            order = order[np.argsort((keys[order] >> shift).astype(np.uint16), kind='stable')]
+        return order
+
+    def argsmallest(self, x, k):
+        if k >= x.shape[0]:
+            return np.arange(x.shape[0])
+        return np.argpartition(x, k)[:k]
+
+    def add_at(self, x, indices, value):
+        # `np.add.at` is much slower by index than `np.bincount`, whose cost is linear in the size of `x`
+        if indices.shape[0] < x.shape[0] // 16:
+            np.add.at(x, indices, value)
+        else:
+            x += value * np.bincount(indices, minlength=x.shape[0])
+        return x
+
+    def update(self, arr, value):
+        if arr.shape == value.shape:
+            np.copyto(arr, value, casting='unsafe')
+            return arr
+        return value.astype(arr.dtype)
+
+
+class CupyBackend(Backend):
+    def __init__(self):
+        # cupy's main namespace doesn't have all the functions of the standard (unique_values, cumulative_sum...),
+        # its array API namespace comes from array_api_compat
+        import cupy
+        from array_api_compat import cupy as xp
+        super().__init__('cupy', xp)
+        self.cupy = cupy
+
+    def to_numpy(self, x):
+        return self.cupy.asnumpy(x)
+
+    def put(self, x, indices, values):
+        x[indices] = values
+        return x
+
+
+def take_into(x, indices, out):
+    """ `np.take(x, indices, axis=0, out=out)`. With `out`, numpy's default mode (raising on out of range indices)
+    takes in a temporary copy: the indices are checked here, and taken directly when they are in range """
+    if indices.shape[0] > 0 and (np.min(indices) < 0 or np.max(indices) >= x.shape[0]):
+        # negative (wrapped) or out of range indices: numpy's checks
+        return np.take(x, indices, axis=0, out=out)
+    return np.take(x, indices, axis=0, out=out, mode='clip')
+
+
+def register_backend(name, factory):
+    """ make a backend available to `Map` (`set_backend`, `backend` argument of `from_arrays`...) under `name`.
+    `factory()` returns the `Backend`, it is called once, when the backend is first used (so that optional
+    libraries are imported only if needed) """
+    BACKENDS[name] = factory
+
+
+def get_backend(backend='numpy'):
+    """ `backend`: name of a registered backend or `Backend` instance """
+    if isinstance(backend, Backend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown backend: {backend}, registered ones: {sorted(BACKENDS.keys())}')
+    if not isinstance(BACKENDS[backend], Backend):
+        BACKENDS[backend] = BACKENDS[backend]()
+    return BACKENDS[backend]
+
+
+register_backend('numpy', NumpyBackend)
+register_backend('cupy', CupyBackend)
+# Strict implementation of the array API standard (on top of numpy), to check that the map stays portable
+register_backend('array_api_strict', lambda: Backend('array_api_strict', __import__('array_api_strict')))
@@ -0,0 +1,2 @@
+from .suite import get_cases, build_array_params, run_case, run_suite, get_metadata, REFERENCE_CASE, SWEEPS, QUICK_REFERENCE_CASE, QUICK_SWEEPS
+from .compare import load_results, compare
@@ -0,0 +1,68 @@
+""" Scaling benchmark of the simulation engine, run from `propagsim/np`:
+    python -m bench run results.json [--quick] [--full] [--n-agents 10000 100000 ...]
+    python -m bench compare baseline.json candidate.json [--threshold .1]
+`compare` exits with status 1 if a timing regressed, 2 if the runs have different settings """
+import argparse, json, sys
+import pandas as pd
+from .suite import get_cases, run_suite, REFERENCE_CASE, SWEEPS, QUICK_REFERENCE_CASE, QUICK_SWEEPS
+from .compare import load_results, compare
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='run the benchmark cases and write the results in a JSON file')
+    run_parser.add_argument('output')
+    run_parser.add_argument('--quick', action='store_true', help='small cases only')
+    run_parser.add_argument('--full', action='store_true', help='all combinations of the swept values')
+    for name in SWEEPS:
+        run_parser.add_argument(f"--{name.replace('_', '-')}", type=float, nargs='+', help='values to sweep')
+    run_parser.add_argument('--n-periods', type=int, default=3)
+    run_parser.add_argument('--n-moves-per-period', type=int, default=4)
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--threads', type=int, help='run the per-agent operations on this number of threads')
+    run_parser.add_argument('--probability-bits', type=int, choices=[16, 32], help='fixed-point probabilities')
+    run_parser.add_argument('--backend', default='numpy', help="array library: 'numpy', 'cupy'...")
+    run_parser.add_argument('--square-sampling', default='matrix', choices=['matrix', 'tree'], help='sampling of the squares of the moves')
+    compare_parser = subparsers.add_parser('compare', help='flag the regressions of a result file against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=.1, help='relative slowdown flagged as a regression')
+    compare_parser.add_argument('--min-time', type=float, default=1e-3, help='timings under it (seconds) are ignored')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        sweeps = dict(QUICK_SWEEPS if args.quick else SWEEPS)
+        reference = QUICK_REFERENCE_CASE if args.quick else REFERENCE_CASE
+        for name in SWEEPS:
+            values = getattr(args, name)
+            if values is not None:
+                sweeps[name] = [int(value) if name in ['n_agents', 'n_squares_axis'] else value for value in values]
+
+        def report(res):
+            print(f"{res['params']}: total {round(res['total_s'], 3)}s, setup {round(res['setup_s'], 3)}s, "
+                  f"peak RSS {round(res['peak_rss_mb'])}MB")
+
+        results = run_suite(get_cases(sweeps, reference, full=args.full), callback=report, n_periods=args.n_periods,
+                            n_moves_per_period=args.n_moves_per_period, repeat=args.repeat, seed=args.seed,
+                            backend=args.backend, n_threads=args.threads,
+                            probability_bits=args.probability_bits, square_sampling=args.square_sampling)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        return 0
+
+    try:
+        df = compare(load_results(args.baseline), load_results(args.candidate), args.threshold, args.min_time)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df.to_string(index=False))
+    n_regressions = int(df['regression'].sum())
+    print(f'{n_regressions} regression(s) over {df.shape[0]} timings')
+    return 1 if n_regressions > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import json
+import pandas as pd
+
+# Settings of a case (see `run_case`) changing its timings: the cases of two results are the same with the same
+# parameters and settings
+CASE_SETTINGS = ('backend', 'n_threads', 'probability_bits', 'square_sampling')
+# Settings of a whole run (see `run_suite`), the runs where they differ are not compared
+RUN_SETTINGS = ('n_periods', 'n_moves_per_period', 'repeat', 'seed')
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def get_times(results):
+    """ one row per case and timing ('total', 'setup', 'build_population' or a phase name) """
+    rows = []
+    for res in results['cases']:
+        key = tuple(sorted(res['params'].items())) + tuple((name, res.get(name)) for name in CASE_SETTINGS)
+        rows.append({'case': key, 'timing': 'setup', 'time_s': res['setup_s']})
+        rows.append({'case': key, 'timing': 'total', 'time_s': res['total_s']})
+        if 'build_population_s' in res:
+            rows.append({'case': key, 'timing': 'build_population', 'time_s': res['build_population_s']})
+        for name, phase in res['phases'].items():
+            rows.append({'case': key, 'timing': name, 'time_s': phase['total_s']})
+    return pd.DataFrame(rows, columns=['case', 'timing', 'time_s'])
+
+
+def compare(baseline, candidate, threshold=.1, min_time=1e-3):
+    """ compare two results of `run_suite` on the cases they have in common, with the same settings (ValueError if
+    the settings of the runs differ).
+    A timing is flagged as a regression when it is more than `threshold` (relative) slower in `candidate`,
+    timings under `min_time` seconds in both being too noisy to be compared.
+    returns a DataFrame with one row per case and timing """
+    differing = [name for name in RUN_SETTINGS if baseline.get('settings', {}).get(name) != candidate.get('settings', {}).get(name)]
+    if differing:
+        raise ValueError(f'the runs differ in their settings {differing}, their timings can\'t be compared')
+    df = get_times(baseline).merge(get_times(candidate), on=['case', 'timing'], suffixes=('_baseline', '_candidate'))
+    df['ratio'] = df['time_s_candidate'] / df['time_s_baseline']
+    comparable = (df[['time_s_baseline', 'time_s_candidate']].max(axis=1) >= min_time)
+    df['regression'] = comparable & (df['ratio'] > 1 + threshold)
+    df['case'] = df['case'].apply(lambda key: ', '.join(f'{name}={value}' for name, value in key))
+    return df
@@ -0,0 +1,153 @@
+import numpy as np
+import multiprocessing as mp
+import itertools, os, platform, resource, subprocess, sys
+from datetime import datetime
+from time import perf_counter
+from classes import Map
+from profiling import Profiler
+from parallel import ChunkExecutor
+from simulation import DATA_DIR, PopulationBuilder, states2ids, get_cell_positions, get_cell_attractivities, get_cell_unsafeties
+
+DAY = datetime(2020, 4, 1)
+STATE_MM = {'asymptomatic': (4, 3), 'infected': (6, 4), 'asympcont': (1, 1),
+            'hosp': (8, 6), 'icu': (17, 15), 'recovercont': (2, 1)}
+AVG_AGENTS_HOME = 2.2
+PROP_PUBLIC_CELLS = 1 / 70  # there is one public place for 70 people in France
+
+# Reference case, each sweep changes one parameter of it
+REFERENCE_CASE = {'n_agents': 100000, 'n_squares_axis': 30, 'p_move': .1, 'prevalence': .01}
+SWEEPS = {'n_agents': [10000, 100000, 1000000, 10000000],
+          'n_squares_axis': [10, 30, 100],
+          'p_move': [.02, .1, .3],
+          'prevalence': [.001, .01, .1]}
+QUICK_REFERENCE_CASE = {'n_agents': 20000, 'n_squares_axis': 10, 'p_move': .1, 'prevalence': .01}
+QUICK_SWEEPS = {'n_agents': [10000, 50000], 'n_squares_axis': [10, 30], 'p_move': [.1, .3], 'prevalence': [.01, .1]}
+
+
+def get_cases(sweeps=SWEEPS, reference=REFERENCE_CASE, full=False):
+    """ cases to benchmark: each parameter swept around the `reference` case, or all the combinations if `full` """
+    if full:
+        names = list(sweeps.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[sweeps[name] for name in names])]
+    cases = []
+    for name, values in sweeps.items():
+        for value in values:
+            case = dict(reference, **{name: value})
+            if case not in cases:
+                cases.append(case)
+    return cases
+
+
+def build_array_params(n_agents, n_squares_axis, p_move, prevalence, seed=0, data_dir=DATA_DIR, builder=None):
+    """ arguments of `Map.from_arrays` for a benchmark case: a synthetic population where a `prevalence`
+    fraction of the agents is infected, the rest healthy. `builder`: `PopulationBuilder` to use, if already built """
+    np.random.seed(seed)
+    n_home_cells = int(n_agents / AVG_AGENTS_HOME)
+    n_public_cells = int(n_agents * PROP_PUBLIC_CELLS)
+    cell_positions = get_cell_positions(n_home_cells + n_public_cells, n_squares_axis, density_factor=2)
+    array_params = {'cell_ids': np.arange(0, n_home_cells + n_public_cells).astype(np.uint32),
+                    'attractivities': get_cell_attractivities(n_home_cells, n_public_cells),
+                    'unsafeties': get_cell_unsafeties(n_home_cells + n_public_cells, n_home_cells, .7),
+                    'xcoords': cell_positions[:, 0], 'ycoords': cell_positions[:, 1],
+                    'unique_state_ids': np.arange(0, len(states2ids)).astype(np.uint32),
+                    'unique_contagiousities': np.array([0, 0, .5, .8, 0, 0, 0, .3, 0]),
+                    'unique_sensitivities': np.array([1, 0, 0, 0, 0, 0, 0, 0, 0]),
+                    'unique_severities': np.array([0, 0, 0, .7, 1, 1, 1, .1, 0])}
+    if builder is None:
+        builder = PopulationBuilder(data_dir=data_dir, seed=seed)
+    array_params.update(builder.build(n_agents, STATE_MM, DAY, n_home_cells, p_move))
+    n_agents_generated = array_params['agent_ids'].shape[0]
+    current_state_ids = np.full(n_agents_generated, states2ids['healthy'], dtype=np.uint8)
+    infected = builder.rng.choice(n_agents_generated, size=int(prevalence * n_agents_generated), replace=False)
+    current_state_ids[infected] = states2ids['infected']
+    array_params['current_state_ids'] = current_state_ids
+    array_params['current_state_durations'] = np.zeros(n_agents_generated, dtype=np.int32)
+    return array_params
+
+
+def get_peak_rss():
+    """ peak resident set size of the current process in bytes """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024  # kilobytes on Linux
+
+
+def run_case(case, n_periods=3, n_moves_per_period=4, repeat=3, seed=0, data_dir=DATA_DIR, backend='numpy', n_threads=None,
+             probability_bits=None, square_sampling='matrix'):
+    """ time the build of the map of `case` then `repeat` simulations of `n_periods` on it (reset in between),
+    computing with `backend` (see `Map.set_backend`), on `n_threads` threads if given (see `Map.set_executor`),
+    with `probability_bits` fixed-point probabilities if given and `square_sampling` (see `Map.from_arrays`).
+    Phase times are the median over the repetitions of their total time in a simulation. The synthetic population
+    is built `repeat` more times (`build_population_s`, median), as done at each round of a calibration """
+    t0 = perf_counter()
+    builder = PopulationBuilder(data_dir=data_dir, seed=seed)
+    array_params = build_array_params(**case, seed=seed, data_dir=data_dir, builder=builder)
+    map = Map()
+    map.from_arrays(**array_params, seed=seed, backend=backend, probability_bits=probability_bits, square_sampling=square_sampling)
+    if n_threads is not None:
+        map.set_executor(ChunkExecutor(n_threads))
+    setup_s = perf_counter() - t0
+    profiler = Profiler(track_memory=False)
+    map.set_profiler(profiler)
+    totals, phases = [], []
+    for _ in range(repeat):
+        map.reset()
+        profiler.clear()
+        t0 = perf_counter()
+        map.run(n_periods, n_moves_per_period)
+        totals.append(perf_counter() - t0)
+        phases.append(profiler.to_dataframe().groupby('name')['duration'].agg(['sum', 'count']))
+    builds = []
+    for _ in range(repeat):
+        t0 = perf_counter()
+        builder.build(case['n_agents'], STATE_MM, DAY, int(case['n_agents'] / AVG_AGENTS_HOME), case['p_move'])
+        builds.append(perf_counter() - t0)
+    phase_names = sorted(set().union(*[phase.index for phase in phases]))
+    res = {'params': dict(case),
+           'backend': map.backend.name,
+           'n_threads': n_threads,
+           'probability_bits': probability_bits,
+           'square_sampling': square_sampling,
+           'n_agents_generated': int(array_params['agent_ids'].shape[0]),
+           'setup_s': setup_s,
+           'build_population_s': float(np.median(builds)),
+           'total_s': float(np.median(totals)),
+           'phases': {name: {'total_s': float(np.median([phase.loc[name, 'sum'] for phase in phases if name in phase.index])),
+                             'n_calls': int(phases[0].loc[name, 'count']) if name in phases[0].index else 0}
+                      for name in phase_names},
+           'peak_rss_mb': get_peak_rss() / 2 ** 20}
+    if map.executor is not None:
+        map.executor.shutdown()
+    return res
+
+
+def run_case_isolated(args):
+    case, kwargs = args
+    return run_case(case, **kwargs)
+
+
+def get_metadata():
+    """ git revision and environment the benchmark was run in """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        git_rev = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, stderr=subprocess.DEVNULL).decode().strip()
+        git_dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=repo_dir, stderr=subprocess.DEVNULL) != 0
+    except (OSError, subprocess.CalledProcessError):
+        git_rev, git_dirty = None, None
+    return {'git_rev': git_rev, 'git_dirty': git_dirty,
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+def run_suite(cases, callback=None, **kwargs):
+    """ run each case in its own process (so that its peak RSS is its own), `kwargs` are passed to `run_case`.
+    `callback(res)` is called after each case. returns the results with the metadata of the run """
+    results = []
+    ctx = mp.get_context()
+    for case in cases:
+        with ctx.Pool(1) as pool:
+            res = pool.apply(run_case_isolated, ((case, kwargs),))
+        results.append(res)
+        if callback is not None:
+            callback(res)
+    return {'metadata': get_metadata(), 'settings': kwargs, 'cases': results}
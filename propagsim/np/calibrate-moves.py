@@ -1,6 +1,6 @@
 from classes import State, Agent, Cell, Transitions, Map
-from simulation import split_population, get_durations, get_current_state_durations, get_transitions_ids, evaluate
-from simulation import get_cell_positions, get_cell_attractivities, get_cell_unsafeties, get_transitions, get_p_moves, draw_lognormal
+from simulation import evaluate, PopulationBuilder
+from simulation import get_cell_positions, get_cell_attractivities, get_cell_unsafeties
 import numpy as np
 from time import time
 import os, json
@@ -22,7 +22,7 @@ PROP_PUBLIC_CELLS = 1 / 70  # there is one public place for 70 people in France
 N_CELLS = int(N_HOME_CELLS + N_AGENTS * PROP_PUBLIC_CELLS)
 MEAN_HOSP_T = 10 # irrelevant here
 MEAN_ICU_T = 18 # irrelevant here
-split_pop = split_population(N_AGENTS)
+population_builder = PopulationBuilder()  # data files are read once for all rounds
 states =  ['healthy', 'asymptomatic', 'asympcont', 'infected', 'hosp', 'icu', 'death', 'recovercont', 'recovered']
 states2ids = {state: i for i, state in enumerate(states)}
 ids2states = {v: k for k, v in states2ids.items()}
@@ -113,27 +113,20 @@ def build_parameters(current_period=0, verbose=0):
     unique_contagiousities = np.array([0, 0, pdict['contagiousity_asympcont'], pdict['contagiousity_infected'], 0, 0, 0, pdict['contagiousity_recovercont'], 0])
     unique_sensitivities = np.array([1, 0, 0, 0, 0, 0, 0, 0, 0])
     unique_severities = np.array([0, 0, 0, pdict['severity_infected'], 1, 1, 1, pdict['severity_recovercont'], 0])
-    transitions = get_transitions(split_pop)
-    durations = get_durations(split_pop, state_mm)
-    n_agents_generated = durations.shape[0]
+    agent_params = population_builder.build(N_AGENTS, state_mm, DAY, N_HOME_CELLS, pdict['avg_p_move'])
+    # initial states are not taken from the state repartition here but from `N_AGENT_INFECTED_START`
+    n_agents_generated = agent_params['agent_ids'].shape[0]
     current_state_ids, current_state_durations = get_current_state_durations(n_agents_generated, N_AGENT_INFECTED_START)
-    agent_ids = np.arange(0, n_agents_generated).astype(np.uint32)
-    home_cell_ids = np.random.choice(np.arange(0, N_HOME_CELLS), size=n_agents_generated).astype(np.uint32)
-    p_moves = get_p_moves(n_agents_generated, pdict['avg_p_move'])
-    least_state_ids = np.ones(n_agents_generated)  # least severe state is state 1 for all agents
-
-
-    transitions_ids = get_transitions_ids(split_pop)
+    agent_params['current_state_ids'] = current_state_ids
+    agent_params['current_state_durations'] = current_state_durations
     dscale = pdict['dscale']
 
     array_params = {'cell_ids': cell_ids, 'attractivities': attractivities, 'unsafeties': unsafeties,
                     'xcoords': xcoords, 'ycoords': ycoords, 'unique_state_ids': unique_state_ids,
                     'unique_contagiousities': unique_contagiousities, 'unique_sensitivities': unique_sensitivities,
-                    'unique_severities': unique_severities, 'transitions': transitions, 'agent_ids': agent_ids,
-                    'home_cell_ids': home_cell_ids, 'p_moves': p_moves, 'least_state_ids': least_state_ids,
-                    'current_state_ids': current_state_ids, 'current_state_durations': current_state_durations,
-                    'durations': durations, 'transitions_ids': transitions_ids, 'dscale': dscale,
+                    'unique_severities': unique_severities, 'dscale': dscale,
                     'current_period': current_period, 'verbose': verbose}
+    array_params.update(agent_params)
 
     return array_params, pdict
 
@@ -159,15 +152,20 @@ def run_calibration(n_rounds, current_period=0, verbose=0):
         os.makedirs('../calibrations')
     memory_error = False
     map = Map()
+    map_built = False
     best_score = None
     for i in range(n_rounds):
         if i%10 == 0:
             print(f'round {i}...')
-        evaluations = []
         array_params, pdict = build_parameters(current_period, verbose)
         try:
-            map.from_arrays(**array_params)
-        except:
+            if map_built:
+                # cell positions change with `density_factor` so squares are recomputed, agent arrays are re-used
+                map.reset(**array_params)
+            else:
+                map.from_arrays(**array_params)
+                map_built = True
+        except MemoryError:
             print('Memory error')
             memory_error = True
             pass
@@ -175,17 +173,8 @@ def run_calibration(n_rounds, current_period=0, verbose=0):
             memory_error = False
             continue
 
-        for prd in range(N_PERIODS):
-            for _ in range(pdict['n_moves_per_period']):
-                map.make_move(prop_cont_factor=pdict['prop_cont_factor'])
-            map.forward_all_cells()
-            state_ids, state_numbers = map.get_states_numbers()
-            # Check if we are already in the good range at mid time
-            evaluation = (state_ids, state_numbers)
-            if prd == 6:
-                ind_asymptomatic = np.where(evaluation[0] == 1)[0][0].astype(np.uint32)
-                n_asymptomatic = evaluation[1][ind_asymptomatic]
-            evaluations.append(evaluation)
+        records = map.run(N_PERIODS, pdict['n_moves_per_period'], prop_cont_factor=pdict['prop_cont_factor'])
+        evaluations = [(records['state_ids'], state_numbers) for state_numbers in records['states']]
 
         score, progressions = evaluate_move(evaluations)
 
@@ -200,4 +189,5 @@ def run_calibration(n_rounds, current_period=0, verbose=0):
             np.save(fpath, to_save)
 
 
-run_calibration(n_rounds=1000)
\ No newline at end of file
+if __name__ == '__main__':
+    run_calibration(n_rounds=1000)
\ No newline at end of file
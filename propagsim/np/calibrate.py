@@ -1,9 +1,11 @@
 from classes import State, Agent, Cell, Transitions, Map
-from simulation import split_population, get_durations, get_current_state_durations, get_transitions_ids, evaluate
-from simulation import get_cell_positions, get_cell_attractivities, get_cell_unsafeties, get_transitions, get_p_moves
+from simulation import evaluate, PopulationBuilder
+from calibration import CalibrationEngine, TPEOptimizer
+from simulation import get_cell_positions, get_cell_attractivities, get_cell_unsafeties
 import numpy as np
 from time import time
-import os, json
+import argparse, os, json
+from collections import Counter
 from datetime import datetime
 
 CALIBRATION_DIR = os.path.join(*['..', '..', 'calibrations'])
@@ -18,7 +20,7 @@ AVG_AGENTS_HOME = 2.2
 N_HOME_CELLS = int(N_AGENTS / AVG_AGENTS_HOME)
 PROP_PUBLIC_CELLS = 1 / 70  # there is one public place for 70 people in France
 N_CELLS = int(N_HOME_CELLS + N_AGENTS * PROP_PUBLIC_CELLS)
-split_pop = split_population(N_AGENTS)
+population_builder = PopulationBuilder()  # data files are read once for all rounds
 states =  ['healthy', 'asymptomatic', 'asympcont', 'infected', 'hosp', 'icu', 'death', 'recovercont', 'recovered']
 states2ids = {state: i for i, state in enumerate(states)}
 ids2states = {v: k for k, v in states2ids.items()}
@@ -64,49 +66,85 @@ def get_random_parameters():
     return pdict
 
 
+# Same ranges as `get_random_parameters` for the optimizers of `calibration`
+SEARCH_SPACE = {'n_moves_per_period': pcmove['n_moves_per_period'],
+                'avg_p_move': (0, pcmove['avg_p_move'] / 2),
+                'dscale': pcmove['dscale'],
+                'density_factor': pcmove['density_factor'],
+                'avg_unsafety': (0, pcmove['avg_unsafety']),
+                'avg_attractivity': (0, 1),
+                'p_closed': (.8, 1),
+                'contagiousity_infected': pcmove['contagiousity_infected'],
+                'contagiousity_asympcont': pcmove['contagiousity_asympcont'],
+                'contagiousity_hosp': 0,
+                'contagiousity_icu': 0,
+                'contagiousity_recovercont': pcmove['contagiousity_recovercont'],
+                'severity_infected': (.5, 1),
+                'ratio_severity_recovercont': (0, 1),  # severity_recovercont / severity_infected
+                'mean_asymptomatic_t': pcmove['mean_asymptomatic_t'],
+                'mean_infected_t': pcmove['mean_infected_t'],
+                'mean_hosp_t': (4, 10),
+                'mean_icu_t': (15, 20)}
+
+
+def complete_parameters(pdict):
+    pdict['severity_recovercont'] = pdict['ratio_severity_recovercont'] * pdict['severity_infected']
+    return pdict
+
 
-def build_parameters(current_period=0, verbose=0):
-    pdict = get_random_parameters()
 
+def get_state_mm(pdict):
     state_mm = {'asymptomatic': (pdict['mean_asymptomatic_t'], pdict['mean_asymptomatic_t'] - 1),
                 'infected': (pdict['mean_infected_t'], pdict['mean_infected_t'] - 2),
                 'asympcont': (1, 1),
                 'hosp': (pdict['mean_hosp_t'], pdict['mean_hosp_t'] - 2),
                 'icu': (pdict['mean_icu_t'], pdict['mean_icu_t'] - 2),
                 'recovercont': (2, 1)}
+    return state_mm
 
-    # vectors
-    cell_ids = np.arange(0, N_CELLS).astype(np.uint32)
+
+def build_round_parameters(pdict):
+    """ parameters depending on `pdict`, given to `Map.reset` from one calibration round to the next.
+    Cell positions, home cells and transitions don't depend on it and are kept """
+    state_mm = get_state_mm(pdict)
     attractivities = get_cell_attractivities(N_HOME_CELLS, N_CELLS - N_HOME_CELLS, avg=pdict['avg_attractivity'], p_closed=pdict['p_closed'])
     unsafeties = get_cell_unsafeties(N_CELLS, N_HOME_CELLS, pdict['avg_unsafety'])
+    unique_contagiousities = np.array([0, 0, pdict['contagiousity_asympcont'], pdict['contagiousity_infected'], pdict['contagiousity_hosp'], pdict['contagiousity_icu'], 0, pdict['contagiousity_recovercont'], 0])
+    unique_severities = np.array([0, 0, 0, pdict['severity_infected'], 1, 1, 1, pdict['severity_recovercont'], 0])
+    effectifs = population_builder.get_effectifs(N_AGENTS)
+    current_state_ids, current_state_durations = population_builder.get_current_state_durations(effectifs, state_mm, DAY)
+    p_moves = population_builder.get_p_moves(current_state_ids.shape[0], pdict['avg_p_move'])
+    durations = population_builder.get_durations(effectifs, state_mm)
+
+    round_params = {'attractivities': attractivities, 'unsafeties': unsafeties,
+                    'unique_contagiousities': unique_contagiousities, 'unique_severities': unique_severities,
+                    'p_moves': p_moves, 'current_state_ids': current_state_ids,
+                    'current_state_durations': current_state_durations, 'durations': durations}
+    return round_params
+
+
+def build_parameters(current_period=0, verbose=0, pdict=None):
+    if pdict is None:
+        pdict = get_random_parameters()
+    state_mm = get_state_mm(pdict)
+
+    # vectors
+    cell_ids = np.arange(0, N_CELLS).astype(np.uint32)
     cell_positions = get_cell_positions(N_CELLS, pcmove['n_squares_axis'], pdict['density_factor'])
     xcoords = cell_positions[:,0]
     ycoords = cell_positions[:,1]
     unique_state_ids = np.arange(0, len(states)).astype(np.uint32)
-    unique_contagiousities = np.array([0, 0, pdict['contagiousity_asympcont'], pdict['contagiousity_infected'], pdict['contagiousity_hosp'], pdict['contagiousity_icu'], 0, pdict['contagiousity_recovercont'], 0])
     unique_sensitivities = np.array([1, 0, 0, 0, 0, 0, 0, 0, 0])
-    unique_severities = np.array([0, 0, 0, pdict['severity_infected'], 1, 1, 1, pdict['severity_recovercont'], 0])
-    transitions = get_transitions(split_pop)
-    current_state_ids, current_state_durations = get_current_state_durations(split_pop, state_mm, DAY)
-    n_agents_generated = current_state_ids.shape[0]
-    agent_ids = np.arange(0, n_agents_generated).astype(np.uint32)
-    home_cell_ids = np.random.choice(np.arange(0, N_HOME_CELLS), size=n_agents_generated).astype(np.uint32)
-    p_moves = get_p_moves(n_agents_generated, pdict['avg_p_move'])
-    least_state_ids = np.ones(n_agents_generated)  # least severe state is state 1 for all agents
-
-    durations = get_durations(split_pop, state_mm)
-    transitions_ids = get_transitions_ids(split_pop)
     dscale = pdict['dscale']
+    # agent_ids, home_cell_ids, p_moves, least_state_ids, current_state_ids, current_state_durations,
+    # durations, transitions and transitions_ids
+    agent_params = population_builder.build(N_AGENTS, state_mm, DAY, N_HOME_CELLS, pdict['avg_p_move'])
 
-
-    array_params = {'cell_ids': cell_ids, 'attractivities': attractivities, 'unsafeties': unsafeties,
-                    'xcoords': xcoords, 'ycoords': ycoords, 'unique_state_ids': unique_state_ids,
-                    'unique_contagiousities': unique_contagiousities, 'unique_sensitivities': unique_sensitivities,
-                    'unique_severities': unique_severities, 'transitions': transitions, 'agent_ids': agent_ids,
-                    'home_cell_ids': home_cell_ids, 'p_moves': p_moves, 'least_state_ids': least_state_ids,
-                    'current_state_ids': current_state_ids, 'current_state_durations': current_state_durations,
-                    'durations': durations, 'transitions_ids': transitions_ids, 'dscale': dscale,
-                    'current_period': current_period, 'verbose': verbose}
+    array_params = {'cell_ids': cell_ids, 'xcoords': xcoords, 'ycoords': ycoords,
+                    'unique_state_ids': unique_state_ids, 'unique_sensitivities': unique_sensitivities,
+                    'dscale': dscale, 'current_period': current_period, 'verbose': verbose}
+    array_params.update(agent_params)
+    array_params.update(build_round_parameters(pdict))
 
     return array_params, pdict
 
@@ -119,15 +157,17 @@ def run_calibration(n_rounds, current_period=0, verbose=0):
     for i in range(n_rounds):
         if i%10 == 0:
             print(f'round {i}...')
-        evaluations = []
-        array_params, pdict = build_parameters(current_period, verbose)
-        map.from_arrays(**array_params)
-        for _ in range(N_PERIODS):
-            for _ in range(pdict['n_moves_per_period']):
-                map.make_move()
-            map.forward_all_cells()
-            state_ids, state_numbers = map.get_states_numbers()
-            evaluations.append((state_ids, state_numbers))
+        if i == 0:
+            array_params, pdict = build_parameters(current_period, verbose)
+            map.from_arrays(**array_params)
+        else:
+            # only the parameters drawn for this round change, the map is re-used
+            pdict = get_random_parameters()
+            round_params = build_round_parameters(pdict)
+            array_params.update(round_params)
+            map.reset(**round_params)
+        records = map.run(N_PERIODS, pdict['n_moves_per_period'])
+        evaluations = [(records['state_ids'], state_numbers) for state_numbers in records['states']]
         score = evaluate(evaluations, DAY, N_PERIODS)
 
 
@@ -141,4 +181,46 @@ def run_calibration(n_rounds, current_period=0, verbose=0):
             map.save(os.path.join('maps', 'week1'))
 
 
-run_calibration(n_rounds=1000)
\ No newline at end of file
+def build_candidate(seed, pdict=None):
+    """ `build_parameters` for the workers of `CalibrationEngine` """
+    population_builder.rng = np.random.default_rng(seed)
+    return build_parameters(pdict=pdict)
+
+
+def run_parallel_calibration(n_candidates, n_workers=None, max_worker_memory=None, optimizer=None):
+    """ `optimizer`: see `calibration.Optimizer`, e.g. `TPEOptimizer(SEARCH_SPACE, complete_parameters)`.
+    Parameters are drawn with `get_random_parameters` if None """
+    engine = CalibrationEngine(build_candidate, DAY, N_PERIODS, n_workers=n_workers, max_worker_memory=max_worker_memory)
+    best_score = None
+    n_done = 0
+
+    def save_if_best(res):
+        nonlocal best_score, n_done
+        n_done += 1
+        if n_done % 10 == 0:
+            print(f'{n_done} candidates evaluated...')
+        if res['status'] != 'complete' or (best_score is not None and res['score'] > best_score):
+            return
+        # the map can be rebuilt from `seed` with `build_candidate`
+        fpath = os.path.join(CALIBRATION_DIR, f"{res['seed']}.npy")
+        print(f"New best score found: {res['score']}, saved under {fpath}")
+        print(f"corresponding pdict:\n{res['pdict']}")
+        best_score = res['score']
+        np.save(fpath, res)
+
+    results = engine.run(n_candidates, callback=save_if_best, optimizer=optimizer)
+    print(f"candidates by status: {dict(Counter(res['status'] for res in results))}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='calibration of the simulation on the real cases. By default, random '
+                                                 'parameters evaluated one after the other on a single map')
+    parser.add_argument('--parallel', action='store_true', help='evaluate the candidates on a pool of worker processes, '
+                        'proposed by a TPE optimizer, and save the best ones by seed (see `run_parallel_calibration`)')
+    parser.add_argument('--workers', type=int, help='number of worker processes with --parallel (default: number of cores)')
+    args = parser.parse_args()
+    if args.parallel:
+        run_parallel_calibration(n_candidates=1000, n_workers=args.workers, optimizer=TPEOptimizer(SEARCH_SPACE, complete_parameters))
+    else:
+        run_calibration(n_rounds=1000)
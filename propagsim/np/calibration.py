@@ -0,0 +1,251 @@
+import numpy as np
+import multiprocessing as mp
+import abc, resource, queue
+from scipy.special import logsumexp
+from classes import Map
+from simulation import DATA_DIR, get_real_cases, get_period_errors
+
+
+# State of each worker process of `CalibrationEngine`, set by `init_worker`
+worker = {}
+
+
+def init_worker(best_score, rung_scores, lock, max_worker_memory):
+    """ `best_score`, `rung_scores` and `lock` are shared between all workers (see `CalibrationEngine.run`) """
+    if max_worker_memory is not None:
+        # bound the address space of the worker: a too big candidate raises a MemoryError instead of swapping
+        resource.setrlimit(resource.RLIMIT_AS, (max_worker_memory, max_worker_memory))
+    worker['best_score'] = best_score
+    worker['rung_scores'] = rung_scores
+    worker['lock'] = lock
+    worker['map'] = Map()
+
+
+def is_promoted(rung, partial_score, eta):
+    """ successive halving: a candidate reaching `rung` (number of periods simulated) goes on only if its partial
+    score is in the best `1 / eta` of the ones of all candidates that reached this rung so far """
+    if rung not in worker['rung_scores']:
+        return True
+    scores, n_scores = worker['rung_scores'][rung]
+    with worker['lock']:
+        scores[n_scores.value] = partial_score
+        n_scores.value += 1
+        rung_scores = np.array(scores[:n_scores.value])
+    if rung_scores.shape[0] < eta:
+        return True
+    return partial_score <= np.quantile(rung_scores, 1 / eta)
+
+
+def evaluate_candidate(args):
+    """ Simulate one candidate in a worker, scoring it against the real cases after each period.
+    returns a dict with its `seed`, `pdict`, `score` (mean error in % over periods and states, inf if not complete),
+    `errors` (one row per simulated period) and `status`: 'complete', 'pruned' or 'memory_error' """
+    build_parameters, seed, pdict, real_cases, states_eval, scale, eta = args
+    n_periods = real_cases.shape[0]
+    res = {'seed': seed, 'pdict': pdict, 'score': np.inf, 'errors': np.zeros((0, len(states_eval))), 'status': 'complete'}
+    np.random.seed(seed)
+    try:
+        array_params, pdict = build_parameters(seed, pdict)
+        res['pdict'] = pdict
+        map = worker['map']
+        map.from_arrays(**array_params)
+        errors = np.empty((n_periods, len(states_eval)))
+
+        def score_period(map, prd, records):
+            """ stops the simulation if the candidate is pruned """
+            errors[prd] = get_period_errors(records['state_ids'], records['states'][prd], real_cases[prd], states_eval, scale)
+            res['errors'] = errors[:prd+1]
+            if prd + 1 == n_periods:
+                return False
+            # the score is a mean over all periods: the errors of the periods so far give a lower bound of it
+            lower_bound = errors[:prd+1].mean(axis=1).sum() / n_periods
+            if lower_bound > worker['best_score'].value or not is_promoted(prd + 1, errors[:prd+1].mean(), eta):
+                res['status'] = 'pruned'
+                return True
+            return False
+        map.run(n_periods, pdict['n_moves_per_period'], callbacks=[score_period])
+        if res['status'] == 'pruned':
+            return res
+        res['score'] = errors.mean()
+        with worker['lock']:
+            if res['score'] < worker['best_score'].value:
+                worker['best_score'].value = res['score']
+    except MemoryError:
+        res['status'] = 'memory_error'
+        worker['map'] = Map()  # release what could be allocated
+    return res
+
+
+class CalibrationEngine:
+    def __init__(self, build_parameters, day, n_periods, n_workers=None, max_worker_memory=None, eta=3, rungs=None,
+                 states_eval=('hosp', 'icu'), scale=100, maxtasksperchild=None, data_dir=DATA_DIR):
+        """ Evaluates calibration candidates concurrently in a process pool and stops the hopeless ones early.
+        `build_parameters(seed, pdict)`: picklable function returning `(array_params, pdict)` for one candidate,
+        `array_params` being the arguments of `Map.from_arrays`. The input `pdict` is the one proposed by the
+        optimizer given to `run`, or None (the function then draws it). Numpy's global random state is seeded
+        with `seed` before the call, other generators (e.g. `PopulationBuilder.rng`) must be seeded by the
+        function itself. The returned `pdict` must contain `n_moves_per_period`.
+        `max_worker_memory`: maximum address space in bytes of each worker, candidates exceeding it are reported
+        with status 'memory_error'
+        `eta`, `rungs`: successive halving parameters. After the number of periods of each rung, only the best
+        `1 / eta` of the candidates having reached it go on. Defaults to `n_periods // eta`, `n_periods // eta ** 2`...
+        (at least 2 periods)
+        `scale`: factor from the number of agents in the map to the real population
+        """
+        self.build_parameters = build_parameters
+        self.n_workers = n_workers if n_workers is not None else mp.cpu_count()
+        self.max_worker_memory = max_worker_memory
+        self.eta = eta
+        if rungs is None:
+            rungs, k = [], 1
+            while n_periods // eta ** k >= 2:
+                rungs.append(n_periods // eta ** k)
+                k += 1
+        self.rungs = sorted(rungs)
+        self.states_eval = tuple(states_eval)
+        self.scale = scale
+        self.maxtasksperchild = maxtasksperchild
+        self.real_cases = get_real_cases(day, n_periods, self.states_eval, data_dir)
+
+    def run(self, n_candidates, seed=None, callback=None, optimizer=None):
+        """ evaluate `n_candidates` candidates, `callback(res)` is called in the main process as soon as each one
+        is done. If an `optimizer` is given, candidates are asked to it by batches filling the idle workers and
+        each score is told to it as soon as it is known. returns the results of `evaluate_candidate` sorted by score """
+        seeds = np.random.SeedSequence(seed).generate_state(n_candidates)
+        ctx = mp.get_context()
+        lock = ctx.Lock()
+        best_score = ctx.Value('d', np.inf, lock=False)
+        rung_scores = {rung: (ctx.Array('d', n_candidates, lock=False), ctx.Value('i', 0, lock=False)) for rung in self.rungs}
+        initargs = (best_score, rung_scores, lock, self.max_worker_memory)
+        results = []
+        done = queue.Queue()
+        n_submitted, n_running = 0, 0
+        with ctx.Pool(self.n_workers, initializer=init_worker, initargs=initargs, maxtasksperchild=self.maxtasksperchild) as pool:
+            while len(results) < n_candidates:
+                n_to_submit = min(self.n_workers - n_running, n_candidates - n_submitted)
+                if n_to_submit > 0:
+                    pdicts = optimizer.ask(n_to_submit) if optimizer is not None else [None] * n_to_submit
+                    for pdict in pdicts:
+                        task = (self.build_parameters, int(seeds[n_submitted]), pdict, self.real_cases, self.states_eval,
+                                self.scale, self.eta)
+                        pool.apply_async(evaluate_candidate, (task,), callback=done.put, error_callback=done.put)
+                        n_submitted += 1
+                        n_running += 1
+                res = done.get()
+                n_running -= 1
+                if isinstance(res, BaseException):
+                    raise res
+                results.append(res)
+                if optimizer is not None and res['pdict'] is not None:
+                    optimizer.tell(res['pdict'], res['score'])
+                if callback is not None:
+                    callback(res)
+        return sorted(results, key=lambda res: res['score'])
+
+
+class Optimizer(abc.ABC):
+    def __init__(self, space, postprocess=None, seed=None):
+        """ Proposes the next candidates (`pdict`) of a calibration from the scores of the previous ones.
+        `space`: parameter name -> `(low, high)` for a float drawn in [low, high], `(low, high, int)` for an integer,
+        any other value is a fixed parameter
+        `postprocess(pdict)`: returns the complete `pdict` of a candidate from the searched and fixed parameters
+        (e.g. to add parameters depending on others). It must keep the searched parameters.
+        Sub-classes implement `propose`, all points are normalized in the unit hypercube """
+        self.space = space
+        self.postprocess = postprocess
+        self.rng = np.random.default_rng(seed)
+        self.names = [name for name, value in space.items() if isinstance(value, tuple)]
+        self.lows = np.array([space[name][0] for name in self.names], dtype=np.float64)
+        self.highs = np.array([space[name][1] for name in self.names], dtype=np.float64)
+        self.is_int = np.array([len(space[name]) > 2 and space[name][2] is int for name in self.names])
+        self.X, self.y = [], []
+
+    def to_pdict(self, x):
+        values = self.lows + x * (self.highs - self.lows)
+        pdict = {name: value for name, value in self.space.items() if not isinstance(value, tuple)}
+        for name, value, is_int in zip(self.names, values, self.is_int):
+            pdict[name] = int(np.around(value)) if is_int else float(value)
+        if self.postprocess is not None:
+            pdict = self.postprocess(pdict)
+        return pdict
+
+    def to_vector(self, pdict):
+        values = np.array([pdict[name] for name in self.names], dtype=np.float64)
+        return (values - self.lows) / (self.highs - self.lows)
+
+    def ask(self, n=1):
+        """ `n` candidates to evaluate concurrently. The ones not evaluated yet are considered as bad as the worst
+        evaluated one ("constant liar") so that the candidates of a batch are different """
+        X, y = list(self.X), list(self.y)
+        pdicts = []
+        for _ in range(n):
+            x = self.propose(np.array(X).reshape(-1, len(self.names)), np.array(y))
+            X.append(x)
+            y.append(np.max(y) if len(y) > 0 else np.inf)
+            pdicts.append(self.to_pdict(x))
+        return pdicts
+
+    def tell(self, pdict, score):
+        """ record the `score` of a candidate (`np.inf` if not completed, it then counts as the worst) """
+        self.X.append(self.to_vector(pdict))
+        self.y.append(score)
+
+    @abc.abstractmethod
+    def propose(self, X, y):
+        """ next point to evaluate given the points `X` (one row per point) and their scores `y` """
+
+
+class RandomSearch(Optimizer):
+    def propose(self, X, y):
+        return self.rng.uniform(size=len(self.names))
+
+
+class TPEOptimizer(Optimizer):
+    def __init__(self, space, postprocess=None, seed=None, gamma=.25, n_startup=10, n_ei_candidates=24):
+        """ Tree-structured Parzen Estimator: the evaluated points are split between the best `gamma` fraction
+        ("good") and the others ("bad"), each group modeled by a Parzen (gaussian kernels) density. Among
+        `n_ei_candidates` points drawn from the good density, the one maximizing good / bad density is proposed.
+        The first `n_startup` points are drawn uniformly """
+        super().__init__(space, postprocess, seed)
+        self.gamma = gamma
+        self.n_startup = n_startup
+        self.n_ei_candidates = n_ei_candidates
+
+    def get_bandwidths(self, points):
+        n, d = points.shape
+        if n < 2:
+            return np.full(d, .25)
+        # at least one step for integer parameters, otherwise the kernels of identical points never move
+        min_bandwidths = np.where(self.is_int, 1 / np.maximum(self.highs - self.lows, 1), 0)
+        return np.clip(points.std(axis=0) * n ** (-1 / (d + 4)), np.maximum(min_bandwidths, .1), .5)
+
+    def sample_parzen(self, points, n):
+        """ draw `n` points from the Parzen density of `points` (with a uniform prior component) """
+        d = points.shape[1]
+        components = self.rng.integers(0, points.shape[0] + 1, size=n)
+        from_prior = (components == points.shape[0])
+        samples = self.rng.uniform(size=(n, d))
+        centers = points[components[~from_prior]]
+        samples[~from_prior] = centers + self.rng.standard_normal(size=centers.shape) * self.get_bandwidths(points)
+        # reflect on the bounds rather than clipping, not to pile up points on them
+        samples = 1 - np.abs(1 - np.abs(samples))
+        return np.clip(samples, 0, 1)
+
+    def log_parzen(self, x, points):
+        """ log density in `x` of the Parzen estimator of `points` (mixture of gaussians and a uniform prior) """
+        bandwidths = self.get_bandwidths(points)
+        z = (x[:, None, :] - points[None, :, :]) / bandwidths
+        log_kernels = -.5 * (z ** 2).sum(axis=2) - np.log(bandwidths * np.sqrt(2 * np.pi)).sum()
+        log_kernels = np.hstack([log_kernels, np.zeros((x.shape[0], 1))])  # uniform prior has density 1
+        return logsumexp(log_kernels, axis=1) - np.log(points.shape[0] + 1)
+
+    def propose(self, X, y):
+        n = X.shape[0]
+        if n < self.n_startup:
+            return self.rng.uniform(size=len(self.names))
+        order = np.argsort(y, kind='stable')
+        n_good = max(1, int(np.ceil(self.gamma * n)))
+        good, bad = X[order[:n_good]], X[order[n_good:]]
+        candidates = self.sample_parzen(good, self.n_ei_candidates)
+        scores = self.log_parzen(candidates, good) - self.log_parzen(candidates, bad)
+        return candidates[np.argmax(scores)]
@@ -1,8 +1,76 @@
 import numpy as np
-import os, pickle
-from utils import get_least_severe_state, squarify, get_square_sampling_probas, get_cell_sampling_probas, vectorized_choice, group_max, get_ind_in_arr
-from utils import get_least_severe_state, squarify, get_square_sampling_probas, get_cell_sampling_probas, vectorized_choice, group_max
-from time import time
+import os, pickle, inspect
+from utils import get_least_severe_state, squarify, get_square_sampling_probas, get_cell_sampling_probas, vectorized_choice
+from utils import get_square_tree
+from utils import group_starts, group_counts, group_argmax, get_ind_in_arr, pack_bits, get_bit_positions, get_bits
+from utils import get_bernoulli_successes
+from profiling import profiled
+from backends import get_backend
+from workspace import Workspace
+
+
+# Random streams of the subsystems of a `Map`, see `Map.set_random_streams`
+RANDOM_STREAMS = ('move', 'contamination', 'transition', 'mask', 'policy', 'testing')
+# Step of `forward_all_cells` in the counters of the random streams, the moves of a period being steps 0, 1, 2...
+END_OF_PERIOD_STEP = np.iinfo(np.uint64).max
+# Arrays of probabilities, stored in fixed-point in the quantized mode (see `Map.from_arrays`), with the
+# cumulated sampling probabilities
+PROBABILITY_ARRAYS = ('unsafeties', 'unique_contagiousities', 'unique_sensitivities', 'p_moves')
+# Arguments of `Map.from_arrays` with one value by cell or by agent, flattened as they may come as columns
+VECTOR_PARAMETERS = ('cell_ids', 'attractivities', 'unsafeties', 'xcoords', 'ycoords', 'agent_ids', 'home_cell_ids', 'p_moves',
+                     'least_state_ids', 'current_state_ids', 'current_state_durations', 'transitions_ids')
+# Unsigned integer type of the fixed-point probabilities by number of bits, and the one of their products
+PROBABILITY_DTYPES = {16: (np.uint16, np.uint32), 32: (np.uint32, np.uint64)}
+# Traced agents (see `Map.change_state_agents`) move this times less
+TRACED_P_MOVE_DIVISOR = 5
+# Isolation of the agents testing positive (and of the traced ones with `isolate_traced`), see `Map.set_testing`
+ISOLATION_DURATION = 14
+# Immunity levels of the agents (see `Map.set_immunity`) are stored as integers up to this one (1: full protection)
+MAX_IMMUNITY = 255
+# Agents are bucketed by the power of 2 bounding their p_move, from 1 to 2 ** -(N_MOVE_BUCKETS - 1) (see `Map.select_movers`)
+N_MOVE_BUCKETS = 24
+# The moving agents are selected by bucket when the expected number of candidates is below this share of the agents
+MAX_MOVE_CANDIDATES = .1
+# How the squares where the agents move are sampled, see `Map.from_arrays`
+SQUARE_SAMPLINGS = ('matrix', 'tree')
+# Adaptive grid (see `Map.from_arrays`): a square is split in 4 or merged with its neighbours at most this number of times
+SQUARE_MAX_SPLITS = 4
+SQUARE_MAX_MERGES = 4
+# Movers sent to a full cell are sent to another one at most this number of times, see `Map.fit_capacities`
+CAPACITY_RESAMPLINGS = 3
+# Attributes of the sampling structures of the moves, depending on the attractivities: computed once by profile
+# of attractivities and switched between the moves, see `Map.set_attractivity_profiles`
+SAMPLING_ATTRIBUTES = ('attractivities', 'square_sampling_probas', 'eligible_cells', 'cell_sampling_probas', 'cell_index_shift',
+                       'cell_counts', 'order_eligible_cells', 'square_tree_children', 'square_tree_attractivities',
+                       'square_tree_bounds', 'square_tree_root', 'square_tree_depth', 'class_structures')
+# Parameters of the mobility classes and attributes of their sampling structures, see `Map.set_mobility_classes`
+CLASS_PARAMETERS = ('mobility_class_ids', 'class_dscales', 'class_attractivity_weights')
+CLASS_ATTRIBUTES = SAMPLING_ATTRIBUTES[:-1] + ('dscale',)
+# Where the moving agents move from, see `Map.set_move_mode`
+MOVE_MODES = ('home', 'current', 'return')
+# What `Map.run` can record for each period
+RUN_RECORDS = ('states', 'new_states')
+# Arrays of a `Map` stored with its backend (the others stay in numpy), see `Map.set_backend`
+BACKEND_ARRAYS = ('unsafeties', 'unique_state_ids', 'unique_contagiousities', 'unique_sensitivities', 'unique_severities', 'unique_mobilities',
+                  'transition_rows', 'agent_ids', 'home_cell_ids', 'p_moves', 'least_state_ids', 'current_state_ids',
+                  'current_state_durations', 'durations', 'transitions_ids', 'agent_squares', 'square_sampling_probas',
+                  'eligible_cells', 'cell_sampling_probas', 'cell_index_shift', 'cell_counts', 'order_eligible_cells',
+                  'initial_current_state_ids', 'initial_current_state_durations', 'infecting_agents', 'infected_agents',
+                  'infected_periods', 'contagious_flags', 'sensitive_flags', 'traced_flags',
+                  'move_bucket_agents', 'move_bucket_factors', 'square_positions', 'square_tree_children',
+                  'square_tree_attractivities', 'square_tree_bounds', 'cell_squares', 'current_cell_ids', 'current_square_ids',
+                  'cell_occupancy', 'away_agents', 'cell_capacities', 'mobility_class_ids',
+                  'isolated_flags', 'isolated_agents', 'isolation_ends', 'unique_test_weights', 'demography_test_weights',
+                  'unique_detectable', 'immunities', 'immunity_periods')
+# Arrays persisted by `Map.save`
+SAVED_ARRAYS = ('unique_state_ids', 'unique_contagiousities', 'unique_sensitivities', 'unique_severities', 'cell_ids',
+                'unsafeties', 'attractivities', 'square_sampling_probas', 'eligible_cells', 'coords_squares',
+                'square_ids_cells', 'cell_sampling_probas', 'cell_index_shift', 'order_eligible_cells', 'agent_ids',
+                'p_moves', 'least_state_ids', 'home_cell_ids', 'current_state_ids', 'current_state_durations',
+                'agent_squares', 'transitions', 'transitions_ids', 'durations', 'r_factors', 'infecting_agents',
+                'infected_agents', 'infected_periods', 'traced_flags', 'cell_capacities', 'attractivity_profiles',
+                'profile_schedule', 'mobility_class_ids', 'class_dscales', 'class_attractivity_weights', 'isolated_agents',
+                'isolation_ends', 'immunities', 'immunity_periods')
 
 
 class State:
@@ -153,7 +221,11 @@ class Cell:
 
        
 class Map:
-    def __init__(self, cells=None, agents=None, possible_states=None, dscale=1, current_period=0, verbose=0):
+    profiler = None  # see `set_profiler`
+    executor = None  # see `set_executor`
+    workspace = None  # see `set_workspace`
+
+    def __init__(self, cells=None, agents=None, possible_states=None, dscale=1, current_period=0, verbose=0, backend='numpy'):
         """ A map contains a list of `cells`, `agents` and an implementation of the 
         way agents can move from a cell to another. `possible_states` must be distinct.
         We let each the possibility for each agent to have its own least severe state to make the model more flexible.
@@ -162,137 +234,112 @@ class Map:
         """
         if cells is None or agents is None or possible_states is None:
             return
-        self.current_period = current_period
-        self.verbose = verbose
-        self.dscale = dscale
-        self.n_infected_period = 0
-        
 
-        self.unique_state_ids, self.unique_contagiousities, self.unique_sensitivities, self.unique_severities = [], [], [], []
+        unique_state_ids, unique_contagiousities, unique_sensitivities, unique_severities = [], [], [], []
         for state in possible_states:
-            self.unique_state_ids.append(state.get_id())
-            self.unique_contagiousities.append(state.get_contagiousity())
-            self.unique_sensitivities.append(state.get_sensitivity())
-            self.unique_severities.append(state.get_severity())
-        self.unique_state_ids = np.array(self.unique_state_ids, dtype=np.uint8)
-        self.unique_contagiousities = np.array(self.unique_contagiousities, dtype=np.float32)
-        self.unique_sensitivities = np.array(self.unique_sensitivities, dtype=np.float32)
-        self.unique_severities = np.array(self.unique_severities, dtype=np.float32)
-
-        self.cell_ids, self.attractivities, xcoords, ycoords, self.unsafeties = [], [], [], [], []
+            unique_state_ids.append(state.get_id())
+            unique_contagiousities.append(state.get_contagiousity())
+            unique_sensitivities.append(state.get_sensitivity())
+            unique_severities.append(state.get_severity())
+
+        cell_ids, attractivities, xcoords, ycoords, unsafeties = [], [], [], [], []
         for cell in cells:
-            self.cell_ids.append(cell.get_id())
+            cell_ids.append(cell.get_id())
             coords = cell.get_position()
             xcoords.append(coords[0])
             ycoords.append(coords[1])
-            self.attractivities.append(cell.get_attractivity())
-            self.unsafeties.append(cell.get_unsafety())
+            attractivities.append(cell.get_attractivity())
+            unsafeties.append(cell.get_unsafety())
 
-        self.cell_ids = np.array(self.cell_ids, dtype=np.uint32)
-        xcoords, ycoords = np.array(xcoords, dtype=np.float32), np.array(ycoords, dtype=np.float32)
-        self.attractivities = np.array(self.attractivities, dtype=np.float32)
-        self.unsafeties = np.array(self.unsafeties, dtype=np.float32)
-        # Compute inter-squares proba transition matrix
-        self.coords_squares, self.square_ids_cells = squarify(xcoords, ycoords)
-        self.set_attractivities(self.attractivities)
-        # Process agent
-        self.agent_ids = []
-        self.p_moves = []
-        self.least_state_ids = []
-        self.unique_state_ids = []
-        self.home_cell_ids = []
-        self.current_state_ids = []
-        self.current_state_durations = []
-        self.transitions = []
-        self.transitions_ids = []
-        self.durations = []
-        
+        agent_ids, p_moves, least_state_ids, home_cell_ids = [], [], [], []
+        current_state_ids, current_state_durations, transitions, transitions_ids, durations = [], [], [], [], []
         for agent in agents:
-            self.agent_ids.append(agent.get_id())
-            self.p_moves.append(agent.get_p_move())
-            least_state_id = agent.get_least_state_id()
-            self.least_state_ids.append(least_state_id)
-            self.home_cell_ids.append(agent.get_home_cell_id())
-            self.current_state_ids.append(agent.get_current_state_id())
-            self.current_state_durations.append(agent.get_current_state_duration())
-            transitions_id = agent.get_transitions_id()
-            self.transitions_ids.append(transitions_id)
-            self.transitions.append(agent.get_transitions_arr())
-            self.durations.append(np.array(agent.get_durations(), dtype=np.float32))
-
-        self.agent_ids = np.array(self.agent_ids, dtype=np.float32)
-        self.p_moves = np.array(self.p_moves, dtype=np.float32)
-        self.least_state_ids = np.array(self.least_state_ids, dtype=np.uint8)
-        self.home_cell_ids = np.array(self.home_cell_ids, dtype=np.uint32)
-        self.current_state_ids = np.array(self.current_state_ids, dtype=np.uint8)  # no more than 255 possible states
-        self.current_state_durations = np.array(self.current_state_durations, dtype=np.float32)
-        self.transitions_ids = np.array(self.transitions_ids, dtype=np.uint8)  # no more than 255 possible transitions
-        # the first cells in parameter `cells`must be home cell, otherwise modify here
-        self.agent_squares = self.square_ids_cells[self.home_cell_ids]  
-        # Re-order transitions by ids
-        order = np.argsort(self.transitions_ids)
-        self.transitions_ids = self.transitions_ids[order]
-        self.transitions = np.dstack(self.transitions)
-        self.transitions = self.transitions[:,:, order]
-        # Compute upfront cumulated sum
-        self.transitions = np.cumsum(self.transitions, axis=1)
-
-        self.durations = np.vstack(self.durations)
-        self.durations = self.durations[order]
-        self.agent_ids = self.agent_ids[order]
-
-        # Compute probas_move for agent selection
-        # Define variable for monitoring the propagation (r factor, contagion chain)
-        self.n_contaminated_period = 0  # number of agent contaminated during current period
-        self.n_diseased_period = self.get_n_diseased()
-        self.r_factors = np.array([])
-        # TODO: Contagion chains
-        # Define arrays for agents state transitions
-        self.infecting_agents, self.infected_agents, self.infected_periods = np.array([]), np.array([]), np.array([])
-
-        
-
-
+            agent_ids.append(agent.get_id())
+            p_moves.append(agent.get_p_move())
+            least_state_ids.append(agent.get_least_state_id())
+            home_cell_ids.append(agent.get_home_cell_id())
+            current_state_ids.append(agent.get_current_state_id())
+            current_state_durations.append(agent.get_current_state_duration())
+            transitions_ids.append(agent.get_transitions_id())
+            transitions.append(agent.get_transitions_arr())
+            durations.append(np.array(agent.get_durations(), dtype=np.float32))
+
+        # Keep one transition matrix by transitions id, re-numbered 0, 1, 2... in the order of the ids
+        transitions_ids = np.array(transitions_ids, dtype=np.uint8)  # no more than 255 possible transitions
+        unique_transitions_ids, inds_first = np.unique(transitions_ids, return_index=True)
+        transitions = np.dstack([transitions[ind] for ind in inds_first])
+        transitions_ids = np.searchsorted(unique_transitions_ids, transitions_ids).astype(np.uint8)
+
+        # the first cells in parameter `cells`must be home cell
+        self.from_arrays(cell_ids=np.array(cell_ids, dtype=np.uint32),
+                         attractivities=np.array(attractivities, dtype=np.float32),
+                         unsafeties=np.array(unsafeties, dtype=np.float32),
+                         xcoords=np.array(xcoords, dtype=np.float32),
+                         ycoords=np.array(ycoords, dtype=np.float32),
+                         unique_state_ids=np.array(unique_state_ids, dtype=np.uint8),
+                         unique_contagiousities=np.array(unique_contagiousities, dtype=np.float32),
+                         unique_sensitivities=np.array(unique_sensitivities, dtype=np.float32),
+                         unique_severities=np.array(unique_severities, dtype=np.float32),
+                         transitions=transitions,
+                         agent_ids=np.array(agent_ids, dtype=np.uint32),
+                         home_cell_ids=np.array(home_cell_ids, dtype=np.uint32),
+                         p_moves=np.array(p_moves, dtype=np.float32),
+                         least_state_ids=np.array(least_state_ids, dtype=np.uint8),
+                         current_state_ids=np.array(current_state_ids, dtype=np.uint8),  # no more than 255 possible states
+                         current_state_durations=np.array(current_state_durations, dtype=np.float32),
+                         durations=np.vstack(durations),
+                         transitions_ids=transitions_ids,
+                         dscale=dscale, current_period=current_period, verbose=verbose, backend=backend)
+
+
+    @profiled
     def contaminate(self, selected_agents, selected_cells, prop_cont_factor=10, p_mask=0, family=False):
         """ both arguments have same length. If an agent with sensitivity > 0 is in the same cell 
         than an agent with contagiousity > 0: possibility of contagion
         prop_cont_factor: influence of the proportion of contagious people in a cell on contagion risk"""
-
-        t0 = time()
-        order_cells = np.argsort(selected_cells, kind='heapsort')
-        selected_cells = np.sort(selected_cells, kind='heapsort').astype(np.uint32)
-        # Sort other datas
-        selected_unsafeties = self.unsafeties[selected_cells]
-        selected_agents = selected_agents[order_cells].astype(np.uint32)
-        selected_states = self.current_state_ids[selected_agents]
-        selected_contagiousities = self.unique_contagiousities[selected_states]
+        xp = self.xp
+        if selected_agents.shape[0] == 0:
+            return
+        order_cells = self.backend.counting_sort(selected_cells, self.unsafeties.shape[0])
+        selected_cells = self.take(selected_cells, order_cells, out='sorted_cells')
+        selected_agents = self.take(selected_agents, order_cells, out='sorted_agents')
+        # Flags of the agents, from their packed bits (see `init_flags`)
+        positions = get_bit_positions(selected_agents, xp)
+        contagious = get_bits(self.contagious_flags, positions, xp)
+        if self.any_isolated:
+            # isolated agents don't infect anybody, at home neither
+            contagious = contagious & ~get_bits(self.isolated_flags, positions, xp)
         if p_mask > 0:
-            pos_contagiousities = np.where(selected_contagiousities > 0)[0]
+            pos_contagiousities = xp.nonzero(contagious)[0]
             n_switchoff = int(pos_contagiousities.shape[0] * p_mask)
-            to_switchoff = np.random.choice(pos_contagiousities, size=n_switchoff, replace=False)
-            selected_contagiousities[to_switchoff] = 0
-
-        selected_sensitivities = self.unique_sensitivities[selected_states]
-        # Find cells where max contagiousity == 0 (no contagiousity can happen there)
-        max_contagiousities, _ = group_max(data=selected_contagiousities, groups=selected_cells)
+            to_switchoff = self.rngs['mask'].choice(pos_contagiousities.shape[0], size=n_switchoff, replace=False)
+            to_switchoff = xp.take(pos_contagiousities, self.asarray(to_switchoff, dtype=np.int64))
+            contagious = self.backend.put(contagious, to_switchoff, False)
+        sensitive = get_bits(self.sensitive_flags, positions, xp)
+
+        starts = group_starts(selected_cells, xp)
+        # Find cells without contagious agent or without sensitive agent (no contagiousity can happen there)
+        any_contagious = self.backend.segment_max(xp.astype(contagious, xp.uint8), starts) > 0
         if self.verbose > 1:
-            print(f'{max_contagiousities[max_contagiousities > 0].shape[0]} cells with contagious agent(s)')
-        # Find cells where max sensitivitity == 0 (no contagiousity can happen there)
-        max_sensitivities, _ = group_max(data=selected_sensitivities, groups=selected_cells)
+            print(f'{xp.count_nonzero(any_contagious)} cells with contagious agent(s)')
+        any_sensitive = self.backend.segment_max(xp.astype(sensitive, xp.uint8), starts) > 0
         # Combine them
-        mask_zero = ((max_contagiousities > 0) & (max_sensitivities > 0))
-        _, count = np.unique(selected_cells, return_counts=True)
-        mask_zero = np.repeat(mask_zero, count)
-        # select agents being on cells with max contagiousity and max sensitivity > 0 (and their corresponding data)
-        selected_agents = selected_agents[mask_zero]
-        selected_contagiousities = selected_contagiousities[mask_zero]
-        selected_sensitivities = selected_sensitivities[mask_zero]
-        selected_cells = selected_cells[mask_zero]
-        selected_unsafeties = selected_unsafeties[mask_zero]
-        # Compute proportion (contagious agent) / (non contagious agent) by cell
-        _, n_contagious_by_cell = np.unique(selected_cells[selected_contagiousities > 0], return_counts=True)
-        _, n_non_contagious_by_cell = np.unique(selected_cells[selected_contagiousities == 0], return_counts=True)
-        p_contagious = np.divide(n_contagious_by_cell, n_non_contagious_by_cell)
+        mask_zero = any_contagious & any_sensitive
+        count = group_counts(starts, selected_cells.shape[0], xp)
+        if self.profiler is not None:
+            self.profiler.set(n_agents=selected_agents.shape[0], n_cells=count.shape[0])
+        mask_zero = xp.repeat(mask_zero, count)
+        # select agents being on cells with contagious and sensitive agents, and gather their data
+        selected_agents = self.compress(mask_zero, selected_agents, out='exposed_agents')
+        selected_cells = self.compress(mask_zero, selected_cells, out='exposed_cells')
+        selected_unsafeties = self.take(self.unsafeties, selected_cells, out='unsafeties')
+        selected_states = self.take(self.current_state_ids, selected_agents, out='states')
+        selected_contagiousities = self.take(self.unique_contagiousities, selected_states, out='contagiousities')
+        if p_mask > 0 or self.any_isolated:
+            # agents with a mask (or isolated) are not contagious
+            contagious = self.compress(mask_zero, contagious, out='exposed_contagious')
+            selected_contagiousities = xp.where(contagious, selected_contagiousities, xp.zeros_like(selected_contagiousities))
+        selected_sensitivities = self.take(self.unique_sensitivities, selected_states, out='sensitivities')
 
         n_selected_agents = selected_agents.shape[0]
         if self.verbose > 1:
@@ -300,132 +347,398 @@ class Map:
         if n_selected_agents == 0:
             return
         # Find for each cell which agent has the max contagiousity inside (it will be the contaminating agent)
-        max_contagiousities, mask_max_contagiousities = group_max(data=selected_contagiousities, groups=selected_cells) 
-        infecting_agents = selected_agents[mask_max_contagiousities]
-
-        selected_contagiousities = selected_contagiousities[mask_max_contagiousities]
+        starts = group_starts(selected_cells, xp)
+        max_contagiousities = self.backend.segment_max(selected_contagiousities, starts)
+        inds_max_contagiousities = group_argmax(selected_contagiousities, starts, max_contagiousities, xp)
+        infecting_agents = xp.take(selected_agents, inds_max_contagiousities)
         # Select agents that can be potentially infected ("pinfected") and corresponding variables
         pinfected_mask = (selected_sensitivities > 0)
-        pinfected_agents = selected_agents[pinfected_mask]
-        selected_sensitivities = selected_sensitivities[pinfected_mask]
-        selected_unsafeties = selected_unsafeties[pinfected_mask]
-        selected_cells = selected_cells[pinfected_mask]
+        pinfected_agents = self.compress(pinfected_mask, selected_agents, out='pinfected_agents')
+        selected_sensitivities = self.compress(pinfected_mask, selected_sensitivities, out='pinfected_sensitivities')
+        selected_unsafeties = self.compress(pinfected_mask, selected_unsafeties, out='pinfected_unsafeties')
+        selected_cells = self.compress(pinfected_mask, selected_cells, out='pinfected_cells')
 
         if self.verbose > 1:
             print(f'selected_contagiousities: {selected_contagiousities}')
             print(f'selected_sensitivities: {selected_sensitivities}')
             print(f'selected_unsafeties: {selected_unsafeties}')
         # Group `selected_cells` and expand `infecting_agents` and `selected_contagiousities` accordingly
-        # There is one and only one infecting agent by pinselected_agentsfected_cell so #`counts` == #`infecting_agents`
-        _, counts = np.unique(selected_cells, return_counts=True)
-        infecting_agents = np.repeat(infecting_agents, counts)
-        selected_contagiousities = np.repeat(selected_contagiousities, counts)
-        p_contagious = np.repeat(p_contagious, counts)
+        # There is one and only one infecting agent by pinfected cell so #`counts` == #`infecting_agents`
+        counts = group_counts(group_starts(selected_cells, xp), selected_cells.shape[0], xp)
+        infecting_agents = xp.repeat(infecting_agents, counts)
+        selected_contagiousities = xp.repeat(max_contagiousities, counts)
         # Compute contagions
-        res = np.multiply(selected_contagiousities, selected_sensitivities)
-        res = np.multiply(res, selected_unsafeties)
-        # Modifiy probas contamination according to `p_contagious`
-
-        """
-        mask_p = (p_contagious < 1)
-        res[mask_p] = np.multiply(res[mask_p], p_contagious[mask_p])
-        res[~mask_p] = 1 - np.divide(1 - res[~mask_p], p_contagious[~mask_p])
-        """
-
-        draw = np.random.uniform(size=infecting_agents.shape[0])
+        res = self.widen(selected_sensitivities, out='contamination_probas')  # the sensitivities are not used anymore
+        if self.any_immune:
+            self.multiply_probabilities(res, self.get_susceptibilities(pinfected_agents))
+        self.multiply_probabilities(res, selected_contagiousities)
+        self.multiply_probabilities(res, selected_unsafeties)
+        draw = self.draw_probabilities('contamination', infecting_agents.shape[0], out='draw_contamination')
         if family:
-            draw = np.zeros(infecting_agents.shape[0])
-
-        draw = (draw < res)
-
-        """
-        mask_p = (p_contagious < 1)
-        res[mask_p] = np.multiply(res[mask_p], p_contagious[mask_p])
-        res[~mask_p] = 1 - np.divide(1 - res[~mask_p], p_contagious[~mask_p])
-        """
+            draw = xp.zeros_like(draw)
+        draw = self.backend.elementwise('less', draw, res, out=self.buffer('is_infected', draw.shape, np.bool_))
 
         infecting_agents = infecting_agents[draw]
         infected_agents = pinfected_agents[draw]
         n_infected_agents = infected_agents.shape[0]
-        """
-        if self.verbose > 1:
-            print(f'Infecting and infected agents should be all different, are they? {((infecting_agents == infected_agents).sum() == 0)}')
-            print(f'Number of infected agents: {n_infected_agents}')
-        """
-        # self.current_state_ids[infected_agents] = self.least_state_ids[infected_agents]
-        self.current_state_ids[infected_agents] = 1
-
-        self.current_state_ids[infected_agents] = self.least_state_ids[infected_agents]
-        self.current_state_ids[infected_agents] = self.least_state_ids[infected_agents]
-        self.current_state_durations[infected_agents] = 0
+        if self.profiler is not None:
+            self.profiler.set(n_infected=n_infected_agents)
+        self.current_state_ids = self.backend.put(self.current_state_ids, infected_agents, xp.take(self.least_state_ids, infected_agents))
+        self.current_state_durations = self.backend.put(self.current_state_durations, infected_agents, 0)
+        self.refresh_flags(infected_agents)
+        if self.infection_immunity > 0:
+            self.immunize(infected_agents, self.infection_immunity)
         self.n_infected_period += n_infected_agents
-        self.infecting_agents = np.append(self.infecting_agents, infecting_agents)
-        self.infected_agents = np.append(self.infected_agents, infected_agents)
-        self.infected_periods = np.append(self.infected_periods, np.repeat([self.current_period], n_infected_agents))
+        self.infecting_agents = xp.concat([self.infecting_agents, xp.astype(infecting_agents, xp.uint32)])
+        self.infected_agents = xp.concat([self.infected_agents, xp.astype(infected_agents, xp.uint32)])
+        self.infected_periods = xp.concat([self.infected_periods, xp.full((n_infected_agents,), self.current_period, dtype=xp.int32)])
 
 
     def set_verbose(self, verbose):
         self.verbose = verbose
 
 
-    def move_agents(self, selected_agents):
-        """ First select the square where they move and then the cell inside the square """
-        selected_agents = selected_agents.astype(np.uint32)
-        agents_squares_to_move = self.agent_squares[selected_agents]
-
-        _, inverse = np.unique(agents_squares_to_move, return_inverse=True)
-        # Align `square_sampling_probas` with agents (their square)
-        square_sampling_ps = self.square_sampling_probas[inverse,:]
-        # Chose one square for each row (agent), considering each row as a sample proba
-        selected_squares = vectorized_choice(square_sampling_ps)
-        max_sq = self.square_sampling_probas.shape[1] - 1
-        selected_squares[selected_squares > max_sq] = max_sq
-        # Now select cells in the squares where the agents move
-
-        cell_sampling_ps = self.cell_sampling_probas[selected_squares,:]
-        index_shift = self.cell_index_shift[selected_squares]
-        cell_sampling_ps = cell_sampling_ps.astype(np.float16)  # float16 to avoid max memory error, precision should be enough
-        selected_cells = vectorized_choice(cell_sampling_ps)
-        # Now we have like "cell 2 in square 1, cell n in square 2 etc." we have to go back to the actual cell id
-        max_is = self.cell_index_shift.shape[0] - 1
-        selected_squares[selected_squares > max_is] = max_is
-
-        selected_cells = np.add(selected_cells, index_shift)
-        selected_cells = self.order_eligible_cells[selected_cells]
-        selected_cells = self.eligible_cells[selected_cells]
+    def set_profiler(self, profiler):
+        """ record the phases of the simulation with a `profiling.Profiler`, None to stop """
+        self.profiler = profiler
+
+
+    def set_executor(self, executor):
+        """ run the large per-agent operations by chunks on several threads with a `parallel.ChunkExecutor`
+        (numpy backend only), None to stop """
+        if executor is not None and self.backend.name != 'numpy':
+            raise ValueError(f'executors only run with the numpy backend, not {self.backend.name}')
+        self.executor = executor
+
+
+    @profiled
+    def move_agents(self, selected_agents, max_temp_bytes=None):
+        """ First select the square where they move (from their home square or current one, see `set_move_mode`)
+        and then the cell inside the square.
+        `max_temp_bytes`: bound on the size of the sampling temporaries (one row of sampling probabilities
+        by moving agent), the agents are then processed by chunks. The result doesn't depend on it """
+        xp = self.xp
+        origin_squares = self.agent_squares if self.move_mode == 'home' else self.current_square_ids
+        agents_squares_to_move = self.take(origin_squares, selected_agents, out='agent_squares')
+        n_agents = selected_agents.shape[0]
+        chunk_size = self.get_move_chunk_size(n_agents, max_temp_bytes)
+        if self.profiler is not None:
+            self.profiler.set(n_agents=n_agents, n_squares=xp.unique_values(agents_squares_to_move).shape[0],
+                              n_chunks=np.ceil(n_agents / chunk_size))
+        # Draw for all agents upfront, the same way whatever the chunks
+        if self.square_sampling == 'tree':
+            # one draw by level of the tree
+            r_squares = self.xp.reshape(self.draw('move', n_agents * self.get_square_tree_steps(), out='r_squares'), (n_agents, -1))
+        else:
+            r_squares = self.draw_probabilities('move', n_agents, out='r_squares')
+        r_cells = self.draw_probabilities('move', n_agents, out='r_cells')
+        if len(self.class_structures) > 0:
+            selected_cells = self.select_cells_by_class(selected_agents, agents_squares_to_move, r_squares, r_cells, chunk_size)
+        else:
+            selected_cells = self.select_cells_by_chunks(agents_squares_to_move, r_squares, r_cells, chunk_size, out='selected_cells')
+
+        if self.move_mode == 'return':
+            returning = self.draw('move', n_agents) < self.p_return_home
+            selected_cells = xp.where(returning, xp.take(self.home_cell_ids, selected_agents), selected_cells)
 
         if self.verbose > 2:
-            selected_squares = self.square_ids_cells[selected_cells]
-            home_squares = self.square_ids_cells[self.home_cell_ids[selected_agents]]
+            selected_squares = self.square_ids_cells[self.backend.to_numpy(selected_cells)]
+            home_squares = self.square_ids_cells[self.backend.to_numpy(xp.take(self.home_cell_ids, selected_agents))]
             n_out = (home_squares != selected_squares).sum()
-            print(f'INFO: {n_out}/{selected_agents.shape[0]} moving out of their squares {round(n_out / selected_agents.shape[0] * 100, 2)}%')
-        # return selected_agents since it has been re-ordered
+            print(f'INFO: {n_out}/{n_agents} moving out of their squares {round(n_out / n_agents * 100, 2)}%')
+        # when the map has a workspace, `selected_cells` is only valid until the next move
         return selected_agents, selected_cells
 
 
-    def make_move(self, prop_cont_factor=10, p_mask=0):
-        """ determine which agents to move, then move hem and proceed to the contamination process """
-        probas_move = np.multiply(self.p_moves.flatten(),  1 - self.unique_severities[self.current_state_ids])
-        draw = np.random.uniform(size=probas_move.shape[0])
-        draw = (draw < probas_move)
-        selected_agents = self.agent_ids[draw]
-        selected_agents, selected_cells = self.move_agents(selected_agents)
+    def select_cells_by_chunks(self, squares, r_squares, r_cells, chunk_size, out=None):
+        """ `select_cells` by chunks of `chunk_size` agents """
+        n_agents = squares.shape[0]
+        if chunk_size >= n_agents:
+            return self.select_cells(squares, r_squares, r_cells, out=out)
+        selected_cells = self.empty(out, (n_agents,), self.eligible_cells.dtype)
+        for start in range(0, n_agents, chunk_size):
+            selected_cells[start:start+chunk_size] = self.select_cells(squares[start:start+chunk_size],
+                                                                       r_squares[start:start+chunk_size],
+                                                                       r_cells[start:start+chunk_size])
+        return selected_cells
+
+    def select_cells_by_class(self, agents, squares, r_squares, r_cells, chunk_size):
+        """ `select_cells_by_chunks` for the moving `agents`, grouped by mobility class, each group with the sampling
+        structures of its class (see `set_mobility_classes`) """
+        xp = self.xp
+        n_classes = len(self.class_structures)
+        classes = xp.take(self.mobility_class_ids, agents)
+        order = self.backend.counting_sort(classes, n_classes)
+        counts = self.backend.to_numpy(self.backend.bincount(classes, n_classes))
+        selected_cells = xp.zeros((agents.shape[0],), dtype=self.eligible_cells.dtype)
+        structures = {name: getattr(self, name) for name in CLASS_ATTRIBUTES}
+        start = 0
+        for mobility_class, count in enumerate(counts):
+            if count == 0:
+                continue
+            inds = order[start:start+count]
+            start += count
+            self.use_sampling_structures(self.class_structures[mobility_class])
+            cells = self.select_cells_by_chunks(xp.take(squares, inds), xp.take(r_squares, inds, axis=0), xp.take(r_cells, inds), chunk_size)
+            selected_cells = self.backend.put(selected_cells, inds, cells)
+        self.use_sampling_structures(structures)
+        return selected_cells
+
+    def select_cells(self, squares, r_squares, r_cells, out=None):
+        """ select a square to move to from each of `squares` (drawing `r_squares`), then a cell inside
+        this square (drawing `r_cells`). `out`: name of the workspace buffer of the result """
+        backend = self.backend
+        n_agents = squares.shape[0]
+        if self.square_sampling == 'tree':
+            selected_squares = self.descend_square_tree(squares, r_squares)
+        else:
+            # Align `square_sampling_probas` with agents (their square)
+            square_sampling_ps = self.take(self.square_sampling_probas, squares, out='square_sampling_ps')
+            # Chose one square for each row (agent), considering each row as a sample proba (see `vectorized_choice`)
+            mask = backend.elementwise('less', square_sampling_ps, r_squares[:, None],
+                                       out=self.buffer('square_mask', square_sampling_ps.shape, np.bool_))
+            selected_squares = backend.count_true(mask, axis=1, out=self.buffer('selected_squares', (n_agents,), np.int64))
+            selected_squares = backend.elementwise('minimum', selected_squares, self.square_sampling_probas.shape[1] - 1, out=selected_squares)
+        # Now select cells in the squares where the agents move
+        cell_sampling_ps = self.take(self.cell_sampling_probas, selected_squares, out='cell_sampling_ps')
+        mask = backend.elementwise('less', cell_sampling_ps, r_cells[:, None], out=self.buffer('cell_mask', cell_sampling_ps.shape, np.bool_))
+        selected_cells = backend.count_true(mask, axis=1, out=self.buffer('selected_square_cells', (n_agents,), np.int64))
+        # a draw above the cumulated probas (rounding) stays in the square
+        last_cells = self.take(self.cell_counts, selected_squares, out='last_cells')
+        last_cells -= 1
+        selected_cells = backend.elementwise('minimum', selected_cells, last_cells, out=selected_cells)
+        # Now we have like "cell 2 in square 1, cell n in square 2 etc." we have to go back to the actual cell id
+        selected_cells += self.take(self.cell_index_shift, selected_squares, out='cell_index_shift')
+        selected_cells = self.take(self.order_eligible_cells, selected_cells, out='eligible_cell_inds')
+        return self.take(self.eligible_cells, selected_cells, out=out)
+
+
+    def descend_square_tree(self, squares, r_squares):
+        """ square to move to (rank among the squares having attractivity) from each of `squares`, descending the
+        quadtree of the squares (see `utils.get_square_tree`) two levels at a time, with one draw of `r_squares`
+        (n_agents, n_steps) by step. A node two levels below is chosen with a probability proportional to the sum
+        over its own children of their attractivity times exp(-dscale * distance), the distance to a node being
+        the mean of the ones to its bounding box and to its centroid. Between squares of a same node these are the
+        probabilities of the matrix, above it is an approximation (far squares of a node weigh as closer ones) """
+        xp = self.xp
+        n_agents = squares.shape[0]
+        positions = xp.take(self.square_positions, squares, axis=0)
+        x, y = positions[:, 0:1], positions[:, 1:2]
+        nodes = xp.full((n_agents,), self.square_tree_root, dtype=xp.int64)
+        for step in range(self.get_square_tree_steps()):
+            descendants = [nodes]
+            for _ in range(3):
+                descendants.append(xp.reshape(xp.take(self.square_tree_children, xp.reshape(descendants[-1], (-1,)), axis=0), (n_agents, -1)))
+            grandchildren, weighed = descendants[2], xp.reshape(descendants[3], (-1,))
+            xmin, ymin, xmax, ymax, xc, yc = [xp.reshape(bound, (n_agents, 64)) for bound in xp.unstack(xp.take(self.square_tree_bounds, weighed, axis=1))]
+            dx = xp.maximum(xp.maximum(xmin - x, x - xmax), 0)
+            dy = xp.maximum(xp.maximum(ymin - y, y - ymax), 0)
+            dxc, dyc = xc - x, yc - y
+            distances = (xp.sqrt(dx * dx + dy * dy) + xp.sqrt(dxc * dxc + dyc * dyc)) / 2
+            # relative to the closest node, so that the weights of far agents don't all underflow
+            distances = distances - xp.min(distances, axis=1, keepdims=True)
+            attractivities = xp.reshape(xp.take(self.square_tree_attractivities, weighed), (n_agents, 64))
+            # the padding nodes (no attractivity) are infinitely far
+            weights = xp.where(attractivities > 0, attractivities * xp.exp(-self.dscale * distances), 0)
+            cumulated = xp.cumulative_sum(xp.sum(xp.reshape(weights, (n_agents, 16, 4)), axis=2), axis=1)
+            chosen = xp.count_nonzero(cumulated < r_squares[:, step:step+1] * cumulated[:, 15:], axis=1)
+            nodes = xp.take_along_axis(grandchildren, chosen[:, None], axis=1)[:, 0]
+        return nodes
+
+    def get_square_tree_steps(self):
+        """ number of steps of `descend_square_tree` (the leaves are their own child, an odd depth ends on them) """
+        return (self.square_tree_depth + 1) // 2
+
+
+    def get_move_chunk_size(self, n_agents, max_temp_bytes=None):
+        """ number of moving agents whose sampling temporaries in `select_cells` fit in `max_temp_bytes` """
+        if max_temp_bytes is None:
+            return max(n_agents, 1)
+        # by agent: a row of square probas and its comparison with the draw, then a row of cell probas
+        # and its comparison while the square ones are still alive
+        itemsize = np.dtype(self.probability_dtype).itemsize
+        bytes_per_agent = (self.square_sampling_probas.shape[1] + self.cell_sampling_probas.shape[1]) * (itemsize + 1)
+        if self.square_sampling == 'tree':
+            # bounds and a few temporaries of the 64 nodes weighed by step
+            bytes_per_agent += 64 * 12 * 4
+        return max(int(max_temp_bytes // bytes_per_agent), 1)
+
+
+    @profiled
+    def make_move(self, prop_cont_factor=10, p_mask=0, max_temp_bytes=None):
+        """ determine which agents to move, then move hem and proceed to the contamination process
+        `max_temp_bytes`: memory budget of the moves, see `move_agents`. The share of masked agents is the largest
+        of `p_mask` and the one of the map (`p_mask` attribute, set by the policies) """
+        p_mask = max(p_mask, self.p_mask)
+        self.set_step(self.move_index)
+        if self.profile_schedule.shape[0] > 0:
+            self.use_attractivity_profile(int(self.profile_schedule[self.move_index % self.profile_schedule.shape[0]]))
+        self.move_index += 1
+        xp = self.xp
+        if self.n_move_candidates < MAX_MOVE_CANDIDATES * self.agent_ids.shape[0]:
+            selected_agents = self.select_movers()
+        elif self.executor is None:
+            probas_move = self.take(self.unique_mobilities, self.current_state_ids, out='probas_move')
+            self.multiply_probabilities(probas_move, self.p_moves)
+            self.restrict_moves(probas_move, self.agent_ids)
+            draw = self.draw_probabilities('move', probas_move.shape[0], out='draw_move')
+            is_moving = self.backend.elementwise('less', draw, probas_move, out=self.buffer('is_moving', draw.shape, np.bool_))
+            selected_agents = self.compress(is_moving, self.agent_ids, out='selected_agents')
+        else:
+            def select_agents(chunk, rng):
+                probas_move = np.take(self.unique_mobilities, self.current_state_ids[chunk])
+                self.multiply_probabilities(probas_move, self.p_moves[chunk])
+                self.restrict_moves(probas_move, self.agent_ids[chunk])
+                return self.agent_ids[chunk][self.get_random_probabilities(rng, probas_move.shape[0]) < probas_move]
+            n_agents = self.agent_ids.shape[0]
+            selected_agents = np.concatenate(self.executor.map(select_agents, n_agents, self.executor.get_rngs(self.rngs['move'], n_agents)))
+        if self.profiler is not None:
+            self.profiler.set(n_agents=selected_agents.shape[0])
+        selected_agents, selected_cells = self.move_agents(selected_agents, max_temp_bytes)
+        selected_agents, selected_cells = self.update_locations(selected_agents, selected_cells, max_temp_bytes)
         if self.verbose > 1:
-            print(f'{selected_agents.shape[0]} agents selected for moving in {np.unique(selected_cells).shape[0]} distinct cells')
+            print(f'{selected_agents.shape[0]} agents selected for moving in {xp.unique_values(selected_cells).shape[0]} distinct cells')
         self.contaminate(selected_agents, selected_cells, prop_cont_factor, p_mask)
 
 
-
+    def update_locations(self, moved_agents, cells, max_temp_bytes=None):
+        """ record that `moved_agents` are now in `cells`, the other agents going home (move mode 'home') or staying
+        where they are. With cell capacities, only the agents finding room move (see `fit_capacities`).
+        Returns the agents in the cells visited at this move, to be contaminated: the ones having moved, and the
+        ones staying away from home (none in move mode 'home'), with their cells """
+        xp = self.xp
+        if self.move_mode == 'home':
+            self.return_home()
+        if self.cell_capacities.shape[0] > 0:
+            moved_agents, cells = self.fit_capacities(moved_agents, cells, max_temp_bytes)
+        self.relocate(moved_agents, cells)
+        if self.move_mode == 'home':
+            self.away_agents = moved_agents[cells != xp.take(self.home_cell_ids, moved_agents)]
+            return moved_agents, cells
+        away = self.current_cell_ids != self.home_cell_ids
+        self.away_agents = xp.take(self.agent_ids, xp.nonzero(away)[0])
+        present = self.backend.put(away, moved_agents, True)
+        present_agents = xp.take(self.agent_ids, xp.nonzero(present)[0])
+        return present_agents, xp.take(self.current_cell_ids, present_agents)
+
+    def fit_capacities(self, moved_agents, cells, max_temp_bytes=None):
+        """ Keep the moves to cells having room left (see `cell_capacities` in `from_arrays`). The movers are
+        placed in a random order: the first ones going to a cell take its remaining room, the others are sent to
+        another cell drawn the same way (`move_agents`), at most `CAPACITY_RESAMPLINGS` times, after which they stay
+        where they are. Going home (or staying in the same cell) is always possible. The room left by the movers
+        is available from the next drawing on. Returns the moving agents (sorted) and their cells """
+        xp = self.xp
+        n_cells = self.unsafeties.shape[0]
+        room = xp.astype(self.cell_capacities, xp.int64) - xp.astype(self.cell_occupancy, xp.int64)
+        placed_agents, placed_cells = [], []
+        for resampling in range(CAPACITY_RESAMPLINGS + 1):
+            if resampling > 0:
+                moved_agents, cells = self.move_agents(moved_agents, max_temp_bytes)
+            n_agents = moved_agents.shape[0]
+            # random order of the movers, then grouped by cell (stable): rank of each one among the ones going to its cell
+            order = self.asarray(self.rngs['move'].permutation(n_agents), dtype=np.int64)
+            order = xp.take(order, self.backend.counting_sort(xp.take(cells, order), n_cells))
+            moved_agents, cells = xp.take(moved_agents, order), xp.take(cells, order)
+            starts = group_starts(cells, xp)
+            ranks = xp.arange(n_agents, dtype=xp.int64) - xp.repeat(starts, group_counts(starts, n_agents, xp))
+            fits = ranks < xp.take(room, cells)
+            fits |= (cells == xp.take(self.home_cell_ids, moved_agents)) | (cells == xp.take(self.current_cell_ids, moved_agents))
+            placed_agents.append(moved_agents[fits])
+            placed_cells.append(cells[fits])
+            room = self.backend.add_at(room, cells[fits], -1)
+            room = self.backend.add_at(room, xp.take(self.current_cell_ids, placed_agents[-1]), 1)
+            moved_agents = moved_agents[~fits]
+            if moved_agents.shape[0] == 0:
+                break
+        if self.verbose > 1:
+            print(f'{moved_agents.shape[0]} agents not moving for lack of room')
+        moved_agents, cells = xp.concat(placed_agents), xp.concat(placed_cells)
+        order = self.backend.counting_sort(moved_agents, self.agent_ids.shape[0])
+        return xp.take(moved_agents, order), xp.take(cells, order)
+
+    def relocate(self, agent_ids, cells):
+        """ move the (unique) `agent_ids` to `cells`, updating the occupancy of the cells they leave and join """
+        xp = self.xp
+        self.cell_occupancy = self.backend.add_at(self.cell_occupancy, xp.take(self.current_cell_ids, agent_ids), -1)
+        self.cell_occupancy = self.backend.add_at(self.cell_occupancy, cells, 1)
+        self.current_cell_ids = self.backend.put(self.current_cell_ids, agent_ids, cells)
+        self.current_square_ids = self.backend.put(self.current_square_ids, agent_ids, xp.take(self.cell_squares, cells))
+        self.cell_index = None
+
+    def return_home(self):
+        """ the agents away from home go back home """
+        self.relocate(self.away_agents, self.xp.take(self.home_cell_ids, self.away_agents))
+        self.away_agents = self.away_agents[:0]
+
+    def init_locations(self):
+        """ all the agents at home """
+        xp = self.xp
+        self.current_cell_ids = self.backend.update(self.current_cell_ids, self.home_cell_ids)
+        self.current_square_ids = self.backend.update(self.current_square_ids, self.agent_squares)
+        self.away_agents = xp.zeros((0,), dtype=xp.uint32)
+        self.cell_occupancy = self.backend.add_at(xp.zeros((self.unsafeties.shape[0],), dtype=xp.int32), self.home_cell_ids, 1)
+        self.cell_index = None
+
+    def set_move_mode(self, move_mode, p_return_home=0):
+        """ Where the agents selected for a move move from. 'home': from their home square, the agents not moving
+        going back home (the cells visited at a move are independent from the previous moves). 'current': from the
+        square they are in, the agents not moving staying in their cell (and being contaminated there), as in trip
+        chains. 'return': as 'current', but each moving agent goes back home with probability `p_return_home`.
+        All agents are home at the end of the periods """
+        if move_mode not in MOVE_MODES:
+            raise ValueError(f'move_mode must be one of {MOVE_MODES}, not {move_mode}')
+        self.move_mode = move_mode
+        self.p_return_home = p_return_home
+
+
+    def select_movers(self):
+        """ Agents moving at this step, with the probabilities of the dense selection of `make_move` but drawn
+        by bucket of agents (see `set_move_buckets`): the candidates of a bucket of bound `2 ** -k` are drawn
+        with this probability, then each one moves with probability `probas_move * 2 ** k`. The cost is
+        proportional to the number of candidates, not of agents (at most twice the number of agents moving
+        when they are all healthy and not traced) """
+        xp = self.xp
+        rng = self.rngs['move']
+        candidates, n_candidates, start = [], [], 0
+        for k, count in enumerate(self.move_bucket_counts):
+            bucket_candidates = get_bernoulli_successes(int(count), 2. ** -k, rng)
+            candidates.append(start + bucket_candidates)
+            n_candidates.append(bucket_candidates.shape[0])
+            start += count
+        candidates = xp.take(self.move_bucket_agents, self.asarray(np.concatenate(candidates)))
+        probas_move = xp.take(self.unique_mobilities, xp.take(self.current_state_ids, candidates))
+        self.multiply_probabilities(probas_move, xp.take(self.p_moves, candidates))
+        self.restrict_moves(probas_move, candidates)
+        probas_move = probas_move * xp.repeat(self.move_bucket_factors, self.asarray(n_candidates, dtype=np.int64))
+        draw = self.draw_probabilities('move', candidates.shape[0])
+        return xp.sort(candidates[draw < probas_move])
+
+
+    @profiled
     def forward_all_cells(self, tracing_rate=0):
         """ move all agents in map one time step forward """
-        agents_durations = self.durations[np.arange(0, self.durations.shape[0]),self.current_state_ids]
-        to_transit = (self.current_state_durations == agents_durations)
-        self.current_state_durations += 1
-        to_transit = self.agent_ids[to_transit]
+        self.set_step(END_OF_PERIOD_STEP)
+        xp = self.xp
+        if self.executor is None:
+            agents_durations = xp.take_along_axis(self.durations, xp.astype(self.current_state_ids, xp.int64)[:, None], axis=1)[:, 0]
+            to_transit = self.agent_ids[self.current_state_durations == agents_durations]
+            self.current_state_durations += 1
+        else:
+            def get_to_transit(chunk):
+                agents_durations = np.take_along_axis(self.durations[chunk], self.current_state_ids[chunk, None].astype(np.int64), axis=1)[:, 0]
+                to_transit = self.agent_ids[chunk][self.current_state_durations[chunk] == agents_durations]
+                self.current_state_durations[chunk] += 1
+                return to_transit
+            to_transit = np.concatenate(self.executor.map(get_to_transit, self.agent_ids.shape[0]))
+        if self.profiler is not None:
+            self.profiler.set(n_transit=to_transit.shape[0])
         new_states = self.transit_states(to_transit, tracing_rate)
-        self.transit_states(to_transit, tracing_rate)
+        self.release_isolated()
+        if self.n_tests_per_period > 0:
+            self.test_agents()
 
         # Contamination at home by end of the period
+        self.return_home()
         self.contaminate(self.agent_ids, self.home_cell_ids)
 
         # Update r and associated variables
@@ -435,38 +748,88 @@ class Map:
         self.r_factors = np.append(self.r_factors, r)
         self.n_diseased_period = self.get_n_diseased()
         self.n_infected_period = 0
-        # tracing
         #Move one period forward
         self.current_period += 1
+        self.move_index = 0
         return new_states
 
     
+    @profiled
     def transit_states(self, agent_ids_transit, tracing_rate=0):
-        #Move one period forward
-        self.current_period += 1
+        """ draw the next state of `agent_ids_transit` according to their transitions and current state,
+        returns the new states """
+        xp = self.xp
         if agent_ids_transit.shape[0] == 0:
-            return 
-        agent_ids_transit = agent_ids_transit.astype(np.uint32)
-        agent_current_states = self.current_state_ids[agent_ids_transit]
-        agent_transitions = self.transitions_ids[agent_current_states]
+            return xp.zeros((0,), dtype=self.current_state_ids.dtype)
         # Select rows corresponding to transitions to do
-        transitions = self.transitions[agent_current_states,:,agent_transitions]
+        n_states = self.transition_rows.shape[1]
+        rows = xp.astype(xp.take(self.transitions_ids, agent_ids_transit), xp.int64) * n_states
+        rows = rows + xp.astype(xp.take(self.current_state_ids, agent_ids_transit), xp.int64)
+        transitions = xp.take(self.transition_rows, rows, axis=0)
         # Select new states according to transition matrix
-        new_states = vectorized_choice(transitions)
+        new_states = vectorized_choice(transitions, r=self.draw('transition', transitions.shape[0]), xp=xp)
+        new_states = xp.astype(new_states, self.current_state_ids.dtype)
         self.change_state_agents(agent_ids_transit, new_states, tracing_rate)
         return new_states
 
 
+    def run(self, n_periods, n_moves_per_period, callbacks=None, record=('states',), prop_cont_factor=10, p_mask=0,
+            tracing_rate=0, max_temp_bytes=None, policy=None):
+        """ simulate `n_periods` of `n_moves_per_period` moves each (see `make_move` and `forward_all_cells`
+        for the other arguments). `policy`: `policies.Policy` applied before each period. `record`: what to record at the end of each period, among 'states' (number of agents
+        in each state) and 'new_states' (number of agents that just transited to each state).
+        `callbacks`: functions `callback(map, period, records)` called at the end of each period, `period` being
+        the index of the period in the run; the run stops early if one of them returns True.
+        returns the records, one row by simulated period and one column by state, and 'state_ids' (the states
+        of the columns) """
+        unknown = set(record) - set(RUN_RECORDS)
+        if unknown:
+            raise ValueError(f'unknown records: {sorted(unknown)}, possible ones: {RUN_RECORDS}')
+        state_ids = self.backend.to_numpy(self.unique_state_ids)
+        records = {name: np.zeros((n_periods, state_ids.shape[0]), dtype=np.int64) for name in record}
+        records['state_ids'] = state_ids
+        if policy is not None:
+            policy.start(self)
+        for period in range(n_periods):
+            if policy is not None:
+                policy.apply(self, period)
+            for _ in range(n_moves_per_period):
+                self.make_move(prop_cont_factor, p_mask, max_temp_bytes)
+            new_states = self.forward_all_cells(tracing_rate)
+            if 'states' in records:
+                records['states'][period] = self.get_state_counts()
+            if 'new_states' in records:
+                records['new_states'][period] = self.get_state_counts(new_states)
+            if callbacks and any([callback(self, period, records) for callback in callbacks]):
+                records.update({name: records[name][:period+1] for name in record})
+                break
+        if policy is not None:
+            policy.stop(self)
+        return records
+
+
+    def get_state_counts(self, state_ids=None):
+        """ number of agents of `state_ids` (default: the current states of all agents) in each of the possible
+        states, in the order of `unique_state_ids`, as a numpy array """
+        if state_ids is None:
+            state_ids = self.current_state_ids
+        unique_state_ids = self.xp.astype(self.unique_state_ids, self.xp.int64)
+        counts = self.backend.bincount(state_ids, int(self.xp.max(unique_state_ids)) + 1)
+        return self.backend.to_numpy(self.xp.take(counts, unique_state_ids))
+
+
     def get_states_numbers(self):
         """ For all possible states, return the number of agents in the map in this state
-        returns a numpy array consisting in 2 columns: the first is the state id and the second, 
-        the number of agents currently in this state on the map """
-        state_ids, n_agents = np.unique(self.current_state_ids, return_counts=True)
-        return state_ids, n_agents
+        returns two numpy arrays: the state ids and the number of agents currently in this state on the map """
+        state_ids, n_agents = self.xp.unique_counts(self.current_state_ids)
+        state_ids, n_agents = self.backend.to_numpy(state_ids), self.backend.to_numpy(n_agents)
+        order = np.argsort(state_ids)
+        return state_ids[order], n_agents[order]
 
 
     def get_n_diseased(self):
-        return ((self.unique_severities[self.current_state_ids] > 0) & (self.unique_severities[self.current_state_ids] < 1)).sum()
+        severities = self.xp.take(self.unique_severities, self.current_state_ids)
+        return int(self.xp.count_nonzero((severities > 0) & (severities < 1)))
 
 
     def get_r_factors(self):
@@ -477,20 +840,60 @@ class Map:
         return self.infecting_agents, self.infected_agents, self.infected_periods
 
 
+    # Occupancy of the cells: `cell_occupancy` (number of agents in each cell) is updated with the agents changing
+    # cell only (see `relocate`), the agents of each cell are indexed on demand, without comparison sort
+
+    def get_cell_agents(self):
+        """ agents in each cell, in CSR layout: returns `starts` (n_cells + 1) and `agents`, the agents in
+        cell `c` (in increasing order) being `agents[starts[c]:starts[c + 1]]`. Built by counting sort of the
+        current cells of the agents (O(n_agents + n_cells)), and kept until the next move """
+        if self.cell_index is None:
+            xp = self.xp
+            order = self.backend.counting_sort(self.current_cell_ids, self.unsafeties.shape[0])
+            starts = xp.cumulative_sum(xp.astype(self.cell_occupancy, xp.int64), include_initial=True)
+            self.cell_index = starts, xp.take(self.agent_ids, order)
+        return self.cell_index
+
+    def get_occupancy_histogram(self):
+        """ number of cells holding 0, 1, 2... agents, as a numpy array """
+        occupancies, n_cells = self.xp.unique_counts(self.cell_occupancy)
+        occupancies = self.backend.to_numpy(occupancies)
+        histogram = np.zeros(int(occupancies.max()) + 1, dtype=np.int64)
+        histogram[occupancies] = self.backend.to_numpy(n_cells)
+        return histogram
+
+    def get_max_crowding(self):
+        """ the most occupied cell and its number of agents """
+        cell = int(self.xp.argmax(self.cell_occupancy))
+        return cell, int(self.cell_occupancy[cell])
+
+    def get_contagious_counts(self):
+        """ number of contagious agents in each cell """
+        xp = self.xp
+        contagious = get_bits(self.contagious_flags, get_bit_positions(self.agent_ids, xp), xp)
+        return self.backend.add_at(xp.zeros((self.unsafeties.shape[0],), dtype=xp.int32), self.current_cell_ids[contagious], 1)
+
+
     def change_state_agents(self, agent_ids, new_state_ids, tracing_rate=0):
-        """ switch `agent_ids` to `new_state_ids` """
-        self.current_state_ids[agent_ids] = new_state_ids
-        self.current_state_durations[agent_ids] = 0
+        """ switch `agent_ids` to `new_state_ids`. With `tracing_rate`, the agents infected by the ones getting
+        to state "infected" are traced with this probability: they move `TRACED_P_MOVE_DIVISOR` times less, or are
+        isolated with `isolate_traced` (see `set_testing`) """
+        xp = self.xp
+        self.current_state_ids = self.backend.put(self.current_state_ids, agent_ids, new_state_ids)
+        self.current_state_durations = self.backend.put(self.current_state_durations, agent_ids, 0)
+        self.refresh_flags(agent_ids)
         # Tracing
         if tracing_rate > 0:
             new_infected_agents = agent_ids[new_state_ids == 4]
             # Index of agents that just got to state "infected" in `self.infected_agents`
-            inds_nia = get_ind_in_arr(self.infecting_agents, new_infected_agents)
-            infected_by_nia = self.infected_agents[inds_nia].astype(np.uint32)
-            mask_traced = np.random.binomial(1, p=tracing_rate, size=infected_by_nia)
-            mask_traced = (mask_traced > 0)
-            traced_agents = infected_by_nia[mask_traced].astype(np.uint32)
-            self.p_moves[traced_agents] = np.divide(self.p_moves[traced_agents], 5)
+            inds_nia = get_ind_in_arr(self.infecting_agents, xp.astype(new_infected_agents, xp.uint32), xp)
+            infected_by_nia = xp.take(self.infected_agents, inds_nia)
+            mask_traced = self.rngs['transition'].binomial(1, p=tracing_rate, size=infected_by_nia.shape[0])
+            traced_agents = infected_by_nia[self.asarray(mask_traced > 0)]
+            if self.isolate_traced:
+                self.isolate(traced_agents)
+            else:
+                self.set_traced(traced_agents)
 
 
     ### Persistence methods
@@ -500,47 +903,28 @@ class Map:
         if not os.path.isdir(savedir):
             os.makedirs(savedir)
         # Persist arrays
-        dsave = {}
-        dsave['unique_state_ids'] = self.unique_state_ids, 
-        dsave['unique_contagiousities'] = self.unique_contagiousities, 
-        dsave['unique_sensitivities'] =  self.unique_sensitivities, 
-        dsave['unique_severities'] =  self.unique_severities, 
-        dsave['cell_ids'] =  self.cell_ids, 
-        dsave['unsafeties'] = self.unsafeties,
-        dsave['attractivities'] = self.attractivities
-        dsave['square_sampling_probas'] =  self.square_sampling_probas, 
-        dsave['eligible_cells'] =  self.eligible_cells,
-        dsave['coords_squares'] =  self.coords_squares,
-        dsave['square_ids_cells'] =  self.square_ids_cells,
-        dsave['cell_sampling_probas'] = self.cell_sampling_probas, 
-        dsave['cell_index_shift'] = self.cell_index_shift,
-        dsave['agent_ids'] = self.agent_ids,
-        dsave['p_moves'] = self.p_moves,
-        dsave['least_state_ids'] = self.least_state_ids,
-        dsave['unique_state_ids'] = self.unique_state_ids,
-        dsave['home_cell_ids'] = self.home_cell_ids,
-        dsave['current_state_ids'] = self.current_state_ids,
-        dsave['current_state_durations'] = self.current_state_durations,
-        dsave['agent_squares'] = self.agent_squares
-        dsave['transitions'] = self.transitions,
-        dsave['transitions_ids'] = self.transitions_ids,
-        dsave['durations'] = self.durations,
-        dsave['r_factors'] = self.r_factors, 
-        dsave['infecting_agents'] = self.infecting_agents, 
-        dsave['infected_agents'] = self.infected_agents, 
-        dsave['infected_periods'] = self.infected_periods
-
-        for fname, arr in dsave.items():
-            filepath = os.path.join(savedir, f'{fname}.npy')
-            np.save(filepath, arr)
+        for fname in SAVED_ARRAYS:
+            arr = getattr(self, fname)
+            if fname in BACKEND_ARRAYS:
+                arr = self.backend.to_numpy(arr)
+            np.save(os.path.join(savedir, f'{fname}.npy'), arr)
 
         # Persist scalars and other parameters
         sdict = {}
         sdict['current_period'] = self.current_period
         sdict['verbose'] = self.verbose
         sdict['dcale'] = self.dscale
+        sdict['p_mask'] = self.p_mask
         sdict['n_infected_period'] = self.n_infected_period
         sdict['n_diseased_period'] = self.n_diseased_period
+        sdict['probability_bits'] = self.probability_bits
+        sdict['square_sampling'] = self.square_sampling
+        sdict['square_size'] = self.square_size
+        sdict['move_mode'] = self.move_mode
+        sdict['p_return_home'] = self.p_return_home
+        sdict['max_cells_per_square'] = self.max_cells_per_square
+        sdict['testing'] = self.get_testing()
+        sdict['immunity'] = {'half_life': self.immunity_half_life, 'infection_immunity': self.infection_immunity}
 
         sdict_path = os.path.join(savedir, 'params.pkl')
         with open(sdict_path, 'wb') as f:
@@ -550,130 +934,832 @@ class Map:
             print(f'Map persisted under folder: {savedir}')
 
 
-    def load(self, savedir):
+    def load(self, savedir, backend='numpy'):
         """ load map that has been persisted in `savedir` through `self.save()` """
         if not os.path.isdir(savedir):
             print(f'{savedir} is not a path')
-        
-        self.unique_state_ids = np.squeeze(np.load(os.path.join(savedir, 'unique_state_ids.npy')))
-        self.unique_contagiousities = np.squeeze(np.load(os.path.join(savedir, 'unique_contagiousities.npy')))
-        self.unique_sensitivities = np.squeeze(np.load(os.path.join(savedir, 'unique_sensitivities.npy')))
-        self.unique_severities = np.squeeze(np.load(os.path.join(savedir, 'unique_severities.npy')))
-        self.cell_ids = np.squeeze(np.load(os.path.join(savedir, 'cell_ids.npy')))
-        self.unsafeties = np.squeeze(np.load(os.path.join(savedir, 'unsafeties.npy')))
-        self.attractivities = np.squeeze(np.load(os.path.join(savedir, 'attractivities.npy')))
-        self.square_sampling_probas = np.squeeze(np.load(os.path.join(savedir, 'square_sampling_probas.npy')))
-        self.eligible_cells = np.squeeze(np.load(os.path.join(savedir, 'eligible_cells.npy')))
-        self.coords_squares = np.squeeze(np.load(os.path.join(savedir, 'coords_squares.npy')))
-        self.square_ids_cells = np.squeeze(np.load(os.path.join(savedir, 'square_ids_cells.npy')))
-        self.cell_sampling_probas = np.squeeze(np.load(os.path.join(savedir, 'cell_sampling_probas.npy')))
-        self.cell_index_shift = np.squeeze(np.load(os.path.join(savedir, 'cell_index_shift.npy')))
-        self.agent_ids = np.squeeze(np.load(os.path.join(savedir, 'agent_ids.npy')))
-        self.p_moves = np.squeeze(np.load(os.path.join(savedir, 'p_moves.npy')))
-        self.least_state_ids = np.squeeze(np.load(os.path.join(savedir, 'least_state_ids.npy')))
-        self.unique_state_ids = np.squeeze(np.load(os.path.join(savedir, 'unique_state_ids.npy')))
-        self.home_cell_ids = np.squeeze(np.load(os.path.join(savedir, 'home_cell_ids.npy')))
-        self.current_state_ids = np.squeeze(np.load(os.path.join(savedir, 'current_state_ids.npy')))
-        self.current_state_durations = np.squeeze(np.load(os.path.join(savedir, 'current_state_durations.npy')))
-        self.agent_squares = np.squeeze(np.load(os.path.join(savedir, 'agent_squares.npy')))
-        self.transitions = np.squeeze(np.load(os.path.join(savedir, 'transitions.npy')))
-        self.transitions_ids = np.squeeze(np.load(os.path.join(savedir, 'transitions_ids.npy')))
-        self.durations = np.squeeze(np.load(os.path.join(savedir, 'durations.npy')))
-        self.r_factors = np.squeeze(np.load(os.path.join(savedir, 'r_factors.npy')))
-        self.infecting_agents = np.squeeze(np.load(os.path.join(savedir, 'infecting_agents.npy')))
-        self.infected_agents = np.squeeze(np.load(os.path.join(savedir, 'infected_agents.npy')))
-        self.infected_periods = np.squeeze(np.load(os.path.join(savedir, 'infected_periods.npy')))
+
+        for fname in SAVED_ARRAYS:
+            fpath = os.path.join(savedir, f'{fname}.npy')
+            if fname == 'traced_flags' and not os.path.exists(fpath):
+                # map saved before the flags existed
+                self.traced_flags = np.zeros((self.agent_ids.shape[0] + 7) // 8, dtype=np.uint8)
+                continue
+            if fname in ['cell_capacities', 'attractivity_profiles', 'profile_schedule', 'isolated_agents', 'isolation_ends',
+                         'immunities', 'immunity_periods'] + list(CLASS_PARAMETERS) and not os.path.exists(fpath):
+                # map saved before these arrays existed
+                setattr(self, fname, np.zeros(0, dtype=np.uint32))
+                continue
+            setattr(self, fname, np.atleast_1d(np.squeeze(np.load(fpath))))
+        self.r_factors = np.atleast_1d(self.r_factors)
+        self.cell_counts = np.diff(np.append(self.cell_index_shift, self.eligible_cells.shape[0]))
+        self.transition_rows = self.get_transition_rows(self.transitions)
+        self.initial_current_state_ids = self.current_state_ids.copy()
+        self.initial_current_state_durations = self.current_state_durations.copy()
 
         sdict_path = os.path.join(savedir, 'params.pkl')
         with open(sdict_path, 'rb') as f:
             sdict = pickle.load(f)
 
         self.current_period = sdict['current_period']
+        self.initial_current_period = self.current_period
         self.verbose = sdict['verbose']
         self.dscale = sdict['dcale']
+        self.p_mask = sdict.get('p_mask', 0)
         self.n_infected_period = sdict['n_infected_period']
         self.n_diseased_period = sdict['n_diseased_period']
+        self.move_index = 0
+        # arrays have been loaded with numpy
+        self.backend = get_backend('numpy')
+        self.xp = self.backend.xp
+        self.workspace = Workspace()
+        self.set_probability_bits(sdict.get('probability_bits'))
+        self.square_sampling = sdict.get('square_sampling', 'matrix')
+        self.square_size = sdict.get('square_size', 1)
+        self.set_move_mode(sdict.get('move_mode', 'home'), sdict.get('p_return_home', 0))
+        self.cell_squares = self.square_ids_cells.astype(np.uint32)
+        self.current_cell_ids = self.home_cell_ids.astype(np.uint32)
+        self.current_square_ids = self.agent_squares.astype(np.uint32)
+        self.init_locations()
+        self.max_cells_per_square = sdict.get('max_cells_per_square')
+        self.set_square_tree()
+        self.set_mobility_classes(*[getattr(self, name) if getattr(self, name).size > 0 else None for name in CLASS_PARAMETERS])
+        self.set_class_structures(self.attractivities)
+        self.set_attractivity_profiles(self.attractivity_profiles if self.attractivity_profiles.size > 0 else None, self.profile_schedule)
+        self.unique_mobilities = self.get_mobilities(self.unique_severities)
+        self.init_flags(self.traced_flags)
+        self.init_isolation(self.isolated_agents.astype(np.uint32), self.isolation_ends.astype(np.int32))
+        self.set_testing(**sdict.get('testing', {}))
+        self.set_immunity(**sdict.get('immunity', {}))
+        if self.immunities.shape[0] > 0:
+            self.init_immunity(self.immunities.astype(np.uint8), self.immunity_periods.astype(np.int32))
+        else:
+            self.init_immunity()
+        self.set_move_buckets()
+        self.set_backend(backend)
+        self.set_random_streams()
 
 
     def from_arrays(self, cell_ids, attractivities, unsafeties, xcoords, ycoords, unique_state_ids, 
         unique_contagiousities, unique_sensitivities, unique_severities, transitions, agent_ids, home_cell_ids, p_moves, least_state_ids,
-        current_state_ids, current_state_durations, durations, transitions_ids, dscale=1, current_period=0, verbose=0):
-        """ to initialize a map directly from the arrays """
-
+        current_state_ids, current_state_durations, durations, transitions_ids, dscale=1, current_period=0, verbose=0,
+        seed=None, rngs=None, backend='numpy', probability_bits=None, square_sampling='matrix', square_size=1,
+        max_cells_per_square=None, move_mode='home', p_return_home=0, cell_capacities=None, attractivity_profiles=None,
+        profile_schedule=None, mobility_class_ids=None, class_dscales=None, class_attractivity_weights=None):
+        """ to initialize a map directly from the (numpy) arrays. `seed` and `rngs`: see `set_random_streams`,
+        `backend`: see `set_backend`.
+        `probability_bits`: 16 or 32 to store the probabilities of moving, of contamination (unsafeties,
+        contagiousities, sensitivities) and the cumulated sampling probabilities of the moves as fixed-point
+        unsigned integers of this size, drawn against random integers. Halves (16 bits) the memory traffic of
+        the moves compared to float32 probabilities. Each probability is rounded to a multiple of 2 ** -bits,
+        and a product of probabilities rounded down: an event whose probability is a product of k probabilities
+        happens with a probability differing from the float one by less than k * 2 ** -bits
+        (6e-5 with 16 bits for contaminations). None (default): float32 probabilities.
+        `square_sampling`: how the squares where the agents move are drawn. 'matrix' (default): from the
+        probabilities between all the squares, memory quadratic in the number of squares. 'tree': by descending
+        a quadtree of the squares (see `descend_square_tree`), memory linear in the number of squares and
+        O(log n_squares) by move, for large maps. Same sampling between neighbouring squares, approximated
+        for the farther ones.
+        `square_size`: side of the squares grouping the cells (in the unit of the coordinates). With
+        `max_cells_per_square`, the grid adapts to the density: dense squares are split and sparse ones merged so that
+        the squares hold at most this number of cells (see `utils.squarify`), bounding the width of the cell sampling
+        probabilities and the number of squares.
+        `move_mode` and `p_return_home`: see `set_move_mode`.
+        `cell_capacities`: maximum number of agents in each cell, the moves to full cells being drawn again (see
+        `fit_capacities`). None (default): no limit.
+        `attractivity_profiles` and `profile_schedule`: attractivities changing from a move to the next, see
+        `set_attractivity_profiles`.
+        `mobility_class_ids`, `class_dscales` and `class_attractivity_weights`: agents moving differently, see
+        `set_mobility_classes` """
+        if square_sampling not in SQUARE_SAMPLINGS:
+            raise ValueError(f'square_sampling must be one of {SQUARE_SAMPLINGS}, not {square_sampling}')
+        (cell_ids, attractivities, unsafeties, xcoords, ycoords, agent_ids, home_cell_ids, p_moves, least_state_ids, current_state_ids,
+         current_state_durations, transitions_ids) = [np.ravel(value) for value in (cell_ids, attractivities, unsafeties, xcoords, ycoords,
+         agent_ids, home_cell_ids, p_moves, least_state_ids, current_state_ids, current_state_durations, transitions_ids)]
+        self.backend = get_backend(backend)
+        self.xp = self.backend.xp
+        self.workspace = Workspace()
+        self.set_probability_bits(probability_bits)
+        self.square_sampling = square_sampling
+        self.set_move_mode(move_mode, p_return_home)
+        self.square_size = square_size
+        self.max_cells_per_square = max_cells_per_square
         self.current_period = current_period
         self.verbose = verbose
         self.dscale = dscale
+        self.p_mask = 0
         self.n_infected_period = 0
-        # For cells
+        # For cells, coordinates and attractivities stay in numpy: they are only used to build the sampling structures
         self.cell_ids = cell_ids
         self.attractivities = attractivities
-        self.unsafeties = unsafeties
+        self.unsafeties = self.to_probabilities(unsafeties)
+        self.set_cell_capacities(cell_capacities)
         self.xcoords = xcoords
         self.ycoords = ycoords
         # For states
-        self.unique_state_ids = unique_state_ids
-        self.unique_contagiousities = unique_contagiousities
-        self.unique_sensitivities = unique_sensitivities
-        self.unique_severities = unique_severities
-        self.transitions = transitions
+        self.unique_state_ids = self.asarray(unique_state_ids)
+        self.unique_contagiousities = self.to_probabilities(unique_contagiousities)
+        self.unique_sensitivities = self.to_probabilities(unique_sensitivities)
+        self.unique_severities = self.asarray(unique_severities, dtype=np.float32)
+        self.unique_mobilities = self.get_mobilities(unique_severities)
+        # `transitions` has one matrix (in depth) by transitions id, `transitions_ids` gives the one of each agent
+        # Compute upfront cumulated sum
+        self.transitions = np.cumsum(transitions, axis=1)
+        self.transition_rows = self.asarray(self.get_transition_rows(self.transitions))
         # For agents
-        self.agent_ids = agent_ids
-        self.home_cell_ids = home_cell_ids
-        self.p_moves = p_moves
-        self.least_state_ids = least_state_ids
-        self.current_state_ids = current_state_ids
-        self.current_state_durations = current_state_durations  # how long the agents are already in their current state
-        self.durations = np.squeeze(durations) # 2d, one row for each agent
-        # self.current_state_durations = np.minimum(self.current_state_durations, self.durations)
-        self.transitions_ids = transitions_ids
-
-        # for cells: cell_ids, attractivities, unsafeties, xcoords, ycoords
-        # for states: unique_contagiousities, unique_sensitivities, unique_severities, transitions
-        # for agents: home_cell_ids, p_moves, least_state_ids, current_state_ids, current_state_durations, durations (3d)
-        
+        durations = np.squeeze(durations)  # 2d, one row for each agent
+        self.agent_ids = self.asarray(agent_ids, dtype=np.uint32)
+        self.home_cell_ids = self.asarray(home_cell_ids)
+        self.p_moves = self.to_probabilities(p_moves)
+        self.set_move_buckets()
+        self.least_state_ids = self.asarray(least_state_ids)
+        self.current_state_ids = self.asarray(current_state_ids)
+        # how long the agents are already in their current state, compared to `durations`
+        self.current_state_durations = self.asarray(current_state_durations, dtype=durations.dtype)
+        self.durations = self.asarray(durations)
+        self.transitions_ids = self.asarray(transitions_ids)
+        self.set_mobility_classes(mobility_class_ids, class_dscales, class_attractivity_weights)
+        self.set_testing()
+        self.set_immunity()
+
         # Compute inter-squares proba transition matrix
-        self.coords_squares, self.square_ids_cells = squarify(xcoords, ycoords)
+        self.coords_squares, self.square_ids_cells = squarify(xcoords, ycoords, square_size, max_cells_per_square,
+                                                             SQUARE_MAX_SPLITS, SQUARE_MAX_MERGES)
         self.set_attractivities(attractivities)
+        self.set_attractivity_profiles(attractivity_profiles, profile_schedule)
         
         # the first cells in parameter `cells`must be home cell, otherwise modify here
-        self.agent_squares = self.square_ids_cells[self.home_cell_ids]  
-        # Re-order transitions by ids
-        order = np.argsort(self.transitions_ids)
-        self.transitions_ids = self.transitions_ids[order]
-        self.transitions = self.transitions[:,:, transitions_ids]
-        # Compute upfront cumulated sum
-        self.transitions = np.cumsum(self.transitions, axis=1)
+        self.agent_squares = self.asarray(self.square_ids_cells[home_cell_ids])
+        self.cell_squares = self.asarray(self.square_ids_cells, dtype=np.uint32)
+        self.current_cell_ids = self.asarray(home_cell_ids, dtype=np.uint32)
+        self.current_square_ids = self.xp.astype(self.agent_squares, self.xp.uint32)
+
+        # Keep initial dynamic state for `reset`
+        self.initial_current_period = current_period
+        self.initial_current_state_ids = self.xp.asarray(self.current_state_ids, copy=True)
+        self.initial_current_state_durations = self.xp.asarray(self.current_state_durations, copy=True)
+        self.init_dynamic_state()
+        self.set_random_streams(seed, rngs)
 
-        # Compute probas_move for agent selection
+
+    def init_dynamic_state(self):
+        """ (re-)initialize the variables evolving during the simulation, except the current states """
+        self.n_infected_period = 0
         # Define variable for monitoring the propagation (r factor, contagion chain)
         self.n_contaminated_period = 0  # number of agent contaminated during current period
         self.n_diseased_period = self.get_n_diseased()
         self.r_factors = np.array([])
-        # TODO: Contagion chains
         # Define arrays for agents state transitions
-        self.infecting_agents, self.infected_agents, self.infected_periods = np.array([]), np.array([]), np.array([])
+        self.infecting_agents = self.xp.zeros((0,), dtype=self.xp.uint32)
+        self.infected_agents = self.xp.zeros((0,), dtype=self.xp.uint32)
+        self.infected_periods = self.xp.zeros((0,), dtype=self.xp.int32)
+        self.move_index = 0  # number of moves done in the current period
+        self.init_flags()
+        self.init_isolation()
+        self.init_immunity()
+        self.init_locations()
+
+
+    def reset(self, **changed):
+        """ Put the map back in its initial state to run a new simulation on it (e.g. next calibration round)
+        without rebuilding it. `changed` takes any argument of `from_arrays`: arrays keeping their shape are
+        overwritten in place and only the structures derived from the changed arguments are recomputed
+        (squares for coordinates, sampling matrices for attractivities and `dscale`, etc.).
+        Current states and durations are set back to the ones given to `from_arrays` (or in `changed`). The random
+        streams built from a `seed` start again from the beginning, not the generators given in `rngs` """
+        unknown = set(changed.keys()) - set(inspect.signature(self.from_arrays).parameters.keys())
+        if unknown:
+            raise ValueError(f'unknown parameters for reset: {sorted(unknown)}')
+        for name, value in changed.items():
+            if name in VECTOR_PARAMETERS:
+                value = changed[name] = np.ravel(value)
+            if name == 'transitions':
+                self.transitions = np.cumsum(value, axis=1)
+                self.transition_rows = self.asarray(self.get_transition_rows(self.transitions))
+            elif name == 'durations':
+                self.durations = self.update_array(self.durations, np.squeeze(value))
+            elif name == 'current_state_ids':
+                self.initial_current_state_ids = self.update_array(self.initial_current_state_ids, value)
+            elif name == 'current_state_durations':
+                self.initial_current_state_durations = self.update_array(self.initial_current_state_durations, value)
+            elif name == 'current_period':
+                self.initial_current_period = value
+            elif name in ['seed', 'rngs']:
+                continue
+            elif name == 'backend':
+                self.set_backend(value)
+            elif name == 'square_sampling':
+                if value not in SQUARE_SAMPLINGS:
+                    raise ValueError(f'square_sampling must be one of {SQUARE_SAMPLINGS}, not {value}')
+                self.square_sampling = value
+            elif name == 'cell_capacities':
+                self.set_cell_capacities(value)
+            elif name in ['attractivity_profiles', 'profile_schedule'] + list(CLASS_PARAMETERS):
+                continue
+            elif name in ['move_mode', 'p_return_home']:
+                self.set_move_mode(changed.get('move_mode', self.move_mode), changed.get('p_return_home', self.p_return_home))
+            elif name == 'probability_bits':
+                if value != self.probability_bits:
+                    raise ValueError('probability_bits can\'t be changed by reset, the map must be rebuilt')
+            elif name in PROBABILITY_ARRAYS:
+                setattr(self, name, self.update_array(getattr(self, name), self.backend.to_numpy(self.to_probabilities(value))))
+            elif name == 'unique_severities':
+                self.unique_severities = self.update_array(self.unique_severities, value)
+                self.unique_mobilities = self.update_array(self.unique_mobilities, self.backend.to_numpy(self.get_mobilities(value)))
+            elif isinstance(value, np.ndarray):
+                setattr(self, name, self.update_array(getattr(self, name), value))
+            else:
+                setattr(self, name, value)
+        # Recompute only the derived structures whose inputs changed
+        coords_changed = len({'xcoords', 'ycoords', 'square_size', 'max_cells_per_square'} & set(changed.keys())) > 0
+        if coords_changed:
+            self.coords_squares, self.square_ids_cells = squarify(self.xcoords, self.ycoords, self.square_size, self.max_cells_per_square,
+                                                                 SQUARE_MAX_SPLITS, SQUARE_MAX_MERGES)
+        if coords_changed or ('home_cell_ids' in changed):
+            self.agent_squares = self.asarray(self.square_ids_cells[self.backend.to_numpy(self.home_cell_ids)])
+        if coords_changed:
+            self.cell_squares = self.asarray(self.square_ids_cells, dtype=np.uint32)
+        classes_changed = len(set(CLASS_PARAMETERS) & set(changed.keys())) > 0
+        if classes_changed:
+            # the class parameters not given stay
+            class_params = {name: changed.get(name, getattr(self, name) if getattr(self, name).shape[0] > 0 else None) for name in CLASS_PARAMETERS}
+            if class_params['class_dscales'] is None and class_params['class_attractivity_weights'] is None and 'mobility_class_ids' not in changed:
+                # no classes anymore, their ids go with them
+                class_params['mobility_class_ids'] = None
+            self.set_mobility_classes(**class_params)
+        if coords_changed or classes_changed or ('attractivities' in changed) or ('cell_ids' in changed):
+            self.set_attractivities(self.attractivities)
+        elif ('dscale' in changed) or ('square_sampling' in changed):
+            self.set_square_sampling_probas()
+            self.set_class_structures(self.attractivities)
+        sampling_changed = coords_changed or classes_changed or len({'attractivities', 'cell_ids', 'dscale', 'square_sampling'} & set(changed.keys())) > 0
+        if ('attractivity_profiles' in changed) or (sampling_changed and self.attractivity_profiles.shape[0] > 0):
+            self.set_attractivity_profiles(changed.get('attractivity_profiles', self.attractivity_profiles),
+                                           changed.get('profile_schedule', self.profile_schedule))
+        elif 'profile_schedule' in changed:
+            self.set_profile_schedule(changed['profile_schedule'])
+        if 'p_moves' in changed:
+            self.set_move_buckets()
+        # Dynamic state
+        self.current_period = self.initial_current_period
+        self.current_state_ids = self.update_array(self.current_state_ids, self.initial_current_state_ids)
+        self.current_state_durations = self.update_array(self.current_state_durations, self.initial_current_state_durations)
+        self.init_dynamic_state()
+        self.set_random_streams(changed.get('seed', self.seed), changed.get('rngs', self.explicit_rngs))
+
+
+    def set_random_streams(self, seed=None, rngs=None):
+        """ Each subsystem draws from its own random stream: 'move' (moving agents and their destinations),
+        'contamination', 'transition' (new states and tracing), 'mask', 'policy' (draws of the actions of
+        `policies.Policy`) and 'testing' (see `set_testing`). Two maps with the same `seed` use
+        common random numbers, e.g. to compare scenarios with much fewer replicas.
+        With a `seed`, the streams are counter-based (Philox) and re-positioned at each step (move or end of period)
+        on a counter depending only on the period and the step: what a step draws doesn't depend on how many
+        values the previous steps drew, so scenarios keep sharing their random numbers after they diverge.
+        `rngs`: stream name -> `numpy.random.Generator`, used as is (not re-positioned) instead of the seeded stream.
+        Without `seed` nor `rngs`, all draws are done with numpy's global random state """
+        rngs = dict(rngs) if rngs is not None else {}
+        unknown = set(rngs.keys()) - set(RANDOM_STREAMS)
+        if unknown:
+            raise ValueError(f'unknown random streams: {sorted(unknown)}, possible ones: {RANDOM_STREAMS}')
+        self.seed = seed
+        self.explicit_rngs = rngs
+        self.stream_keys = {}
+        if seed is not None:
+            seed_seqs = np.random.SeedSequence(seed).spawn(len(RANDOM_STREAMS))
+            self.stream_keys = {stream: seed_seq.generate_state(2, np.uint64) for stream, seed_seq in zip(RANDOM_STREAMS, seed_seqs)}
+        self.rngs = {}
+        self.set_step(self.move_index)
+
+    def set_step(self, step, streams=RANDOM_STREAMS):
+        """ position the random `streams` for the draws of `step` in the current period """
+        for stream in streams:
+            if stream in self.explicit_rngs:
+                self.rngs[stream] = self.explicit_rngs[stream]
+            elif stream in self.stream_keys:
+                counter = np.array([0, 0, step, self.current_period], dtype=np.uint64)
+                self.rngs[stream] = np.random.Generator(np.random.Philox(counter=counter, key=self.stream_keys[stream]))
+            else:
+                self.rngs[stream] = np.random
+
+    def draw(self, stream, n, out=None):
+        """ `n` uniform draws in [0, 1) from the random `stream`, as an array of the backend. Draws are done
+        with numpy whatever the backend, so that a seed gives the same simulation on all backends.
+        `out`: name of the workspace buffer to draw in """
+        rng = self.rngs[stream]
+        buffer = self.buffer(out, (n,), np.float64)
+        if buffer is not None and isinstance(rng, np.random.Generator):
+            return rng.random(out=buffer)
+        return self.backend.asarray(rng.uniform(size=n))
+
+
+    def init_flags(self, traced_flags=None):
+        """ Per-agent flags, packed 8 by byte (layout of `np.packbits`): contagious and sensitive (from the current
+        states, kept up to date by `refresh_flags`), traced (see `change_state_agents`, `traced_flags` or none) """
+        xp = self.xp
+        self.contagious_flags = pack_bits(xp.take(self.unique_contagiousities > 0, self.current_state_ids), xp)
+        self.sensitive_flags = pack_bits(xp.take(self.unique_sensitivities > 0, self.current_state_ids), xp)
+        if traced_flags is None:
+            traced_flags = xp.zeros(self.contagious_flags.shape, dtype=xp.uint8)
+        self.traced_flags = traced_flags
+        self.any_traced = bool(xp.any(traced_flags != 0))
+
+    def get_flag_bytes(self, agent_ids):
+        """ bytes holding the flags of `agent_ids` (sorted) and the ids of all the agents of these bytes """
+        xp = self.xp
+        flag_bytes = xp.sort(xp.unique_values(xp.astype(agent_ids, xp.int64) >> 3))
+        members = xp.reshape(flag_bytes[:, None] * 8 + xp.arange(8, dtype=xp.int64), (-1,))
+        return flag_bytes, members
+
+    def refresh_flags(self, agent_ids):
+        """ recompute the state flags of `agent_ids` (and of the agents sharing their bytes) after a change of
+        their states """
+        xp = self.xp
+        if agent_ids.shape[0] == 0:
+            return
+        n_agents = self.agent_ids.shape[0]
+        flag_bytes, members = self.get_flag_bytes(agent_ids)
+        # the last byte can hold less than 8 agents
+        valid = members < n_agents
+        states = xp.take(self.current_state_ids, xp.minimum(members, n_agents - 1))
+        contagious = xp.take(self.unique_contagiousities > 0, states) & valid
+        sensitive = xp.take(self.unique_sensitivities > 0, states) & valid
+        self.contagious_flags = self.backend.put(self.contagious_flags, flag_bytes, pack_bits(contagious, xp))
+        self.sensitive_flags = self.backend.put(self.sensitive_flags, flag_bytes, pack_bits(sensitive, xp))
+
+    def set_flags(self, flags, agent_ids, value):
+        """ `flags` (packed) with the ones of `agent_ids` set to `value` """
+        xp = self.xp
+        if agent_ids.shape[0] == 0:
+            return flags
+        flag_bytes, members = self.get_flag_bytes(agent_ids)
+        bits = get_bits(flags, get_bit_positions(members, xp), xp)
+        agent_ids = xp.unique_values(xp.astype(agent_ids, xp.int64))
+        # position of each agent in `members`
+        positions = xp.searchsorted(flag_bytes, agent_ids >> 3) * 8 + (agent_ids & 7)
+        bits = self.backend.put(bits, positions, value)
+        return self.backend.put(flags, flag_bytes, pack_bits(bits, xp))
+
+    def set_traced(self, agent_ids):
+        """ flag `agent_ids` as traced """
+        if agent_ids.shape[0] == 0:
+            return
+        self.traced_flags = self.set_flags(self.traced_flags, agent_ids, True)
+        self.any_traced = True
+
+    def restrict_moves(self, probas_move, agent_ids):
+        """ `probas_move` of `agent_ids` updated in place for the traced and isolated agents """
+        if self.any_traced:
+            self.apply_tracing(probas_move, agent_ids)
+        if self.any_isolated:
+            isolated = get_bits(self.isolated_flags, get_bit_positions(agent_ids, self.xp), self.xp)
+            probas_move[isolated] = 0
+
+    def apply_tracing(self, probas_move, agent_ids):
+        """ divide in place the `probas_move` of `agent_ids` that are traced """
+        traced = get_bits(self.traced_flags, get_bit_positions(agent_ids, self.xp), self.xp)
+        if self.probability_bits is None:
+            probas_move[traced] = probas_move[traced] / TRACED_P_MOVE_DIVISOR
+        else:
+            probas_move[traced] = probas_move[traced] // TRACED_P_MOVE_DIVISOR
+
+
+    def set_testing(self, n_tests_per_period=0, state_weights=None, demography_weights=None, detected_state_ids=None,
+                    p_detect=1, isolation_duration=ISOLATION_DURATION, isolate_traced=False):
+        """ At the end of each period, `n_tests_per_period` agents are tested (the budget), drawn among the agents not
+        isolated with probabilities proportional to the weight of their state (`state_weights`, in the order of
+        `unique_state_ids`, e.g. higher for symptomatic states) times the one of their demography
+        (`demography_weights`, by transitions id). Default weights: 1. The tested agents in `detected_state_ids`
+        (default: the contagious states) are positive with probability `p_detect`, and isolated for
+        `isolation_duration` periods: they don't move, and infect nobody (at home neither). With `isolate_traced`,
+        the traced agents (see `change_state_agents`) are isolated the same way instead of moving less for good.
+        The tests are drawn from the 'testing' random stream """
+        n_states = self.unique_state_ids.shape[0]
+        n_demographies = int(self.xp.max(self.transitions_ids)) + 1
+        if state_weights is None:
+            state_weights = np.ones(n_states)
+        if demography_weights is None:
+            demography_weights = np.ones(n_demographies)
+        if detected_state_ids is None:
+            detected = self.backend.to_numpy(self.unique_contagiousities) > 0
+        else:
+            detected = np.isin(self.backend.to_numpy(self.unique_state_ids), detected_state_ids)
+        self.n_tests_per_period = n_tests_per_period
+        self.unique_test_weights = self.asarray(state_weights, dtype=np.float32)
+        self.demography_test_weights = self.asarray(demography_weights, dtype=np.float32)
+        self.unique_detectable = self.asarray(detected)
+        self.p_detect = p_detect
+        self.isolation_duration = isolation_duration
+        self.isolate_traced = isolate_traced
+
+    def get_testing(self):
+        """ the parameters of `set_testing` """
+        return {'n_tests_per_period': self.n_tests_per_period, 'state_weights': self.backend.to_numpy(self.unique_test_weights),
+                'demography_weights': self.backend.to_numpy(self.demography_test_weights),
+                'detected_state_ids': self.backend.to_numpy(self.unique_state_ids)[self.backend.to_numpy(self.unique_detectable)],
+                'p_detect': self.p_detect, 'isolation_duration': self.isolation_duration, 'isolate_traced': self.isolate_traced}
+
+    def init_isolation(self, isolated_agents=None, isolation_ends=None):
+        """ isolated agents (none by default) and the periods their isolation ends """
+        xp = self.xp
+        if isolated_agents is None:
+            isolated_agents, isolation_ends = xp.zeros((0,), dtype=xp.uint32), xp.zeros((0,), dtype=xp.int32)
+        self.isolated_agents, self.isolation_ends = isolated_agents, isolation_ends
+        self.isolated_flags = self.set_flags(xp.zeros(self.contagious_flags.shape, dtype=xp.uint8), isolated_agents, True)
+        self.any_isolated = isolated_agents.shape[0] > 0
+
+    def isolate(self, agent_ids, duration=None):
+        """ isolate `agent_ids` until the end of the period `duration` periods after the current one (default
+        duration: the one of `set_testing`) """
+        xp = self.xp
+        if agent_ids.shape[0] == 0:
+            return
+        duration = self.isolation_duration if duration is None else duration
+        agent_ids = xp.unique_values(xp.astype(agent_ids, xp.uint32))
+        ends = xp.full(agent_ids.shape, self.current_period + duration, dtype=xp.int32)
+        # an agent isolated again stays isolated until the latest of its ends
+        positions = xp.clip(xp.searchsorted(agent_ids, self.isolated_agents), max=agent_ids.shape[0] - 1)
+        again = xp.take(agent_ids, positions) == self.isolated_agents
+        positions = positions[again]
+        ends = self.backend.put(ends, positions, xp.maximum(self.isolation_ends[again], xp.take(ends, positions)))
+        self.isolated_agents = xp.concat([self.isolated_agents[~again], agent_ids])
+        self.isolation_ends = xp.concat([self.isolation_ends[~again], ends])
+        self.isolated_flags = self.set_flags(self.isolated_flags, agent_ids, True)
+        self.any_isolated = True
+
+    def release_isolated(self):
+        """ end the isolations ending at the current period """
+        xp = self.xp
+        if not self.any_isolated:
+            return
+        ended = self.isolation_ends <= self.current_period
+        self.isolated_flags = self.set_flags(self.isolated_flags, self.isolated_agents[ended], False)
+        self.isolated_agents, self.isolation_ends = self.isolated_agents[~ended], self.isolation_ends[~ended]
+        self.any_isolated = self.isolated_agents.shape[0] > 0
+
+    def test_agents(self):
+        """ test the agents and isolate the positive ones, see `set_testing` """
+        xp = self.xp
+        rng = self.rngs['testing']
+        weights = xp.take(self.unique_test_weights, self.current_state_ids) * xp.take(self.demography_test_weights, self.transitions_ids)
+        if self.any_isolated:
+            weights = xp.where(get_bits(self.isolated_flags, get_bit_positions(self.agent_ids, xp), xp), xp.zeros_like(weights), weights)
+        candidates = xp.nonzero(weights > 0)[0]
+        weights = xp.take(weights, candidates)
+        # weighted draw without replacement: the agents with the smallest exponential keys of rates `weights`
+        keys = self.asarray(rng.standard_exponential(candidates.shape[0]), dtype=np.float32) / weights
+        tested = xp.take(candidates, self.backend.argsmallest(keys, self.n_tests_per_period))
+        positive = xp.take(self.unique_detectable, xp.take(self.current_state_ids, tested))
+        positive = positive & (self.asarray(rng.random(tested.shape[0])) < self.p_detect)
+        if self.profiler is not None:
+            self.profiler.set(n_tested=tested.shape[0], n_positive=int(xp.count_nonzero(positive)))
+        self.isolate(tested[positive])
+
+    def set_immunity(self, half_life=None, infection_immunity=0):
+        """ Immunity of the agents (vaccinated, see `immunize` and `policies.Vaccinate`, or infected with `infection_immunity` > 0): the
+        sensitivity of an agent is multiplied by `1 - immunity`, the immunity halving every `half_life` periods since
+        the agent got it (None: no waning). An infection gives the immunity `infection_immunity`, only useful when
+        the agents recovering get back to sensitive states (the sensitivity of the states stays: a recovered state
+        with sensitivity 0 is immune for good) """
+        self.immunity_half_life = half_life
+        self.infection_immunity = infection_immunity
+
+    def init_immunity(self, immunities=None, immunity_periods=None):
+        """ Immunity of the agents (none by default): level at the period they got it, out of `MAX_IMMUNITY`
+        (uint8), and this period (int32, as `isolation_ends`). The waning is computed from them when the immunity
+        is used, the agents are not updated at each period """
+        xp = self.xp
+        if immunities is None:
+            immunities = xp.zeros(self.agent_ids.shape, dtype=xp.uint8)
+            immunity_periods = xp.zeros(self.agent_ids.shape, dtype=xp.int32)
+        self.immunities, self.immunity_periods = immunities, immunity_periods
+        self.any_immune = bool(xp.any(immunities != 0))
+
+    def get_immunities(self, agent_ids):
+        """ current immunities (float64, 0 to 1) of `agent_ids` """
+        xp = self.xp
+        immunities = xp.astype(xp.take(self.immunities, agent_ids), xp.float64) / MAX_IMMUNITY
+        if self.immunity_half_life is None:
+            return immunities
+        elapsed = self.current_period - xp.astype(xp.take(self.immunity_periods, agent_ids), xp.float64)
+        return immunities * 2 ** (-elapsed / self.immunity_half_life)
+
+    def get_susceptibilities(self, agent_ids):
+        """ `1 - immunity` of `agent_ids`, factors of the probabilities in the type of their products (see `widen`) """
+        xp = self.xp
+        susceptibilities = 1 - self.get_immunities(agent_ids)
+        if self.probability_bits is None:
+            return xp.astype(susceptibilities, xp.float32)
+        # fixed-point up to `2 ** bits` included (the product type has room for it): the probabilities of the
+        # agents without immunity stay exactly the same
+        return xp.astype(xp.round(susceptibilities * 2 ** self.probability_bits), self.probability_product_dtype)
+
+    def immunize(self, agent_ids, immunity):
+        """ give `agent_ids` the immunity `immunity` (0 to 1) from the current period, unless theirs is higher """
+        xp = self.xp
+        if agent_ids.shape[0] == 0:
+            return
+        agent_ids = xp.unique_values(agent_ids)
+        immunities = xp.maximum(self.get_immunities(agent_ids), xp.full(agent_ids.shape, float(immunity), dtype=xp.float64))
+        immunities = xp.astype(xp.round(immunities * MAX_IMMUNITY), xp.uint8)
+        self.immunities = self.backend.put(self.immunities, agent_ids, immunities)
+        self.immunity_periods = self.backend.put(self.immunity_periods, agent_ids, self.current_period)
+        self.any_immune = self.any_immune or bool(xp.any(immunities != 0))
+
+    def draw_probabilities(self, stream, n, out=None):
+        """ `n` draws from the random `stream` to compare with probabilities as stored by the map: uniform
+        in [0, 1), or uniform integers in [0, 2 ** probability_bits) in the quantized mode """
+        if self.probability_bits is None:
+            return self.draw(stream, n, out)
+        return self.get_random_probabilities(self.rngs[stream], n)
+
+    def get_random_probabilities(self, rng, n):
+        """ see `draw_probabilities`, drawing from `rng` (`numpy.random.Generator` or `numpy.random`) """
+        if self.probability_bits is None:
+            return self.backend.asarray(rng.uniform(size=n))
+        integers = rng.integers if isinstance(rng, np.random.Generator) else rng.randint
+        return self.backend.asarray(integers(0, 2 ** self.probability_bits, size=n, dtype=self.probability_dtype))
+
+
+    def set_probability_bits(self, probability_bits):
+        """ storage of the probabilities, see `from_arrays` """
+        if probability_bits is not None and probability_bits not in PROBABILITY_DTYPES:
+            raise ValueError(f'probability_bits must be None or one of {sorted(PROBABILITY_DTYPES.keys())}, not {probability_bits}')
+        self.probability_bits = probability_bits
+        self.probability_dtype, self.probability_product_dtype = PROBABILITY_DTYPES.get(probability_bits, (np.float32, np.float32))
+
+    def to_probabilities(self, probabilities):
+        """ numpy array of `probabilities` as stored by the map: float32 or fixed-point integers """
+        if self.probability_bits is None:
+            return self.asarray(probabilities, dtype=np.float32)
+        one = 2 ** self.probability_bits
+        # a probability of 1 is stored as 1 - 2 ** -bits: the draws are below it but one in 2 ** bits
+        fixed = np.minimum(np.rint(np.asarray(probabilities, dtype=np.float64) * one), one - 1)
+        return self.asarray(fixed, dtype=self.probability_dtype)
+
+    def get_probabilities(self, probabilities):
+        """ float64 numpy array of the `probabilities` stored by the map (see `to_probabilities`) """
+        probabilities = np.asarray(self.backend.to_numpy(probabilities), dtype=np.float64)
+        if self.probability_bits is not None:
+            probabilities = probabilities / 2 ** self.probability_bits
+        return probabilities
+
+    def get_mobilities(self, severities):
+        """ probabilities `1 - severities` (factor of `p_moves`) in the type of the products of probabilities """
+        if self.probability_bits is None:
+            # computed in float32 as `1 - severity` is during the moves
+            return self.asarray(1 - np.asarray(severities, dtype=np.float32), dtype=np.float32)
+        return self.xp.astype(self.to_probabilities(1 - np.asarray(severities, dtype=np.float64)), self.probability_product_dtype)
+
+    def widen(self, probabilities, out=None):
+        """ `probabilities` in the type of their products (see `multiply_probabilities`), in the workspace
+        buffer `out` if any. Returns `probabilities` themselves in float mode """
+        if self.probability_bits is None:
+            return probabilities
+        buffer = self.buffer(out, probabilities.shape, self.probability_product_dtype)
+        if buffer is None:
+            return self.xp.astype(probabilities, self.probability_product_dtype)
+        buffer[...] = probabilities
+        return buffer
+
+    def multiply_probabilities(self, res, probabilities):
+        """ `res *= probabilities` in place, `res` having the type of the products (see `widen`) """
+        res *= probabilities
+        if self.probability_bits is not None:
+            res >>= self.probability_bits
+
+
+    def set_backend(self, backend):
+        """ Move the simulation to another array library: name of a backend registered in `backends`
+        ('numpy', 'cupy', 'array_api_strict'...) or a `backends.Backend` instance """
+        backend = get_backend(backend)
+        if self.executor is not None and backend.name != 'numpy':
+            raise ValueError(f'executors only run with the numpy backend, not {backend.name}')
+        for name in BACKEND_ARRAYS:
+            setattr(self, name, backend.asarray(self.backend.to_numpy(getattr(self, name))))
+        for structures in self.get_sampling_structures():
+            for name in set(structures.keys()) & set(BACKEND_ARRAYS):
+                structures[name] = backend.asarray(self.backend.to_numpy(structures[name]))
+        self.cell_index = None
+        self.backend = backend
+        self.xp = backend.xp
+
+    def take(self, arr, indices, out=None):
+        """ `arr[indices]` along the first axis of `arr`, by chunks on the threads of the executor if any.
+        `out`: name of the workspace buffer of the result """
+        buffer = self.buffer(out, indices.shape + arr.shape[1:], arr.dtype)
+        if self.executor is None:
+            return self.backend.take(arr, indices, out=buffer)
+        return self.executor.take(arr, indices, out=buffer)
+
+    def compress(self, mask, arr, out=None):
+        """ `arr[mask]`, `out`: name of the workspace buffer of the result """
+        if not self.uses_workspace(out):
+            return arr[mask]
+        return self.backend.compress(mask, arr, out=self.workspace.get(out, (int(np.count_nonzero(mask)),) + arr.shape[1:], arr.dtype))
+
+    def empty(self, name, shape, dtype):
+        """ workspace buffer `name` if any, otherwise a new array """
+        if self.uses_workspace(name):
+            return self.workspace.get(name, shape, dtype)
+        return self.xp.empty(shape, dtype=dtype)
+
+    def buffer(self, name, shape, dtype):
+        """ workspace buffer `name` for a result of `shape` and `dtype`, None if the map has no workspace
+        (or its backend can't write in existing arrays) """
+        if not self.uses_workspace(name):
+            return None
+        return self.workspace.get(name, shape, dtype)
+
+    def uses_workspace(self, name):
+        return name is not None and self.workspace is not None and self.backend.supports_out
+
+    def set_workspace(self, workspace):
+        """ `workspace.Workspace` whose buffers are reused for the temporaries of the moves and contaminations
+        (numpy backend), None to allocate them at each move. Maps have one by default """
+        self.workspace = workspace
+
+    def asarray(self, x, dtype=None):
+        """ copy of the numpy array (or list, scalar) `x` as an array of the backend: the map updates its
+        arrays in place, they must not be shared with the caller (nor with another map) """
+        return self.backend.asarray(np.array(x, dtype=dtype))
+
+    def update_array(self, arr, value):
+        """ copy `value` in `arr` if they have the same shape (no reallocation), otherwise return a copy of `value` """
+        if isinstance(arr, np.ndarray):
+            if arr.shape == value.shape:
+                np.copyto(arr, value, casting='unsafe')
+                return arr
+            return value.astype(arr.dtype)
+        return self.backend.update(arr, value)
+
+    @staticmethod
+    def get_transition_rows(transitions):
+        """ `transitions` (one matrix in depth by transitions id) as one row by (transitions id, state):
+        the row of state `s` with transitions `t` is `t * n_states + s` """
+        n_states = transitions.shape[1]
+        return np.ascontiguousarray(np.transpose(transitions, (2, 0, 1)).reshape(-1, n_states))
 
 
     # For calibration: reset parameters that can change due to public policies
 
     def set_p_moves(self, p_moves):
-        self.p_moves = p_moves
+        self.p_moves = self.to_probabilities(p_moves)
+        self.set_move_buckets()
+
+    def set_move_buckets(self):
+        """ Group the agents by the smallest power of 2 `2 ** -k` above their p_move (bucket `k`, the last
+        bucket taking all the smaller p_moves), for `select_movers`. Agents with a p_move of 0 are in no bucket """
+        p_moves = self.get_probabilities(self.p_moves)
+        mantissas, exponents = np.frexp(p_moves)
+        buckets = np.minimum(np.where(mantissas == .5, 1 - exponents, -exponents), N_MOVE_BUCKETS - 1)
+        buckets[p_moves == 0] = N_MOVE_BUCKETS
+        order = np.argsort(buckets, kind='stable')
+        self.move_bucket_counts = np.bincount(buckets, minlength=N_MOVE_BUCKETS + 1)[:N_MOVE_BUCKETS]
+        self.move_bucket_agents = self.asarray(self.backend.to_numpy(self.agent_ids)[order[:self.move_bucket_counts.sum()]])
+        # `2 ** k`, factor of the probabilities of the candidates of bucket `k`
+        self.move_bucket_factors = self.asarray(2 ** np.arange(N_MOVE_BUCKETS), dtype=self.probability_product_dtype)
+        self.n_move_candidates = float(np.sum(self.move_bucket_counts * 2. ** -np.arange(N_MOVE_BUCKETS)))
 
     def set_unsafeties(self, unsafeties):
-        self.unsafeties = unsafeties
+        self.unsafeties = self.to_probabilities(unsafeties)
+
+    def set_cell_capacities(self, cell_capacities):
+        """ `cell_capacities`: see `from_arrays`, None to remove the limits """
+        if cell_capacities is None:
+            cell_capacities = np.zeros(0)
+        self.cell_capacities = self.asarray(cell_capacities, dtype=np.uint32)
 
     def set_attractivities(self, attractivities):
+        self.set_sampling_structures(attractivities)
+        self.set_class_structures(attractivities)
+
+    def set_sampling_structures(self, attractivities):
+        """ the sampling structures of the moves (`SAMPLING_ATTRIBUTES`) for `attractivities` """
         self.attractivities = attractivities
-        self.square_sampling_probas = get_square_sampling_probas(attractivities, 
-                                                        self.square_ids_cells, 
-                                                        self.coords_squares,  
-                                                        self.dscale)
+        self.set_square_sampling_probas()
         mask_eligible = np.where(attractivities > 0)[0]  # only cells with attractivity > 0 are eligible for a move
-        self.eligible_cells = self.cell_ids[mask_eligible]
+        self.eligible_cells = self.asarray(self.cell_ids[mask_eligible])
         # Compute square to cell transition matrix
-        self.cell_sampling_probas, self.cell_index_shift, self.order_eligible_cells = get_cell_sampling_probas(attractivities[mask_eligible], self.square_ids_cells[mask_eligible])
+        cell_sampling_probas, cell_index_shift, order_eligible_cells = get_cell_sampling_probas(attractivities[mask_eligible], self.square_ids_cells[mask_eligible])
+        self.cell_index_shift = self.asarray(cell_index_shift)
+        self.cell_counts = self.asarray(np.diff(np.append(cell_index_shift, mask_eligible.shape[0])))
+        self.order_eligible_cells = self.asarray(order_eligible_cells)
         # Compute upfront cumulated sum of sampling matrices
-        self.square_sampling_probas = np.cumsum(self.square_sampling_probas, axis=1)
-        self.cell_sampling_probas = np.cumsum(self.cell_sampling_probas, axis=1)
-        
-
+        self.cell_sampling_probas = self.to_probabilities(np.cumsum(cell_sampling_probas, axis=1))
+
+    def set_attractivity_profiles(self, attractivity_profiles, profile_schedule=None):
+        """ Attractivities changing during the periods (e.g. work places in the daytime, leisure in the evening):
+        `attractivity_profiles` has one row of attractivities of the cells by profile, and `profile_schedule` gives the
+        profile of each move of a period (see `set_profile_schedule`). The sampling structures of each profile are
+        computed once here, the moves only switch between them (`use_attractivity_profile`).
+        None: no profiles, the attractivities in use stay for all the moves (see `set_attractivities`) """
+        if attractivity_profiles is None:
+            self.attractivity_profiles = np.zeros((0, self.cell_ids.shape[0]), dtype=np.float32)
+            self.profile_structures = []
+            self.set_profile_schedule(None)
+            return
+        self.attractivity_profiles = np.array(attractivity_profiles, dtype=np.float32).reshape(-1, self.cell_ids.shape[0])
+        self.profile_structures = []
+        for attractivities in self.attractivity_profiles:
+            self.set_attractivities(attractivities.copy())
+            self.profile_structures.append({name: getattr(self, name) for name in SAMPLING_ATTRIBUTES})
+        self.set_profile_schedule(profile_schedule)
+
+    def set_profile_schedule(self, profile_schedule=None):
+        """ index of the attractivity profile of each move of a period, cycled if the period has more moves.
+        None: one profile by move, in their order """
+        n_profiles = self.attractivity_profiles.shape[0]
+        if profile_schedule is None:
+            profile_schedule = np.arange(n_profiles)
+        profile_schedule = np.array(profile_schedule, dtype=np.int64).reshape(-1)
+        if np.any((profile_schedule < 0) | (profile_schedule >= n_profiles)):
+            raise ValueError(f'profile_schedule must give profiles between 0 and {n_profiles - 1}, not {profile_schedule}')
+        self.profile_schedule = profile_schedule
+        if n_profiles > 0:
+            self.use_attractivity_profile(int(profile_schedule[0]))
+
+    def use_attractivity_profile(self, profile):
+        """ move with the attractivities (and sampling structures) of `profile` """
+        self.use_sampling_structures(self.profile_structures[profile])
+
+    def use_sampling_structures(self, structures):
+        for name, value in structures.items():
+            setattr(self, name, value)
+
+    def set_mobility_classes(self, mobility_class_ids=None, class_dscales=None, class_attractivity_weights=None):
+        """ Agents moving differently (e.g. workers, students, elderly people): each mobility class has its own
+        `dscale` (`class_dscales`, default: the one of the map) and weights of the attractivities of the cells
+        (`class_attractivity_weights`, one row by class, default: 1), and sampling structures computed for them.
+        `mobility_class_ids`: class of each agent, default: its transitions id.
+        Without `class_dscales` nor `class_attractivity_weights`, all the agents move the same way (ValueError if
+        `mobility_class_ids` are given). The sampling structures are computed by `set_attractivities` """
+        if class_dscales is None and class_attractivity_weights is None:
+            if mobility_class_ids is not None:
+                raise ValueError('mobility_class_ids need class_dscales or class_attractivity_weights')
+            self.class_dscales = np.zeros(0, dtype=np.float32)
+            self.class_attractivity_weights = np.zeros((0, self.cell_ids.shape[0]), dtype=np.float32)
+            self.mobility_class_ids = self.xp.zeros((0,), dtype=self.xp.uint8)
+            return
+        n_classes = len(class_dscales) if class_dscales is not None else len(class_attractivity_weights)
+        if class_dscales is None:
+            class_dscales = np.full(n_classes, self.dscale)
+        if class_attractivity_weights is None:
+            class_attractivity_weights = np.ones((n_classes, self.cell_ids.shape[0]))
+        self.class_dscales = np.array(class_dscales, dtype=np.float32).reshape(-1)
+        self.class_attractivity_weights = np.array(class_attractivity_weights, dtype=np.float32).reshape(n_classes, -1)
+        if self.class_dscales.shape[0] != n_classes:
+            raise ValueError(f'class_dscales and class_attractivity_weights must have one row by class')
+        if mobility_class_ids is None:
+            mobility_class_ids = self.transitions_ids
+        mobility_class_ids = np.array(mobility_class_ids if isinstance(mobility_class_ids, np.ndarray) else self.backend.to_numpy(mobility_class_ids))
+        if mobility_class_ids.max() >= n_classes:
+            raise ValueError(f'mobility_class_ids must be under the number of classes ({n_classes})')
+        self.mobility_class_ids = self.asarray(mobility_class_ids, dtype=np.uint8)
+
+    def set_class_structures(self, attractivities):
+        """ sampling structures of the mobility classes for `attractivities` (see `set_mobility_classes`) """
+        self.class_structures = []
+        if self.class_dscales.shape[0] == 0:
+            return
+        structures = {name: getattr(self, name) for name in CLASS_ATTRIBUTES}
+        for dscale, weights in zip(self.class_dscales, self.class_attractivity_weights):
+            self.dscale = float(dscale)
+            self.set_sampling_structures(attractivities * weights)
+            self.class_structures.append({name: getattr(self, name) for name in CLASS_ATTRIBUTES})
+        self.use_sampling_structures(structures)
+
+    def get_sampling_structures(self):
+        """ the cached sampling structures (of the attractivity profiles and the mobility classes) """
+        structures = self.profile_structures + self.class_structures
+        structures += [class_structures for profile_structures in self.profile_structures for class_structures in profile_structures['class_structures']]
+        return list({id(s): s for s in structures}.values())
+
+    def set_square_sampling_probas(self):
+        """ inter-squares proba transition matrix (cumulated), depends on attractivities, squares and `dscale`.
+        Empty with `square_sampling='tree'`, the quadtree replacing it """
+        if self.square_sampling == 'tree':
+            self.square_sampling_probas = self.to_probabilities(np.zeros((0, 0)))
+        else:
+            square_sampling_probas = get_square_sampling_probas(self.attractivities, 
+                                                                self.square_ids_cells, 
+                                                                self.coords_squares,  
+                                                                self.dscale)
+            self.square_sampling_probas = self.to_probabilities(np.cumsum(square_sampling_probas, axis=1))
+        self.set_square_tree()
+
+    def set_square_tree(self):
+        """ quadtree of the squares for `square_sampling='tree'` (see `utils.get_square_tree`), empty otherwise.
+        Depends on attractivities and squares, not on `dscale` (applied during the moves) """
+        if self.square_sampling == 'tree':
+            # side of the smallest squares
+            unit = self.square_size if self.max_cells_per_square is None else self.square_size * 2. ** -SQUARE_MAX_SPLITS
+            children, attractivities, bounds, self.square_tree_root, self.square_tree_depth = get_square_tree(self.attractivities, self.square_ids_cells, self.coords_squares, unit)
+        else:
+            children, attractivities, bounds = np.zeros((0, 4), dtype=np.int64), np.zeros(0), np.zeros((0, 6))
+            self.square_tree_root, self.square_tree_depth = 0, 0
+        self.square_tree_children = self.asarray(children)
+        self.square_tree_attractivities = self.asarray(attractivities, dtype=np.float32)
+        # by column, for the descent to gather each one contiguously
+        self.square_tree_bounds = self.asarray(bounds.T, dtype=np.float32)
+        self.square_positions = self.asarray(self.coords_squares, dtype=np.float32)
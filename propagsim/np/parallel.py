@@ -0,0 +1,45 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from backends import take_into
+
+
+class ChunkExecutor:
+    def __init__(self, n_threads=None, chunk_size=2 ** 16):
+        """ Runs the large per-agent elementwise and gather operations of a `Map` by chunks of `chunk_size`
+        elements on a pool of `n_threads` threads (default: number of cores). NumPy releases the GIL in these
+        operations, so a single map uses several cores (numpy backend only, see `Map.set_executor`).
+        The draws of a chunk come from its own random stream: for a given `chunk_size` the simulation
+        doesn't depend on `n_threads`, but it differs from the one without executor """
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads if n_threads is not None else os.cpu_count()
+        self.pool = ThreadPoolExecutor(self.n_threads)
+
+    def get_chunks(self, n):
+        return [slice(start, min(start + self.chunk_size, n)) for start in range(0, max(n, 1), self.chunk_size)]
+
+    def map(self, func, n, *chunk_args):
+        """ [func(chunk, *args) for each chunk of range(n)], `chunk_args` giving the per-chunk arguments `args` """
+        chunks = self.get_chunks(n)
+        if len(chunks) == 1:
+            return [func(chunks[0], *[args[0] for args in chunk_args])]
+        return list(self.pool.map(func, chunks, *chunk_args))
+
+    def take(self, arr, indices, out=None):
+        """ `arr[indices]` along the first axis of `arr`, written in `out` if given """
+        if out is None:
+            out = np.empty(indices.shape + arr.shape[1:], dtype=arr.dtype)
+
+        def take_chunk(chunk):
+            take_into(arr, indices[chunk], out[chunk])
+        self.map(take_chunk, indices.shape[0])
+        return out
+
+    def get_rngs(self, rng, n):
+        """ generators of the chunks of `n` draws, seeded from `rng` (`numpy.random.Generator` or `numpy.random`) """
+        key = (rng.random(2) * 2 ** 63).astype(np.uint64)
+        return [np.random.Generator(np.random.Philox(counter=np.array([0, i, 0, 0], dtype=np.uint64), key=key))
+                for i in range(len(self.get_chunks(n)))]
+
+    def shutdown(self):
+        self.pool.shutdown()
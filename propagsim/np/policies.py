@@ -0,0 +1,218 @@
+import numpy as np
+
+# Steps of the 'policy' random stream of the map (see `Map.set_step`) where `Policy.start` and `Policy.apply` draw:
+# the draws of the actions depend only on the period, not on what the simulation drew before
+START_STEP, APPLY_STEP = 0, 1
+
+def get_mask(selection, n):
+    """ boolean mask of size `n` of `selection`: indices, boolean mask or None (everything) """
+    if selection is None:
+        return np.ones(n, dtype=bool)
+    selection = np.asarray(selection)
+    if selection.dtype == bool:
+        return selection.copy()
+    mask = np.zeros(n, dtype=bool)
+    mask[selection] = True
+    return mask
+
+
+### Triggers: `trigger(map, period)` is True when an intervention starts (any function of this signature works)
+
+class PeriodTrigger:
+    def __init__(self, period):
+        """ from the period `period` of the run on """
+        self.period = period
+
+    def __call__(self, map, period):
+        return period >= self.period
+
+
+class PrevalenceTrigger:
+    def __init__(self, prevalence):
+        """ when the share of diseased agents (see `Map.get_n_diseased`) reaches `prevalence` """
+        self.prevalence = prevalence
+
+    def __call__(self, map, period):
+        return map.get_n_diseased() >= self.prevalence * map.agent_ids.shape[0]
+
+
+class StateCountTrigger:
+    def __init__(self, state_ids, count):
+        """ when the number of agents in the states `state_ids` (e.g. hospitalized ones) reaches `count` """
+        self.state_ids = state_ids
+        self.count = count
+
+    def __call__(self, map, period):
+        counts = map.get_state_counts()
+        return counts[np.isin(map.backend.to_numpy(map.unique_state_ids), self.state_ids)].sum() >= self.count
+
+
+### Actions: `compile(map)` at the start of the run, then `apply(map, params, period)` for each period where they
+### are active, updating the parameters `params` of the map (see `Policy.apply`) with vectorized operations
+
+class ScaleUnsafeties:
+    def __init__(self, factor, cells=None):
+        """ unsafeties of `cells` (indices or mask, None: all the cells) multiplied by `factor` """
+        self.factor = factor
+        self.cells = cells
+
+    def compile(self, map):
+        self.mask = get_mask(self.cells, map.cell_ids.shape[0])
+
+    def apply(self, map, params, period):
+        params['unsafeties'][self.mask] *= self.factor
+
+
+class CloseCells:
+    def __init__(self, cells):
+        """ nobody moves to `cells` (indices or mask): their attractivity is 0 """
+        self.cells = cells
+
+    def compile(self, map):
+        self.mask = get_mask(self.cells, map.cell_ids.shape[0])
+
+    def apply(self, map, params, period):
+        params['open_cells'][self.mask] = False
+
+
+class CapPMoves:
+    def __init__(self, max_p_move, agents=None):
+        """ p_moves of `agents` (indices or mask, e.g. of a demographic group; None: all the agents) at most `max_p_move` """
+        self.max_p_move = max_p_move
+        self.agents = agents
+
+    def compile(self, map):
+        self.mask = get_mask(self.agents, map.agent_ids.shape[0])
+
+    def apply(self, map, params, period):
+        params['p_moves'][self.mask] = np.minimum(params['p_moves'][self.mask], self.max_p_move)
+
+
+class WearMasks:
+    def __init__(self, p_mask):
+        """ share `p_mask` of the contagious agents wearing a mask during the moves (see `Map.contaminate`) """
+        self.p_mask = p_mask
+
+    def compile(self, map):
+        pass
+
+    def apply(self, map, params, period):
+        params['p_mask'] = max(params['p_mask'], self.p_mask)
+
+
+class IsolateTested:
+    def __init__(self, p_test, state_ids, duration):
+        """ at each period, the agents in the states `state_ids` (e.g. symptomatic ones) not isolated yet are tested
+        with probability `p_test`, the positive ones are isolated for `duration` periods (see `Map.isolate`): they
+        don't move and infect nobody. The tests are drawn from the 'policy' random stream of the map. The running
+        isolations go on when the intervention stops. For tests with a budget, see `Map.set_testing` """
+        self.p_test = p_test
+        self.state_ids = state_ids
+        self.duration = duration
+
+    def compile(self, map):
+        pass
+
+    def apply(self, map, params, period):
+        candidates = np.isin(map.backend.to_numpy(map.current_state_ids), self.state_ids)
+        candidates[map.backend.to_numpy(map.isolated_agents)] = False
+        candidates = np.nonzero(candidates)[0]
+        positives = candidates[map.rngs['policy'].random(candidates.shape[0]) < self.p_test]
+        # isolated from the current period on, until the end of the period `duration - 1` periods after it
+        map.isolate(map.asarray(positives, dtype=np.uint32), self.duration - 1)
+
+
+class Vaccinate:
+    def __init__(self, n_doses, priority_groups=None, efficacy=.9):
+        """ vaccination campaign: `n_doses` by period given to the agents of `priority_groups` (list of indices or
+        masks, None: all the agents in one group), a group after the other. Each agent gets one dose, in a random
+        order within its group, drawn from the 'policy' random stream of the map. A dose gives the immunity
+        `efficacy`, waning with time (see `Map.set_immunity`). The doses given stay when the campaign stops """
+        self.n_doses = n_doses
+        self.priority_groups = priority_groups
+        self.efficacy = efficacy
+
+    def compile(self, map):
+        n_agents = map.agent_ids.shape[0]
+        rng = map.rngs['policy']
+        groups = [None] if self.priority_groups is None else self.priority_groups
+        # agents in the order of their dose, an agent being in its first group only
+        remaining = np.ones(n_agents, dtype=bool)
+        queue = []
+        for group in groups:
+            members = np.nonzero(get_mask(group, n_agents) & remaining)[0]
+            remaining[members] = False
+            queue.append(rng.permutation(members))
+        self.queue = np.concatenate(queue)
+        self.n_given = 0
+
+    def apply(self, map, params, period):
+        doses = self.queue[self.n_given:self.n_given + self.n_doses]
+        self.n_given += doses.shape[0]
+        map.immunize(map.asarray(doses, dtype=np.uint32), self.efficacy)
+
+
+class Intervention:
+    def __init__(self, trigger, actions, duration=None):
+        """ `actions` applied from the first period where `trigger` is True, for `duration` periods (None: until
+        the end of the run) """
+        self.trigger = trigger
+        self.actions = actions
+        self.duration = duration
+
+
+class Policy:
+    def __init__(self, interventions):
+        """ Interventions on a `Map`, applied by `map.run(..., policy=policy)` before each period: the triggers of the
+        interventions not started yet are evaluated, then the parameters of the map (unsafeties, open cells,
+        p_moves, share of masks) are recomputed from the ones it had at the start of the run with the actions of
+        the active interventions, as operations on whole arrays. The map gets its parameters back at the end of the
+        run: scenarios are compared by running the same map (see `Map.reset`) with different policies """
+        self.interventions = interventions
+
+    def start(self, map):
+        """ keep the parameters of `map`, the ones the actions apply to """
+        self.params = {'unsafeties': map.get_probabilities(map.unsafeties), 'p_moves': map.get_probabilities(map.p_moves),
+                       'open_cells': np.ones(map.cell_ids.shape[0], dtype=bool), 'p_mask': map.p_mask}
+        self.attractivities = map.attractivities.copy()
+        self.attractivity_profiles, self.profile_schedule = map.attractivity_profiles.copy(), map.profile_schedule.copy()
+        self.applied = self.params
+        map.set_step(START_STEP, streams=('policy',))
+        # first period of each intervention, None if not started
+        self.start_periods = [None] * len(self.interventions)
+        for intervention in self.interventions:
+            for action in intervention.actions:
+                action.compile(map)
+
+    def apply(self, map, period):
+        """ start the interventions whose trigger is True and set the parameters of `map` for `period` """
+        params = {name: value.copy() if isinstance(value, np.ndarray) else value for name, value in self.params.items()}
+        map.set_step(APPLY_STEP, streams=('policy',))
+        for i, intervention in enumerate(self.interventions):
+            if self.start_periods[i] is None and intervention.trigger(map, period):
+                self.start_periods[i] = period
+            if self.start_periods[i] is None:
+                continue
+            if intervention.duration is None or period < self.start_periods[i] + intervention.duration:
+                for action in intervention.actions:
+                    action.apply(map, params, period)
+        self.set_params(map, params)
+
+    def stop(self, map):
+        """ give `map` its parameters of the start of the run back """
+        self.set_params(map, self.params)
+
+    def set_params(self, map, params):
+        """ update the parameters of `map` that differ from the ones applied before """
+        if not np.array_equal(params['unsafeties'], self.applied['unsafeties']):
+            map.set_unsafeties(params['unsafeties'])
+        if not np.array_equal(params['p_moves'], self.applied['p_moves']):
+            map.set_p_moves(params['p_moves'])
+        if not np.array_equal(params['open_cells'], self.applied['open_cells']):
+            # the sampling structures of the moves are recomputed only when the closed cells change
+            if self.attractivity_profiles.shape[0] > 0:
+                map.set_attractivity_profiles(self.attractivity_profiles * params['open_cells'], self.profile_schedule)
+            else:
+                map.set_attractivities(self.attractivities * params['open_cells'])
+        map.p_mask = params['p_mask']
+        self.applied = params
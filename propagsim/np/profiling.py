@@ -0,0 +1,116 @@
+import functools, json, tracemalloc
+import pandas as pd
+from time import perf_counter
+
+
+def profiled(method):
+    """ Decorator of the `Map` methods forming a phase of the simulation: each call is recorded by the map's
+    profiler. Costs one attribute check when the map has no profiler """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return method(self, *args, **kwargs)
+        with self.profiler.phase(method.__name__, self.current_period):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class Phase:
+    def __init__(self, profiler, name, period):
+        self.profiler = profiler
+        period = int(period) if period is not None else None
+        self.record = {'name': name, 'period': period, 'depth': len(profiler.stack)}
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                profiler.started_tracemalloc = True
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak is reset for this phase: keep the one of the enclosing phase so far
+            if profiler.stack:
+                profiler.stack[-1].peak = max(profiler.stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory, self.peak = current, current
+        profiler.stack.append(self)
+        self.record['start'] = perf_counter() - profiler.t_origin
+        return self
+
+    def __exit__(self, *exc_info):
+        profiler = self.profiler
+        self.record['duration'] = perf_counter() - profiler.t_origin - self.record['start']
+        profiler.stack.pop()
+        if profiler.track_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.record['peak_temp_bytes'] = self.peak - self.start_memory
+            if profiler.stack:
+                profiler.stack[-1].peak = max(profiler.stack[-1].peak, self.peak)
+        profiler.records.append(self.record)
+        return False
+
+
+class Profiler:
+    def __init__(self, track_memory=True):
+        """ Records the phases of a simulation (see `Map.set_profiler`): for each call of `make_move`,
+        `move_agents`, `contaminate`, `forward_all_cells`..., its wall time, the sizes it reports (agents
+        selected, cells touched, infections...) and, if `track_memory`, its peak of temporary allocations
+        (traced with `tracemalloc`, which slows down the simulation) """
+        self.track_memory = track_memory
+        self.records = []
+        self.stack = []
+        self.t_origin = perf_counter()
+        self.started_tracemalloc = False
+
+    def phase(self, name, period=None):
+        return Phase(self, name, period)
+
+    def set(self, **sizes):
+        """ record `sizes` (e.g. `n_agents=...`) for the phase being run """
+        self.stack[-1].record.update({key: int(value) for key, value in sizes.items()})
+
+    def clear(self):
+        self.records = []
+
+    def stop(self):
+        """ stop tracing the allocations if this profiler started it """
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def to_dataframe(self):
+        """ one row per phase call, in the order they ended (nested phases end before their enclosing one) """
+        return pd.DataFrame(self.records)
+
+    def summary(self):
+        """ table with one row per phase: number of calls, total and mean time, share of the time of the outer
+        phases, max peak of temporary allocations and mean of the recorded sizes """
+        df = self.to_dataframe()
+        if df.shape[0] == 0:
+            return df
+        total_time = df.loc[df['depth'] == 0, 'duration'].sum()
+        size_cols = [col for col in df.columns if col not in ['name', 'period', 'depth', 'start', 'duration', 'peak_temp_bytes']]
+        grouped = df.groupby('name', sort=False)
+        summary = pd.DataFrame({'n_calls': grouped.size(),
+                                'total_s': grouped['duration'].sum(),
+                                'mean_s': grouped['duration'].mean()})
+        summary['share'] = summary['total_s'] / total_time if total_time > 0 else 0
+        if 'peak_temp_bytes' in df.columns:
+            summary['max_peak_temp_mb'] = grouped['peak_temp_bytes'].max() / 2 ** 20
+        for col in size_cols:
+            summary[f'mean_{col}'] = grouped[col].mean()
+        return summary.sort_values('total_s', ascending=False)
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.records, f)
+
+    def to_chrome_trace(self, path):
+        """ write the phases in the Chrome trace event format, to open in chrome://tracing or Perfetto """
+        events = []
+        for record in self.records:
+            args = {key: value for key, value in record.items() if key not in ['name', 'start', 'duration', 'depth']}
+            events.append({'name': record['name'], 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': record['start'] * 1e6,
+                           'dur': record['duration'] * 1e6, 'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -1,4 +1,5 @@
 from classes import Map
+from policies import Policy, Intervention, PeriodTrigger, ScaleUnsafeties, WearMasks
 import os
 import numpy as np
 from pprint import pprint
@@ -84,6 +85,9 @@ def draw_beta(min_value, max_value, mean_value, n_values, round=False):
 
 
 N_PERIODS = 50
+# Scenarios run with the same seed share their random numbers (see `Map.set_random_streams`): the differences
+# between them come from the policies, not from the draws
+SEED = 0
 n_moves_per_period = pdict['n_moves_per_period']
 map_path = os.path.join('maps', 'week1')
 
@@ -115,10 +119,9 @@ if n2switch > 0:
     np.save(os.path.join(map_path, 'current_state_ids.npy'), current_state_ids)
 
 
-# agents move now `f_unmove`x less than before lockdown
+# Lockdown from the start: cells `1 / f_unsafety`x less unsafe than before, and masks
 f_unsafety = .33
-unsafeties = np.load(os.path.join(map_path, 'unsafeties.npy')).flatten()
-unsafeties = np.multiply(unsafeties, f_unsafety)
+lockdown = Policy([Intervention(PeriodTrigger(0), [ScaleUnsafeties(f_unsafety), WearMasks(.3)])])
 
 
 # agents move now `f_unmove`x less than before lockdown
@@ -132,23 +135,16 @@ print(f'DEBUG: mean of p_move: {np.mean(p_moves)}')
 res = {}
 map = Map()
 map.load(map_path)
+map.set_random_streams(SEED)
 # map.set_verbose(3)
 
 map.set_p_moves(p_moves)
-map.set_unsafeties(unsafeties)
 
 
-new_hosps = []
+records = map.run(N_PERIODS, n_moves_per_period, record=('states', 'new_states'), tracing_rate=0, policy=lockdown)
 for i in range(N_PERIODS):
-    res[i] = {}
-    for _ in range(n_moves_per_period):
-        map.make_move(p_mask=.3)
-    new_states = map.forward_all_cells(tracing_rate=0)
-    new_hosp = new_states[new_states == 4].shape[0]
-    new_hosps.append(new_hosp)
-    state_ids, state_numbers = map.get_states_numbers()
-    for j in range(state_ids.shape[0]):
-        res[i][state_ids[j]] = state_numbers[j]
+    res[i] = dict(zip(records['state_ids'], records['states'][i]))
+new_hosps = records['new_states'][:, records['state_ids'] == 4][:, 0].tolist()
 
 pprint(res)
 print(new_hosps)
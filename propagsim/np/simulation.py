@@ -220,6 +220,180 @@ def get_p_moves(n_agents, avg):
     return draw_beta(0, 1, avg, n_agents).flatten()
 
 
+class PopulationBuilder:
+    def __init__(self, data_dir=DATA_DIR, pop_reference=67000000, p_fast_hospicu=None, seed=None):
+        """ Generates all the per-agent arrays of a synthetic population. The demography (`p_gender_pop.json`),
+        the state repartition by demography and day and the transition matrices are read from `data_dir` only once,
+        so that `build` can then be called for any population size (e.g. at each calibration round) at the cost
+        of vectorized draws only.
+        `pop_reference`: size of the real population the state repartition numbers refer to
+        `p_fast_hospicu`: agegroup -> proportion of agents going fast through hosp and icu (see DURATIONS above)
+        `seed`: seed of the builder's own random generator
+        """
+        self.rng = np.random.default_rng(seed)
+        self.pop_reference = pop_reference
+        if p_fast_hospicu is None:
+            p_fast_hospicu = {0: .11, 70: .13, 80: .18}
+        with open(os.path.join(data_dir, 'p_gender_pop.json'), 'r') as f:
+            p_gender_pop = json.load(f)
+        # Demographies are ordered as in `split_population`
+        self.demographies, agegroups, props = [], [], []
+        for gender, repartition in p_gender_pop.items():
+            for age, prop in repartition.items():
+                self.demographies.append(f'{gender}_{age}')
+                agegroups.append(int(age))
+                props.append(prop)
+        self.agegroups = np.array(agegroups, dtype=np.uint32)
+        self.props = np.array(props, dtype=np.float64) / 100
+        # proportion of fast hosp/icu for each demography: the one of the highest agegroup threshold below its age
+        thresholds = np.array(sorted(p_fast_hospicu.keys()))
+        p_fasts = np.array([p_fast_hospicu[t] for t in thresholds])
+        self.fast_classes = np.searchsorted(thresholds, self.agegroups, side='right') - 1
+        self.p_fasts = p_fasts
+
+        transitions = [np.load(os.path.join(data_dir, f'{demography}.npy')) for demography in self.demographies]
+        self.transitions = np.dstack(transitions)
+
+        repartition_df = pd.read_csv(os.path.join(data_dir, 'state_repartition_demography.csv'))
+        repartition_df['day'] = pd.to_datetime(repartition_df['day'])
+        self.repartition_states = [state for state in states if state in repartition_df.columns]
+        self.repartition_state_ids = np.array([states2ids.get(state) for state in self.repartition_states], dtype=np.uint32)
+        # day -> (n_demographies, n_repartition_states) array aligned with `self.demographies`
+        self.repartitions = {}
+        for day, day_df in repartition_df.groupby('day'):
+            day_df = day_df.set_index('demography').reindex(self.demographies).fillna(0)
+            self.repartitions[day] = day_df[self.repartition_states].values.astype(np.float64)
+
+    def get_effectifs(self, n_agents):
+        """ number of agents in each demography for a population of `n_agents` """
+        return np.around(self.props * n_agents).astype(np.int64)
+
+    def get_transitions_ids(self, effectifs):
+        return np.repeat(np.arange(0, effectifs.shape[0], dtype=np.uint8), effectifs)
+
+    def draw_lognormal(self, mean, mediane, n, out=None):
+        """ float32 lognormal draws, written in `out` if given (avoids a float64 temporary per state) """
+        mu, sigma = get_under_params(mean, mediane)
+        if out is None:
+            out = np.empty(n, dtype=np.float32)
+        self.rng.standard_normal(size=n, dtype=np.float32, out=out)
+        out *= sigma
+        out += mu
+        return np.exp(out, out=out)
+
+    def get_p_moves(self, n_agents, avg):
+        a, b = get_alpha_beta(0, 1, avg)
+        return self.rng.beta(a, b, n_agents)
+
+    def draw_fast_hospicu(self, effectifs):
+        """ indexes of the agents for which hosp and icu last only 1 period. For each agegroup class,
+        exactly `int(p_fast * n)` agents are drawn without replacement """
+        classes = np.repeat(self.fast_classes, effectifs)
+        inds_fast = []
+        for i, p_fast in enumerate(self.p_fasts):
+            inds_class = np.where(classes == i)[0]
+            n_fast = int(p_fast * inds_class.shape[0])
+            inds_fast.append(self.rng.choice(inds_class, size=n_fast, replace=False, shuffle=False))
+        return np.concatenate(inds_fast)
+
+    def get_durations(self, effectifs, state_mm):
+        """ vectorized version of `get_durations`: one row per agent, one column per state, -1 for no duration """
+        n_agents = int(effectifs.sum())
+        res = np.full((n_agents, len(states)), -1, dtype=np.int32, order='F')  # column-major: filled state by state
+        draws = np.empty(n_agents, dtype=np.float32)
+        for state, mm in state_mm.items():
+            self.draw_lognormal(mm[0], mm[1], n_agents, out=draws)
+            np.rint(draws, out=draws)
+            np.maximum(draws, 1, out=draws)
+            res[:, states2ids.get(state)] = draws
+        inds_fast = self.draw_fast_hospicu(effectifs)
+        res[inds_fast[:, None], [states2ids.get('hosp'), states2ids.get('icu')]] = 1
+        return res
+
+    def get_current_state_durations(self, effectifs, state_mm, day):
+        """ vectorized version of `get_current_state_durations`: inside each demography the agents are
+        filled state by state as in the state repartition of `day`, the remaining ones are healthy """
+        repartition = self.repartitions[pd.Timestamp(day)]
+        n_demographies, n_rep_states = repartition.shape
+        n_agents = int(effectifs.sum())
+        counts = np.empty((n_demographies, n_rep_states + 1), dtype=np.int64)
+        counts[:, :-1] = (repartition * n_agents / self.pop_reference).astype(np.int64)
+        counts[:, -1] = effectifs
+        # clip to the effectif of each demography, the last column gets the remaining (healthy) agents
+        counts = np.minimum(np.cumsum(counts, axis=1), effectifs[:, None])
+        counts[:, 1:] -= counts[:, :-1].copy()
+        counts = counts.flatten()
+
+        block_state_ids = np.tile(np.append(self.repartition_state_ids, states2ids.get('healthy')), n_demographies)
+        block_ids = np.repeat(np.arange(0, counts.shape[0]), counts)
+        block_starts = np.cumsum(counts) - counts
+        ranks = np.arange(0, n_agents) - block_starts[block_ids]  # rank of each agent inside its block
+
+        current_state_ids = block_state_ids[block_ids].astype(np.uint32)
+        current_state_durations = np.full(n_agents, -1, dtype=np.float64)
+        for state in self.repartition_states:
+            state_id = states2ids.get(state)
+            mask = (current_state_ids == state_id)
+            if state in ['recovered', 'death'] or not mask.any():
+                continue
+            if state in ['asymptomatic', 'infected']:
+                # durations 1 to 5 with 1.15 growth rate, remaining agents padded with duration 1
+                rate = sum([1.15 ** i for i in range(5)])
+                n_block = counts[block_ids[mask]]
+                per_durations = ((n_block[:, None] / rate) * 1.15 ** np.arange(0, 5)[None, :]).astype(np.uint32)
+                cum_durations = np.cumsum(per_durations, axis=1)
+                durations = (ranks[mask][:, None] >= cum_durations).sum(axis=1) + 1
+                durations[durations > 5] = 1
+                current_state_durations[mask] = durations
+                continue
+            mean, mediane = state_mm.get(state)
+            if state_id == 5:
+                mediane = mediane - .2
+                current_state_durations[mask] = self.draw_lognormal(.75*mean, .75*mediane, mask.sum())
+            else:
+                current_state_durations[mask] = self.draw_lognormal(2.5*mean, 2.5*mediane, mask.sum())
+        current_state_durations = np.around(current_state_durations).astype(np.int32)
+        return current_state_ids, current_state_durations
+
+    def build(self, n_agents, state_mm, day, n_home_cells, avg_p_move):
+        """ generate all per-agent arrays for a population of (approximately) `n_agents`.
+        Returns a dict whose keys are the corresponding arguments of `Map.from_arrays` """
+        effectifs = self.get_effectifs(n_agents)
+        n_agents_generated = int(effectifs.sum())
+        current_state_ids, current_state_durations = self.get_current_state_durations(effectifs, state_mm, day)
+        agent_params = {'agent_ids': np.arange(0, n_agents_generated, dtype=np.uint32),
+                        'home_cell_ids': self.rng.integers(0, n_home_cells, size=n_agents_generated, dtype=np.uint32),
+                        'p_moves': self.get_p_moves(n_agents_generated, avg_p_move),
+                        'least_state_ids': np.ones(n_agents_generated, dtype=np.uint8),  # least severe state is state 1 for all agents
+                        'current_state_ids': current_state_ids,
+                        'current_state_durations': current_state_durations,
+                        'durations': self.get_durations(effectifs, state_mm),
+                        'transitions': self.transitions,
+                        'transitions_ids': self.get_transitions_ids(effectifs)}
+        return agent_params
+
+
+def get_real_cases(day, n_periods, states_eval=('hosp', 'icu'), data_dir=DATA_DIR):
+    """ real numbers of agents in `states_eval` for the `n_periods` days following `day`.
+    returns a (n_periods, len(states_eval)) array, row `i` corresponding to the end of period `i` """
+    df = pd.read_csv(os.path.join(data_dir, 'overall_cases.csv'))
+    df['day'] = pd.to_datetime(df['day'])
+    days = pd.date_range(day + timedelta(days=1), periods=n_periods)
+    df = df.set_index('day').reindex(days)
+    return df[list(states_eval)].values.astype(np.float64)
+
+
+def get_period_errors(state_ids, state_numbers, real_cases, states_eval=('hosp', 'icu'), scale=100):
+    """ relative error in % of the simulated numbers of agents in `states_eval` (output of `Map.get_states_numbers`
+    scaled by `scale`) compared to `real_cases`, the corresponding row of `get_real_cases` """
+    n_sims = np.zeros(len(states_eval))
+    for i, state in enumerate(states_eval):
+        n_sim = state_numbers[state_ids == states2ids.get(state)]
+        if n_sim.shape[0] > 0:
+            n_sims[i] = n_sim[0] * scale
+    return np.divide(np.abs(np.subtract(real_cases, n_sims)), real_cases) * 100
+
+
 def evaluate(evaluations, day, n_periods):
     df = pd.read_csv(os.path.join(DATA_DIR, 'overall_cases.csv'))
     df['day'] = pd.to_datetime(df['day'])
@@ -23,12 +23,27 @@ def get_least_severe_state(states):
     return least_severe_state
 
 
-def squarify(xcoords, ycoords):
-    xcoords_square = xcoords.astype(np.int32)
-    ycoords_square = ycoords.astype(np.int32)
-    coords_squares = np.vstack((xcoords_square, ycoords_square)).T
-    coords_squares, square_ids_cells = np.unique(coords_squares, return_inverse=True,  axis=0)
-    return coords_squares, square_ids_cells
+def squarify(xcoords, ycoords, square_size=1, max_cells_per_square=None, max_splits=4, max_merges=4):
+    """
+    Group the cells in squares of side `square_size`. With `max_cells_per_square`, adaptive grid: the squares
+    holding more cells are split in 4 (at most `max_splits` times) and the sparse ones merged 4 by 4 (at most
+    `max_merges` times) while the merged square doesn't hold more cells. Each square is then the largest block of a
+    quadtree over the grid holding at most `max_cells_per_square` cells (or the smallest block if none does).
+    :return: `coords_squares`: coordinates of the centers of the squares, `square_ids_cells`: square of each cell
+    """
+    min_level, max_level = (0, 0) if max_cells_per_square is None else (-max_splits, max_merges)
+    # index of the cells on the finest grid
+    keys = np.floor(np.vstack((xcoords, ycoords)).T / (square_size * 2. ** min_level)).astype(np.int64)
+    levels = np.full(keys.shape[0], min_level)
+    for level in range(min_level + 1, max_level + 1):
+        # the number of cells of the block of a cell grows with the level
+        _, inverse, counts = np.unique(keys >> (level - min_level), return_inverse=True, return_counts=True, axis=0)
+        levels[counts[inverse.ravel()] <= max_cells_per_square] = level
+    blocks = np.hstack((levels[:, None], keys >> (levels - min_level)[:, None]))
+    blocks, square_ids_cells = np.unique(blocks, return_inverse=True, axis=0)
+    sizes = square_size * 2. ** blocks[:, :1]
+    coords_squares = (blocks[:, 1:] + .5) * sizes
+    return coords_squares, square_ids_cells.ravel()
 
 
 def get_square_sampling_probas(attractivity_cells, square_ids_cells, coords_squares, dscale=1):
@@ -49,6 +64,55 @@ def get_square_sampling_probas(attractivity_cells, square_ids_cells, coords_squa
     return square_sampling_probas
 
 
+def get_square_tree(attractivity_cells, square_ids_cells, coords_squares, unit=1):
+    """
+    Quadtree of the squares having attractivity, to sample squares without the matrix of `get_square_sampling_probas`:
+    each node is a block of 2 ** level x 2 ** level squares, with the sum of their attractivities, their bounding box
+    and their centroid (weighted by attractivity). The leaves are placed on the grid of step `unit` (side of the
+    smallest squares, see `squarify`).
+    :return: `children`: (n_nodes + 1, 4) the children of each node, padded with the last node (empty, never sampled).
+    The leaves are the first nodes, in the order of the squares in `get_cell_sampling_probas`, and are their own first child.
+    `attractivities` of the nodes, `bounds`: (n_nodes + 1, 6) xmin, ymin, xmax, ymax, xcentroid, ycentroid of each node
+    (inf for the empty node), `root`: index of the root, `depth`: number of levels above the leaves
+    """
+    sum_attractivity_squares, unique_squares = sum_by_group(values=attractivity_cells, groups=square_ids_cells)
+    mask_attractivity = sum_attractivity_squares > 0
+    keys = np.floor(coords_squares[unique_squares[mask_attractivity]] / unit).astype(np.int64)
+    keys -= keys.min(axis=0)
+    level_attractivities = [sum_attractivity_squares[mask_attractivity]]
+    level_bounds = [np.hstack((coords_squares[unique_squares[mask_attractivity]],) * 3).astype(np.float64)]
+    level_parents = []
+    while keys.shape[0] > 1:
+        keys, parents = np.unique(keys >> 1, axis=0, return_inverse=True)
+        parents = parents.ravel()
+        bounds = np.full((keys.shape[0], 6), np.inf)
+        np.minimum.at(bounds[:, :2], parents, level_bounds[-1][:, :2])
+        bounds[:, 2:4] = -np.inf
+        np.maximum.at(bounds[:, 2:4], parents, level_bounds[-1][:, 2:4])
+        attractivities = np.bincount(parents, weights=level_attractivities[-1], minlength=keys.shape[0])
+        for i in [4, 5]:
+            bounds[:, i] = np.bincount(parents, weights=level_attractivities[-1] * level_bounds[-1][:, i], minlength=keys.shape[0]) / attractivities
+        level_attractivities.append(attractivities)
+        level_bounds.append(bounds)
+        level_parents.append(parents)
+    n_nodes = sum(attractivities.shape[0] for attractivities in level_attractivities)
+    attractivities = np.append(np.concatenate(level_attractivities), 0)
+    bounds = np.vstack(level_bounds + [np.full((1, 6), np.inf)])
+    children = np.full((n_nodes + 1, 4), n_nodes, dtype=np.int64)
+    n_leaves = level_attractivities[0].shape[0]
+    children[:n_leaves, 0] = np.arange(n_leaves)
+    start = 0
+    for parents in level_parents:
+        # children of a node: its nodes on the level below, in their order
+        order = np.argsort(parents, kind='stable')
+        starts = group_starts(parents[order])
+        slots = np.arange(order.shape[0]) - np.repeat(starts, np.diff(np.append(starts, order.shape[0])))
+        parent_start = start + parents.shape[0]
+        children[parent_start + parents[order], slots] = start + order
+        start = parent_start
+    return children, attractivities, bounds, n_nodes - 1, len(level_parents)
+
+
 def get_cell_sampling_probas(attractivity_cells, square_ids_cells):
     """
     Compute the probability array for sampling cells given squares
@@ -92,27 +156,75 @@ def get_cell_sampling_probas(attractivity_cells, square_ids_cells):
     return cell_sampling_probas, cell_index_shift, order
 
 
-def vectorized_choice(prob_matrix,axis=1):
+def vectorized_choice(prob_matrix, axis=1, rng=np.random, r=None, xp=np):
     """
     selects index according to weights in `prob_matrix` rows (if `axis`==0), cols otherwise 
     see https://stackoverflow.com/questions/34187130/fast-random-weighted-selection-across-all-rows-of-a-stochastic-matrix
+    `rng`: `numpy.random.Generator` to draw from, numpy's global random state by default
+    `r`: uniform draws already done (one by row or col), `rng` is not used then
+    `xp`: array namespace of `prob_matrix` (see `backends`)
     """
     # s = prob_matrix.cumsum(axis=axis)
-    r = np.random.rand(prob_matrix.shape[1-axis]).reshape(2*(1-axis)-1, 2*axis - 1)
-    k = (prob_matrix < r).sum(axis=axis)
-    max_choice = prob_matrix.shape[axis]
-    k[k>max_choice] = max_choice
-    return k
-
-
-def group_max(data, groups):
-    order = np.lexsort((data, groups))
-    groups = groups[order] # this is only needed if groups is unsorted
-    data = data[order]
-    index = np.empty(groups.shape[0], 'bool')
-    index[-1] = True
-    index[:-1] = groups[1:] != groups[:-1]
-    return data[index], index
+    if r is None:
+        r = xp.asarray(rng.random(prob_matrix.shape[1-axis]))
+    r = xp.reshape(r, (2*(1-axis)-1, 2*axis - 1))
+    return xp.count_nonzero(prob_matrix < r, axis=axis)
+
+
+def group_starts(sorted_groups, xp=np):
+    """ index of the first element of each group of `sorted_groups` (in which each group is contiguous) """
+    if sorted_groups.shape[0] == 0:
+        return xp.zeros((0,), dtype=xp.int64)
+    return xp.nonzero(xp.concat([xp.asarray([True]), sorted_groups[1:] != sorted_groups[:-1]]))[0]
+
+
+def group_counts(starts, n, xp=np):
+    """ number of elements of each group given their `starts` (see `group_starts`) and the total number `n` of elements """
+    return xp.diff(starts, append=xp.asarray([n], dtype=starts.dtype))
+
+
+def group_argmax(data, starts, maxs, xp=np):
+    """ index in `data` of the max of each group (the first one in case of ties), given the `starts` of the groups
+    (see `group_starts`) and their maxs (`Backend.segment_max`) """
+    counts = group_counts(starts, data.shape[0], xp)
+    inds = xp.nonzero(data == xp.repeat(maxs, counts))[0]
+    # group of each max, keep the first max of each group
+    groups = xp.take(xp.repeat(xp.arange(starts.shape[0]), counts), inds)
+    return inds[xp.concat([xp.asarray([True]), groups[1:] != groups[:-1]])]
+
+
+def get_bernoulli_successes(n, p, rng=np.random):
+    """ sorted indices of the successes among `n` independent trials of probability `p`, drawn as geometric gaps
+    between successes: the number of successes is binomial and, given it, their indices are a uniform sample of
+    range(n). Costs O(number of successes) instead of one draw by trial.
+    `rng`: `numpy.random.Generator` or `numpy.random` """
+    if n == 0 or p <= 0:
+        return np.zeros((0,), dtype=np.int64)
+    # enough gaps to reach `n` in most cases, more are drawn otherwise
+    size = int(n * p + 5 * np.sqrt(n * p) + 10)
+    successes = np.cumsum(rng.geometric(p, size=size)) - 1
+    while successes[-1] < n:
+        successes = np.concatenate([successes, successes[-1] + np.cumsum(rng.geometric(p, size=size))])
+    return successes[:np.searchsorted(successes, n)]
+
+
+def pack_bits(bits, xp=np):
+    """ boolean array `bits` packed 8 by byte (uint8), the first one in the most significant bit (layout of `np.packbits`) """
+    n_bytes = (bits.shape[0] + 7) // 8
+    bits = xp.concat([xp.astype(bits, xp.uint8), xp.zeros((n_bytes * 8 - bits.shape[0],), dtype=xp.uint8)])
+    weights = xp.asarray([128, 64, 32, 16, 8, 4, 2, 1], dtype=xp.uint8)
+    return xp.sum(xp.reshape(bits, (n_bytes, 8)) * weights, axis=1, dtype=xp.uint8)
+
+
+def get_bit_positions(indices, xp=np):
+    """ byte and shift of the bits of `indices` in a packed array (see `pack_bits`), to be given to `get_bits` """
+    return indices >> 3, 7 - (indices & 7)
+
+
+def get_bits(packed, positions, xp=np):
+    """ bits at `positions` (see `get_bit_positions`) of the `packed` array as a boolean array """
+    byte_indices, shifts = positions
+    return ((xp.take(packed, byte_indices) >> shifts) & 1) == 1
 
 
 def sum_by_group(values, groups):
@@ -130,11 +242,13 @@ def sum_by_group(values, groups):
     values[1:] = values[1:] - values[:-1]
     return values, groups
 
-def get_ind_in_arr(x, y):
+def get_ind_in_arr(x, y, xp=np):
     """ returns the position in x of the elements in y that are in x """
-    index = np.argsort(x)
-    sorted_x = x[index]
-    sorted_index = np.searchsorted(sorted_x, y)
-    yindex = np.take(index, sorted_index, mode="clip")
-    mask = x[yindex] != y
+    if x.shape[0] == 0:
+        return xp.zeros((0,), dtype=xp.int64)
+    index = xp.argsort(x)
+    sorted_x = xp.take(x, index)
+    sorted_index = xp.searchsorted(sorted_x, y)
+    yindex = xp.take(index, xp.clip(sorted_index, max=x.shape[0] - 1))
+    mask = xp.take(x, yindex) != y
     return yindex[~mask]
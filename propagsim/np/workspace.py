@@ -0,0 +1,29 @@
+import numpy as np
+
+
+class Workspace:
+    def __init__(self, growth=1.25):
+        """ Named buffers reused from a move to the next for the temporaries of a `Map` (see `Map.set_workspace`),
+        so that moves allocate (almost) nothing once the buffers are big enough. A buffer is grown when a bigger
+        array is asked under its name, by a factor `growth` more than needed so that a slowly growing size
+        (e.g. number of moving agents) doesn't reallocate at each move """
+        self.growth = growth
+        self.buffers = {}
+
+    def get(self, name, shape, dtype):
+        """ array of `shape` and `dtype`, valid until the next `get` of `name` (its content is undefined) """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.nbytes < nbytes:
+            buffer = np.empty(int(nbytes * self.growth), dtype=np.uint8)
+            self.buffers[name] = buffer
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+    def clear(self):
+        """ release the buffers """
+        self.buffers = {}
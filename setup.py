@@ -13,6 +13,8 @@ setuptools.setup(
     long_description_content_type='text/markdown',
     url='https://github.com/parcoor/py-propagsim',
     packages=setuptools.find_packages(),
+    install_requires=['numpy>=2.1', 'scipy', 'pandas'],
+    extras_require={'test': ['pytest', 'array_api_strict'], 'gpu': ['cupy', 'array_api_compat']},
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',
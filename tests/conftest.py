@@ -0,0 +1,55 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import pytest
+import numpy as np
+from datetime import datetime
+from simulation import PopulationBuilder, get_cell_positions, get_cell_attractivities, get_cell_unsafeties
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+DAY = datetime(2020, 4, 1)
+STATE_MM = {'asymptomatic': (4, 3), 'infected': (6, 4), 'asympcont': (1, 1),
+            'hosp': (8, 6), 'icu': (17, 15), 'recovercont': (2, 1)}
+N_AGENTS = 50000
+N_HOME_CELLS = int(N_AGENTS / 2.2)
+N_CELLS = N_HOME_CELLS + int(N_AGENTS / 70)
+N_MOVES_PER_PERIOD = 4
+
+
+def build_array_params(seed=0, avg_p_move=.3):
+    np.random.seed(seed)
+    builder = PopulationBuilder(data_dir=DATA_DIR, seed=seed)
+    cell_positions = get_cell_positions(N_CELLS, 10, density_factor=2)
+    array_params = {'cell_ids': np.arange(0, N_CELLS).astype(np.uint32),
+                    'attractivities': get_cell_attractivities(N_HOME_CELLS, N_CELLS - N_HOME_CELLS),
+                    'unsafeties': get_cell_unsafeties(N_CELLS, N_HOME_CELLS, .7),
+                    'xcoords': cell_positions[:, 0], 'ycoords': cell_positions[:, 1],
+                    'unique_state_ids': np.arange(0, 9).astype(np.uint32),
+                    'unique_contagiousities': np.array([0, 0, .5, .8, 0, 0, 0, .3, 0]),
+                    'unique_sensitivities': np.array([1, 0, 0, 0, 0, 0, 0, 0, 0]),
+                    'unique_severities': np.array([0, 0, 0, .7, 1, 1, 1, .1, 0]),
+                    'dscale': 1}
+    array_params.update(builder.build(N_AGENTS, STATE_MM, DAY, N_HOME_CELLS, avg_p_move))
+    return array_params
+
+
+def run_periods(map, n_periods, seed):
+    np.random.seed(seed)
+    stats = []
+    for _ in range(n_periods):
+        for _ in range(N_MOVES_PER_PERIOD):
+            map.make_move()
+        map.forward_all_cells()
+        stats.append(np.bincount(map.current_state_ids.astype(np.int64), minlength=9))
+    return np.vstack(stats)
+
+
+@pytest.fixture
+def get_array_params():
+    """ arrays of a synthetic population of `N_AGENTS` agents, `get_array_params(seed, avg_p_move)` """
+    return build_array_params
+
+
+@pytest.fixture
+def run():
+    """ state counts after each period of `run(map, n_periods, seed)`, `N_MOVES_PER_PERIOD` moves by period """
+    return run_periods
@@ -0,0 +1,127 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+import pytest
+from classes import Map
+from backends import Backend, get_backend
+from parallel import ChunkExecutor
+
+array_api_strict = pytest.importorskip('array_api_strict')
+N_MOVES_PER_PERIOD = 4
+
+
+def run(map, n_periods):
+    states = []
+    for _ in range(n_periods):
+        for _ in range(N_MOVES_PER_PERIOD):
+            map.make_move(p_mask=.2)
+        map.forward_all_cells(tracing_rate=.5)
+        states.append(map.backend.to_numpy(map.current_state_ids).copy())
+    return np.vstack(states)
+
+
+def test_same_simulation_on_all_backends(tmp_path, get_array_params):
+    array_params = get_array_params()
+    maps = {}
+    for backend in ['numpy', 'array_api_strict']:
+        maps[backend] = Map()
+        maps[backend].from_arrays(**array_params, seed=3, backend=backend)
+    assert not isinstance(maps['array_api_strict'].current_state_ids, np.ndarray)
+    states = {backend: run(map, 3) for backend, map in maps.items()}
+    assert np.array_equal(states['numpy'], states['array_api_strict'])
+    assert np.array_equal(maps['numpy'].get_r_factors(), maps['array_api_strict'].get_r_factors())
+    for chain, chain_strict in zip(maps['numpy'].get_contamination_chain(), maps['array_api_strict'].get_contamination_chain()):
+        assert np.array_equal(chain, np.from_dlpack(chain_strict))
+    # Moving a map to another backend or persisting it keeps its state
+    maps['numpy'].set_backend('array_api_strict')
+    maps['numpy'].save(tmp_path)
+    loaded = Map()
+    loaded.load(tmp_path)
+    assert isinstance(loaded.current_state_ids, np.ndarray)
+    assert np.array_equal(loaded.current_state_ids, states['numpy'][-1])
+    loaded.set_random_streams(seed=4)
+    maps['array_api_strict'].set_random_streams(seed=4)
+    assert np.array_equal(run(loaded, 2), run(maps['array_api_strict'], 2))
+
+
+def test_same_simulation_on_cupy(get_array_params):
+    pytest.importorskip('cupy')
+    pytest.importorskip('array_api_compat')
+    array_params = get_array_params()
+    states = []
+    for backend in ['numpy', 'cupy']:
+        map = Map()
+        map.from_arrays(**array_params, seed=3, backend=backend)
+        states.append(run(map, 3))
+    assert np.array_equal(states[0], states[1])
+
+
+def test_move_buckets_on_all_backends(get_array_params):
+    # low p_moves: the moving agents are selected by bucket (see `Map.select_movers`)
+    array_params = get_array_params(avg_p_move=.02)
+    states = []
+    for backend in ['numpy', 'array_api_strict']:
+        map = Map()
+        map.from_arrays(**array_params, seed=3, backend=backend)
+        assert map.n_move_candidates < .1 * map.agent_ids.shape[0]
+        states.append(run(map, 2))
+    assert np.array_equal(states[0], states[1])
+
+
+def test_put():
+    xp = array_api_strict
+    portable = Backend('array_api_strict', xp)
+    x = np.arange(10, dtype=np.float32)
+    indices, values = np.array([7, 2, 5]), np.array([-1, -2, -3], dtype=np.float32)
+    expected = x.copy()
+    expected[indices] = values
+    res = portable.put(xp.asarray(x), xp.asarray(indices), xp.asarray(values))
+    assert np.array_equal(np.from_dlpack(res), expected)
+    assert np.array_equal(get_backend('numpy').put(x, indices, values), expected)
+
+
+def test_take_out_of_range():
+    # buffered takes check the indices as the unbuffered ones
+    x = np.arange(10, dtype=np.float32)
+    numpy_backend, executor = get_backend('numpy'), ChunkExecutor(n_threads=2, chunk_size=2)
+    for take in [numpy_backend.take, executor.take]:
+        assert np.array_equal(take(x, np.array([3, -1, 0]), out=np.empty(3, dtype=np.float32)), [3, 9, 0])
+        with pytest.raises(IndexError):
+            take(x, np.array([3, 10, 0]), out=np.empty(3, dtype=np.float32))
+    with pytest.raises(IndexError):
+        numpy_backend.take(x, np.array([10]))
+
+
+@pytest.mark.parametrize('n_keys', [3, 2 ** 16, 2 ** 20])
+def test_counting_sort_and_add_at(n_keys):
+    xp = array_api_strict
+    keys = np.random.default_rng(0).integers(0, n_keys, 1000).astype(np.uint32)
+    expected = np.zeros(n_keys, dtype=np.int32)
+    np.add.at(expected, keys, 2)
+    for backend in [Backend('array_api_strict', xp), get_backend('numpy')]:
+        order = backend.counting_sort(backend.asarray(keys), n_keys)
+        assert np.array_equal(backend.to_numpy(order), np.argsort(keys, kind='stable'))
+        counts = backend.add_at(backend.asarray(np.zeros(n_keys, dtype=np.int32)), backend.asarray(keys), 2)
+        assert np.array_equal(backend.to_numpy(counts), expected)
+
+
+def test_testing_and_immunity_on_all_backends(get_array_params):
+    xp = array_api_strict
+    x = np.random.default_rng(0).random(1000).astype(np.float32)
+    for backend in [Backend('array_api_strict', xp), get_backend('numpy')]:
+        assert np.array_equal(np.sort(backend.to_numpy(backend.argsmallest(backend.asarray(x), 10))), np.sort(np.argsort(x)[:10]))
+    states = []
+    for backend in ['numpy', 'array_api_strict']:
+        map = Map()
+        map.from_arrays(**get_array_params(), seed=3, backend=backend)
+        map.set_testing(n_tests_per_period=1000, isolate_traced=True)
+        map.set_immunity(half_life=2, infection_immunity=.5)
+        map.immunize(map.agent_ids[::3], .9)
+        states.append(run(map, 3))
+        assert map.any_isolated
+    assert np.array_equal(states[0], states[1])
+
+
+def test_unknown_backend(get_array_params):
+    with pytest.raises(ValueError):
+        Map().from_arrays(**get_array_params(), backend='unknown')
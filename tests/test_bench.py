@@ -0,0 +1,37 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import copy
+import pytest
+from bench import get_cases, run_case, get_metadata, compare, QUICK_REFERENCE_CASE
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def test_get_cases():
+    sweeps = {'n_agents': [10000, 20000], 'p_move': [.1, .3]}
+    reference = {'n_agents': 20000, 'p_move': .1}
+    # the reference case is run once
+    assert len(get_cases(sweeps, reference)) == 3
+    assert len(get_cases(sweeps, reference, full=True)) == 4
+
+
+def test_run_and_compare():
+    res = run_case(QUICK_REFERENCE_CASE, n_periods=2, n_moves_per_period=3, repeat=2, data_dir=DATA_DIR)
+    assert res['params'] == QUICK_REFERENCE_CASE
+    assert res['phases']['make_move']['n_calls'] == 6 and res['phases']['forward_all_cells']['n_calls'] == 2
+    assert res['phases']['make_move']['total_s'] <= res['total_s'] and res['peak_rss_mb'] > 0
+    assert 0 < res['build_population_s'] < res['setup_s']
+    baseline = {'metadata': get_metadata(), 'cases': [res]}
+    candidate = copy.deepcopy(baseline)
+    candidate['cases'][0]['phases']['contaminate']['total_s'] *= 2
+    candidate['cases'][0]['build_population_s'] *= 2
+    df = compare(baseline, candidate, threshold=.1, min_time=0)
+    assert sorted(df.loc[df['regression'], 'timing'].tolist()) == ['build_population', 'contaminate']
+    assert not compare(baseline, baseline, min_time=0)['regression'].any()
+    # another backend or number of threads is another case, other run settings aren't compared
+    other = copy.deepcopy(candidate)
+    other['cases'][0]['n_threads'] = 4
+    assert compare(baseline, other, min_time=0).shape[0] == 0
+    baseline['settings'], other['settings'] = {'n_periods': 2}, {'n_periods': 3}
+    with pytest.raises(ValueError):
+        compare(baseline, other)
@@ -0,0 +1,69 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import pytest
+import numpy as np
+from datetime import datetime
+from functools import partial
+from calibration import CalibrationEngine, Optimizer, TPEOptimizer, RandomSearch
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+DAY = datetime(2020, 4, 1)
+N_MOVES_PER_PERIOD = 4
+
+
+def build_candidate(get_array_params, seed, pdict=None):
+    if pdict is None:
+        pdict = {'avg_p_move': np.random.uniform(0, .5), 'n_moves_per_period': N_MOVES_PER_PERIOD}
+    return get_array_params(seed, avg_p_move=pdict['avg_p_move']), pdict
+
+
+def test_calibration_engine(get_array_params):
+    engine = CalibrationEngine(partial(build_candidate, get_array_params), DAY, n_periods=6, n_workers=2, eta=2, data_dir=DATA_DIR)
+    assert engine.rungs == [3]
+    results = engine.run(8, seed=0)
+    assert len(results) == 8
+    assert results[0]['status'] == 'complete' and results[0]['errors'].shape == (6, 2)
+    best_score = results[0]['score']
+    for res in results:
+        assert res['status'] in ['complete', 'pruned']
+        if res['status'] == 'pruned':
+            assert res['errors'].shape[0] < 6 and res['score'] == np.inf
+        else:
+            assert np.isclose(res['score'], res['errors'].mean()) and res['score'] >= best_score
+
+
+def test_calibration_engine_optimizer(get_array_params):
+    space = {'avg_p_move': (.05, .5), 'n_moves_per_period': N_MOVES_PER_PERIOD}
+    optimizer = TPEOptimizer(space, seed=0, n_startup=2)
+    engine = CalibrationEngine(partial(build_candidate, get_array_params), DAY, n_periods=3, n_workers=2, data_dir=DATA_DIR)
+    results = engine.run(6, seed=0, optimizer=optimizer)
+    assert len(results) == 6 and len(optimizer.y) == 6
+    assert all(.05 <= res['pdict']['avg_p_move'] <= .5 for res in results)
+
+
+def test_tpe_optimizer():
+    space = {'x': (-5, 5), 'y': (-5, 5), 'n': (0, 10, int), 'fixed': 3}
+    target = np.array([1.5, -2, 7])
+
+    def objective(pdict):
+        return np.sum((np.array([pdict['x'], pdict['y'], pdict['n']]) - target) ** 2)
+
+    bests = {}
+    for optimizer_class in [RandomSearch, TPEOptimizer]:
+        bests[optimizer_class] = []
+        for seed in range(5):
+            optimizer = optimizer_class(space, seed=seed)
+            for _ in range(20):
+                for pdict in optimizer.ask(4):  # batches of 4 concurrent candidates
+                    assert pdict['fixed'] == 3 and isinstance(pdict['n'], int)
+                    optimizer.tell(pdict, objective(pdict))
+            bests[optimizer_class].append(np.min(optimizer.y))
+    assert np.mean(bests[TPEOptimizer]) < np.mean(bests[RandomSearch])
+
+
+def test_optimizer_without_propose():
+    class NoPropose(Optimizer):
+        pass
+
+    with pytest.raises(TypeError):
+        NoPropose({'x': (0, 1)})
@@ -0,0 +1,53 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from classes import Map
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_cell_occupancy(get_array_params):
+    array_params = get_array_params()
+    map = Map()
+    map.from_arrays(**array_params, seed=0, move_mode='current')
+    n_cells = array_params['cell_ids'].shape[0]
+    for _ in range(N_MOVES_PER_PERIOD):
+        map.make_move()
+        # maintained with the agents changing cell only
+        assert np.array_equal(map.cell_occupancy, np.bincount(map.current_cell_ids, minlength=n_cells))
+        starts, agents = map.get_cell_agents()
+        assert np.array_equal(agents, np.argsort(map.current_cell_ids, kind='stable'))
+        assert np.array_equal(np.diff(starts), map.cell_occupancy)
+    histogram = map.get_occupancy_histogram()
+    assert histogram.sum() == n_cells and histogram @ np.arange(histogram.shape[0]) == map.agent_ids.shape[0]
+    cell, n_agents = map.get_max_crowding()
+    assert n_agents == histogram.shape[0] - 1 == map.cell_occupancy[cell]
+    contagious = map.unique_contagiousities[map.current_state_ids] > 0
+    assert np.array_equal(map.get_contagious_counts(), np.bincount(map.current_cell_ids[contagious], minlength=n_cells))
+    map.forward_all_cells()
+    assert np.array_equal(map.cell_occupancy, np.bincount(map.home_cell_ids, minlength=n_cells))
+
+
+def test_cell_capacities(tmp_path, get_array_params):
+    array_params = get_array_params()
+    n_cells = array_params['cell_ids'].shape[0]
+    public = array_params['attractivities'] > 0
+    cell_capacities = np.where(public, 2, 10 ** 6)
+    map = Map()
+    map.from_arrays(**array_params, seed=0, move_mode='current', cell_capacities=cell_capacities)
+    for _ in range(N_MOVES_PER_PERIOD):
+        map.make_move()
+        assert np.all(map.cell_occupancy <= cell_capacities)
+        assert np.array_equal(map.cell_occupancy, np.bincount(map.current_cell_ids, minlength=n_cells))
+    # the cells are full, the agents not finding room stay where they are
+    assert map.cell_occupancy[public].mean() > 1.5
+    map.save(tmp_path)
+    loaded = Map()
+    loaded.load(tmp_path)
+    assert np.array_equal(loaded.cell_capacities, cell_capacities)
+    # capacities never reached: same simulation as without
+    map.reset(cell_capacities=np.full(n_cells, 10 ** 6))
+    records = map.run(2, N_MOVES_PER_PERIOD)
+    map.reset(cell_capacities=None)
+    assert map.cell_capacities.size == 0
+    assert np.array_equal(map.run(2, N_MOVES_PER_PERIOD)['states'], records['states'])
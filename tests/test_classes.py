@@ -1,3 +1,5 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
 from classes import State, Agent, Cell, Transitions, Map
 import numpy as np
 from time import time
@@ -0,0 +1,42 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from classes import Map
+
+N_MOVES_PER_PERIOD = 4
+
+
+def get_home_contaminations(map, n_steps):
+    """ mean number of agents infected at home from the current state """
+    current_state_ids, current_state_durations = map.current_state_ids.copy(), map.current_state_durations.copy()
+    n_infected = []
+    for step in range(n_steps):
+        map.current_state_ids[:], map.current_state_durations[:] = current_state_ids, current_state_durations
+        map.init_flags()
+        map.n_infected_period = 0
+        map.set_step(step)
+        map.contaminate(map.agent_ids, map.home_cell_ids)
+        n_infected.append(map.n_infected_period)
+    return np.mean(n_infected)
+
+
+def test_fixed_point_probabilities(tmp_path, get_array_params):
+    array_params = get_array_params()
+    float_map = Map()
+    float_map.from_arrays(**array_params, seed=0)
+    n_infected = get_home_contaminations(float_map, 40)
+    for probability_bits in [16, 32]:
+        map = Map()
+        map.from_arrays(**array_params, seed=0, probability_bits=probability_bits)
+        assert map.p_moves.dtype == map.square_sampling_probas.dtype == np.dtype(f'uint{probability_bits}')
+        # fixed-point rounding, plus the one of the float32 probabilities
+        tolerance = 2 ** -probability_bits + 2 ** -23
+        for name in ['p_moves', 'unsafeties', 'square_sampling_probas', 'cell_sampling_probas']:
+            assert np.abs(getattr(map, name) / 2 ** probability_bits - getattr(float_map, name)).max() <= tolerance
+        assert abs(get_home_contaminations(map, 40) / n_infected - 1) < .03
+        records = map.run(2, N_MOVES_PER_PERIOD)
+        assert records['states'][-1].sum() == map.agent_ids.shape[0]
+    map.save(tmp_path)
+    loaded = Map()
+    loaded.load(tmp_path)
+    assert loaded.probability_bits == 32 and loaded.unique_mobilities.dtype == np.uint64
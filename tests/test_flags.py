@@ -0,0 +1,25 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from classes import Map
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_agent_flags(get_array_params):
+    map = Map()
+    map.from_arrays(**get_array_params(), seed=0)
+    map.run(3, N_MOVES_PER_PERIOD, tracing_rate=.5)
+    for name, unique_values in [('contagious_flags', map.unique_contagiousities),
+                                ('sensitive_flags', map.unique_sensitivities)]:
+        assert np.array_equal(getattr(map, name), np.packbits(unique_values[map.current_state_ids] > 0))
+    traced = np.unpackbits(map.traced_flags, count=map.agent_ids.shape[0]).astype(bool)
+    assert map.any_traced and 0 < traced.sum() < traced.shape[0]
+    # traced agents move less
+    moves = np.zeros(map.agent_ids.shape[0])
+    for _ in range(20):
+        map.make_move()
+        moves += map.buffer('is_moving', moves.shape, np.bool_)
+    assert moves[traced].mean() < moves[~traced].mean() / 2
+    map.reset()
+    assert not map.any_traced and not map.traced_flags.any()
@@ -0,0 +1,43 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from classes import Map, MAX_IMMUNITY
+
+
+def test_immunity(tmp_path, get_array_params):
+    array_params = get_array_params()
+    for probability_bits in [None, 16]:
+        map = Map()
+        map.from_arrays(**array_params, seed=0, probability_bits=probability_bits)
+        map.set_immunity(half_life=2)
+        # agents without immunity keep their contamination probabilities exactly
+        map.immunize(map.agent_ids[:1], .5)
+        probabilities = map.widen(map.unsafeties[:10].copy())
+        expected = map.xp.asarray(probabilities, copy=True)
+        map.multiply_probabilities(probabilities, map.get_susceptibilities(map.agent_ids[1:11]))
+        assert np.array_equal(probabilities, expected)
+        # fully immune agents are not infected
+        map.immunize(map.agent_ids, 1)
+        assert np.allclose(map.get_immunities(map.agent_ids[:3]), 1)
+        map.make_move()
+        assert map.infected_agents.shape[0] == 0
+        # the immunity halves every 2 periods
+        map.current_period += 4
+        assert np.allclose(map.get_immunities(map.agent_ids[:3]), .25)
+        map.immunize(map.agent_ids[:3], .1)
+        assert np.allclose(map.get_immunities(map.agent_ids[:3]), .25, atol=1 / MAX_IMMUNITY)
+        # periods past the range of 16 bits integers
+        map.current_period = 70000
+        map.immunize(map.agent_ids[:3], .5)
+        map.current_period += 2
+        assert np.allclose(map.get_immunities(map.agent_ids[:3]), .25, atol=1 / MAX_IMMUNITY)
+        map.save(tmp_path)
+        loaded = Map()
+        loaded.load(tmp_path)
+        assert np.array_equal(loaded.immunities, map.immunities) and loaded.immunity_half_life == 2
+        # immunity after an infection
+        map.reset()
+        assert not map.any_immune
+        map.set_immunity(infection_immunity=.8)
+        map.make_move()
+        assert map.infected_agents.shape[0] > 0 and np.allclose(map.get_immunities(map.infected_agents), .8, atol=1 / MAX_IMMUNITY)
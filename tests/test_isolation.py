@@ -0,0 +1,48 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from classes import Map
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_testing_and_isolation(tmp_path, get_array_params):
+    array_params = get_array_params()
+    map = Map()
+    map.from_arrays(**array_params, seed=0)
+    contagious = np.nonzero(map.unique_contagiousities[map.current_state_ids] > 0)[0]
+    # isolated contagious agents stay at home and infect nobody
+    map.isolate(contagious, duration=2)
+    for _ in range(N_MOVES_PER_PERIOD):
+        map.make_move()
+        assert np.all(map.current_cell_ids[contagious] == map.home_cell_ids[contagious])
+    map.forward_all_cells()
+    assert map.infecting_agents.shape[0] > 0 and not np.any(np.isin(map.infecting_agents, contagious))
+    map.forward_all_cells()
+    assert map.any_isolated
+    map.forward_all_cells()
+    assert map.isolated_agents.shape[0] == 0 and not map.any_isolated and not np.any(map.isolated_flags)
+    # tests drawn among the infected states only
+    map.reset()
+    state_weights = (map.unique_state_ids == 3).astype(float)
+    map.set_testing(n_tests_per_period=500, state_weights=state_weights, isolation_duration=3)
+    map.forward_all_cells()
+    assert map.isolated_agents.shape[0] == min(500, np.sum(map.current_state_ids == 3))
+    assert np.all(map.isolation_ends == map.current_period + 2)
+    isolated = np.unpackbits(map.isolated_flags)[:map.agent_ids.shape[0]].astype(bool)
+    assert np.array_equal(np.nonzero(isolated)[0], np.sort(map.isolated_agents))
+    # isolated again: the latest end stays
+    agents, ends = map.isolated_agents.copy(), map.isolation_ends.copy()
+    map.isolate(agents[:2], duration=1)
+    map.isolate(agents[-2:], duration=5)
+    ends[-2:] = map.current_period + 5
+    assert np.array_equal(map.isolation_ends[np.argsort(map.isolated_agents)], ends[np.argsort(agents)])
+    map.save(tmp_path)
+    loaded = Map()
+    loaded.load(tmp_path)
+    assert np.array_equal(loaded.isolated_flags, map.isolated_flags) and loaded.get_testing()['isolation_duration'] == 3
+    # traced agents isolated instead of moving less
+    map.reset()
+    map.set_testing(isolate_traced=True)
+    map.run(2, N_MOVES_PER_PERIOD, tracing_rate=1)
+    assert not map.any_traced and map.any_isolated
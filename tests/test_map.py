@@ -0,0 +1,108 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import pytest
+import numpy as np
+from classes import Map, State, Agent, Cell, Transitions
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_reset_same_as_rebuild(get_array_params, run):
+    array_params = get_array_params()
+    map = Map()
+    map.from_arrays(**array_params)
+    run(map, 3, seed=1)
+    current_state_ids = map.current_state_ids
+    # Changing scalar parameters doesn't rebuild the squares nor reallocate agent arrays
+    coords_squares = map.coords_squares
+    unique_severities = np.array([0, 0, 0, .5, 1, 1, 1, .2, 0])
+    p_moves = np.full(array_params['p_moves'].shape[0], .1)
+    map.reset(unique_severities=unique_severities, p_moves=p_moves, dscale=2)
+    assert map.coords_squares is coords_squares
+    assert map.current_state_ids is current_state_ids
+    assert map.current_period == 0 and map.r_factors.shape[0] == 0
+    stats_reset = run(map, 3, seed=2)
+
+    array_params = get_array_params()
+    array_params.update({'unique_severities': unique_severities, 'p_moves': p_moves, 'dscale': 2})
+    map_rebuilt = Map()
+    map_rebuilt.from_arrays(**array_params)
+    stats_rebuilt = run(map_rebuilt, 3, seed=2)
+    assert np.array_equal(stats_reset, stats_rebuilt)
+    assert np.allclose(map.square_sampling_probas, map_rebuilt.square_sampling_probas)
+
+
+def test_object_constructor():
+    # legacy constructor: one object by state, agent and cell, per-agent values as columns
+    states = [State(id=0, name='healthy', contagiousity=0, sensitivity=1, severity=0),
+              State(id=1, name='infected', contagiousity=.9, sensitivity=0, severity=.1),
+              State(id=2, name='recovered', contagiousity=0, sensitivity=0, severity=0)]
+    transitions = Transitions(0, np.array([[1, 0, 0], [0, 0, 1], [0, 0, 1]]))
+    rng = np.random.default_rng(0)
+    n_agents, n_home_cells = 200, 80
+    p_moves = rng.uniform(size=(n_agents, 1))
+    agents = [Agent(id=i, p_move=p_moves[i], transitions=transitions, states=states, durations=np.array([-1, 3, -1]),
+                    current_state=states[int(i < 20)], home_cell_id=i % n_home_cells) for i in range(n_agents)]
+    cells = [Cell(id=i, position=rng.uniform(0, 10, 2), attractivity=float(i >= n_home_cells), unsafety=1) for i in range(100)]
+    map = Map(cells, agents, states)
+    assert map.p_moves.shape == (n_agents,) and np.allclose(map.p_moves, p_moves.ravel())
+    for _ in range(4):
+        for _ in range(N_MOVES_PER_PERIOD):
+            map.make_move()
+        map.forward_all_cells()
+    assert map.infected_agents.shape[0] > 0
+    map.reset(p_moves=p_moves)
+    assert map.p_moves.shape == (n_agents,)
+
+
+def test_reset_unknown_parameter(get_array_params):
+    map = Map()
+    map.from_arrays(**get_array_params())
+    with pytest.raises(ValueError):
+        map.reset(avg_p_move=.1)
+
+
+def test_common_random_numbers(get_array_params, run):
+    array_params = get_array_params()
+    map = Map()
+    map.from_arrays(**array_params, seed=3)
+    stats = run(map, 3, seed=1)
+    # the global random state doesn't matter anymore, re-running after reset gives the same trajectory
+    map.reset()
+    assert np.array_equal(run(map, 3, seed=2), stats)
+    map.reset(seed=4)
+    assert not np.array_equal(run(map, 3, seed=1), stats)
+    # draws of a move only depend on the period and the move: the first move of the next period is the same
+    # whatever the number of moves done before
+    map.reset(seed=3)
+    map.forward_all_cells()
+    map.set_step(0)
+    draw = map.rngs['move'].uniform(size=10)
+    map.reset(seed=3)
+    map.make_move()
+    map.forward_all_cells()
+    map.set_step(0)
+    assert np.array_equal(map.rngs['move'].uniform(size=10), draw)
+    # explicit generators are used as they are
+    rng = np.random.default_rng(0)
+    map.reset(rngs={'transition': rng})
+    assert map.rngs['transition'] is rng and map.rngs['move'] is not rng
+    try:
+        map.set_random_streams(rngs={'moves': rng})
+        assert False
+    except ValueError:
+        pass
+
+
+def test_run(get_array_params, run):
+    map = Map()
+    map.from_arrays(**get_array_params(), seed=0)
+    stats = run(map, 3, seed=0)
+    map.reset()
+    records = map.run(3, N_MOVES_PER_PERIOD, record=('states', 'new_states'))
+    assert np.array_equal(records['states'], stats[:, records['state_ids']])
+    assert records['new_states'].sum(axis=1).min() > 0
+    # a callback stops the run
+    map.reset()
+    records = map.run(3, N_MOVES_PER_PERIOD, callbacks=[lambda map, period, records: period == 1])
+    assert np.array_equal(records['states'], stats[:2, records['state_ids']]) and map.current_period == 2
@@ -0,0 +1,78 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import pytest
+import numpy as np
+from classes import Map
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_attractivity_profiles(tmp_path, get_array_params):
+    array_params = get_array_params()
+    attractivities = array_params['attractivities']
+    public = np.nonzero(attractivities > 0)[0]
+    # daytime: half of the public cells, evening: the other half
+    day, evening = attractivities.copy(), attractivities.copy()
+    day[public[1::2]], evening[public[::2]] = 0, 0
+    profile_schedule = [0] * (N_MOVES_PER_PERIOD - 1) + [1]
+    map = Map()
+    map.from_arrays(**array_params, seed=0, attractivity_profiles=[day, evening], profile_schedule=profile_schedule)
+    structures = [dict(structures) for structures in map.profile_structures]
+    for move in range(N_MOVES_PER_PERIOD):
+        map.make_move()
+        away = map.current_cell_ids != map.home_cell_ids
+        profile = [day, evening][profile_schedule[move]]
+        assert np.all(profile[map.current_cell_ids[away]] > 0)
+    map.forward_all_cells()
+    # the structures are computed once, the moves switch between them
+    for profile, profile_structures in enumerate(map.profile_structures):
+        assert all(profile_structures[name] is structures[profile][name] for name in profile_structures)
+    map.save(tmp_path)
+    loaded = Map()
+    loaded.load(tmp_path)
+    assert np.array_equal(loaded.profile_schedule, profile_schedule) and len(loaded.profile_structures) == 2
+    # a single profile: same simulation as without profiles
+    map.reset(attractivity_profiles=[attractivities], profile_schedule=None)
+    records = map.run(2, N_MOVES_PER_PERIOD)
+    map.reset(attractivity_profiles=None)
+    assert map.attractivity_profiles.shape[0] == 0
+    assert np.array_equal(map.run(2, N_MOVES_PER_PERIOD)['states'], records['states'])
+    with pytest.raises(ValueError):
+        map.reset(attractivity_profiles=[day, evening], profile_schedule=[0, 2])
+
+
+def test_mobility_classes(tmp_path, get_array_params):
+    array_params = get_array_params()
+    n_agents, n_cells = array_params['agent_ids'].shape[0], array_params['cell_ids'].shape[0]
+    public = np.nonzero(array_params['attractivities'] > 0)[0]
+    # class 0 doesn't go to half of the public cells, class 1 stays close to home
+    class_attractivity_weights = np.ones((2, n_cells))
+    class_attractivity_weights[0, public[::2]] = 0
+    mobility_class_ids = np.arange(n_agents) % 2
+    map = Map()
+    map.from_arrays(**array_params, seed=0, mobility_class_ids=mobility_class_ids, class_dscales=[1, 50],
+                    class_attractivity_weights=class_attractivity_weights, attractivity_profiles=[array_params['attractivities']] * 2)
+    assert len(map.profile_structures[1]['class_structures']) == 2
+    far = []
+    for _ in range(N_MOVES_PER_PERIOD):
+        map.make_move()
+        away = map.current_cell_ids != map.home_cell_ids
+        assert np.all(class_attractivity_weights[0, map.current_cell_ids[away & (mobility_class_ids == 0)]] > 0)
+        squares, home_squares = map.square_ids_cells[map.current_cell_ids], map.square_ids_cells[map.home_cell_ids]
+        far.append([np.mean((squares != home_squares)[away & (mobility_class_ids == c)]) for c in range(2)])
+    assert np.mean(far, axis=0)[1] < .1 * np.mean(far, axis=0)[0]
+    map.save(tmp_path)
+    loaded = Map()
+    loaded.load(tmp_path)
+    assert np.array_equal(loaded.class_dscales, [1, 50]) and len(loaded.class_structures) == 2
+    # classes moving as the map: same simulation as without classes
+    map.reset(attractivity_profiles=None, class_dscales=[map.dscale] * 2, class_attractivity_weights=None)
+    records = map.run(2, N_MOVES_PER_PERIOD)
+    map.reset(class_dscales=None, class_attractivity_weights=None)
+    assert len(map.class_structures) == 0
+    assert np.array_equal(map.run(2, N_MOVES_PER_PERIOD)['states'], records['states'])
+    with pytest.raises(ValueError):
+        map.reset(class_dscales=[1], mobility_class_ids=mobility_class_ids)
+    # class ids without classes
+    with pytest.raises(ValueError):
+        map.reset(mobility_class_ids=mobility_class_ids)
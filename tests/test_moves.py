@@ -0,0 +1,54 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import pytest
+import numpy as np
+from classes import Map, MOVE_MODES
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_move_buckets(get_array_params):
+    array_params = get_array_params()
+    array_params['p_moves'] = np.array([0, .01, .03, .07])[np.arange(array_params['p_moves'].shape[0]) % 4]
+    for probability_bits in [None, 16]:
+        map = Map()
+        map.from_arrays(**array_params, seed=0, probability_bits=probability_bits)
+        assert map.n_move_candidates < .1 * map.agent_ids.shape[0]
+        map.set_traced(map.agent_ids[::3])
+        probas_move = map.backend.to_numpy(map.unique_mobilities[map.current_state_ids] * array_params['p_moves'])
+        if probability_bits is not None:
+            probas_move = probas_move / 2 ** probability_bits
+        probas_move[::3] /= 5
+        n_moves = np.zeros(map.agent_ids.shape[0])
+        for step in range(500):
+            map.set_step(step)
+            selected_agents = map.select_movers()
+            assert np.all(np.diff(selected_agents.astype(np.int64)) > 0)
+            n_moves[selected_agents] += 1
+        # same probabilities as the selection by agent, by p_move and traced or not
+        groups = np.arange(n_moves.shape[0]) % 12
+        expected = np.bincount(groups, weights=probas_move) * 500
+        assert np.all(np.abs(np.bincount(groups, weights=n_moves) - expected) <= 4 * np.sqrt(expected) + 1e-9)
+
+
+def test_move_modes(get_array_params):
+    array_params = get_array_params()
+    map = Map()
+    map.from_arrays(**array_params, seed=0)
+    map.make_move()
+    moved = map.current_cell_ids != map.home_cell_ids
+    assert np.array_equal(map.current_square_ids, map.square_ids_cells[map.current_cell_ids])
+    away = {}
+    for move_mode in MOVE_MODES:
+        map.reset(move_mode=move_mode, p_return_home=.5)
+        for _ in range(N_MOVES_PER_PERIOD):
+            map.make_move()
+        away[move_mode] = np.mean(map.current_cell_ids != map.home_cell_ids)
+        assert np.array_equal(map.current_square_ids, map.square_ids_cells[map.current_cell_ids])
+        map.forward_all_cells()
+        assert np.array_equal(map.current_cell_ids, map.home_cell_ids)
+    # 'home': only the agents of the last move are away, 'current': the ones of all the moves
+    assert away['home'] == pytest.approx(moved.mean(), rel=.1)
+    assert away['home'] < away['return'] < away['current']
+    with pytest.raises(ValueError):
+        map.reset(move_mode='unknown')
@@ -0,0 +1,40 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from classes import Map
+from parallel import ChunkExecutor
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_chunked_moves(get_array_params, run):
+    map = Map()
+    map.from_arrays(**get_array_params(avg_p_move=.5), seed=0)
+    stats = run(map, 2, seed=0)
+    infected_agents = map.infected_agents.copy()
+    chunk_size = map.get_move_chunk_size(10 ** 6, max_temp_bytes=10 ** 6)
+    assert 1 < chunk_size < 10 ** 6
+    map.reset()
+    np.random.seed(0)
+    for _ in range(2):
+        for _ in range(N_MOVES_PER_PERIOD):
+            map.make_move(max_temp_bytes=10 ** 6)
+        map.forward_all_cells()
+    assert np.array_equal(np.bincount(map.current_state_ids.astype(np.int64), minlength=9), stats[-1])
+    assert np.array_equal(map.infected_agents, infected_agents)
+
+
+def test_executor(get_array_params, run):
+    map = Map()
+    map.from_arrays(**get_array_params(), seed=0)
+    states = []
+    for n_threads in [1, 3]:
+        executor = ChunkExecutor(n_threads, chunk_size=4096)
+        map.set_executor(executor)
+        map.reset()
+        states.append(run(map, 2, seed=0))
+        indices = np.random.randint(0, map.p_moves.shape[0], size=10 ** 5)
+        assert np.array_equal(map.take(map.p_moves, indices), map.p_moves[indices])
+        executor.shutdown()
+    # the draws depend on the chunks, not on the threads
+    assert np.array_equal(states[0], states[1])
@@ -0,0 +1,105 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from classes import Map
+from policies import Policy, Intervention, PeriodTrigger, PrevalenceTrigger, StateCountTrigger
+from policies import ScaleUnsafeties, CloseCells, CapPMoves, WearMasks, IsolateTested, Vaccinate
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_actions(get_array_params):
+    array_params = get_array_params()
+    map = Map()
+    map.from_arrays(**array_params, seed=0, probability_bits=16)
+    unsafeties, p_moves = map.unsafeties.copy(), map.p_moves.copy()
+    public = np.nonzero(array_params['attractivities'] > 0)[0]
+    capped = map.transitions_ids == 0
+    policy = Policy([Intervention(PeriodTrigger(0), [CloseCells(public[::2]), CapPMoves(0, agents=capped), WearMasks(.5),
+                                                     ScaleUnsafeties(.5, cells=public)]),
+                     Intervention(PeriodTrigger(1), [IsolateTested(1, state_ids=[3], duration=2)], duration=1)])
+    policy.start(map)
+    policy.apply(map, 0)
+    assert map.p_mask == .5
+    assert np.array_equal(map.unsafeties[public], map.to_probabilities(map.get_probabilities(unsafeties[public]) / 2))
+    for _ in range(N_MOVES_PER_PERIOD):
+        map.make_move()
+        away = map.current_cell_ids != map.home_cell_ids
+        assert not np.any(np.isin(map.current_cell_ids[away], public[::2]))
+        assert not np.any(away & capped)
+    map.forward_all_cells()
+    policy.apply(map, 1)
+    tested = np.nonzero(map.current_state_ids == 3)[0]
+    assert np.all(np.isin(tested, map.isolated_agents)) and np.all(map.isolation_ends == map.current_period + 1)
+    # the isolations go on after the intervention, until their end
+    policy.apply(map, 2)
+    assert np.array_equal(map.p_moves[~capped], p_moves[~capped]) and map.any_isolated
+    map.forward_all_cells()
+    map.forward_all_cells()
+    assert not map.any_isolated
+    policy.stop(map)
+    assert np.array_equal(map.unsafeties, unsafeties) and np.array_equal(map.p_moves, p_moves) and map.p_mask == 0
+    assert np.array_equal(map.eligible_cells, array_params['cell_ids'][array_params['attractivities'] > 0])
+
+
+def test_triggers(get_array_params):
+    map = Map()
+    map.from_arrays(**get_array_params(), seed=0)
+    n_diseased, n_hospitalized = map.get_n_diseased(), np.isin(map.current_state_ids, [4, 5]).sum()
+    assert PrevalenceTrigger(n_diseased / map.agent_ids.shape[0])(map, 0)
+    assert not PrevalenceTrigger((n_diseased + 1) / map.agent_ids.shape[0])(map, 0)
+    assert StateCountTrigger([4, 5], n_hospitalized)(map, 0) and not StateCountTrigger([4, 5], n_hospitalized + 1)(map, 0)
+    assert PeriodTrigger(2)(map, 2) and not PeriodTrigger(2)(map, 1)
+
+
+def test_policy_run(get_array_params):
+    array_params = get_array_params()
+    map = Map()
+    map.from_arrays(**array_params, seed=0)
+    records = map.run(4, N_MOVES_PER_PERIOD, policy=Policy([]))
+    map.reset()
+    assert np.array_equal(map.run(4, N_MOVES_PER_PERIOD)['states'], records['states'])
+    # lockdown from period 2: nobody is infected anymore
+    map.reset()
+    map.run(4, N_MOVES_PER_PERIOD, policy=Policy([Intervention(PeriodTrigger(2), [ScaleUnsafeties(0)])]))
+    infected_periods = map.get_contamination_chain()[2]
+    assert np.any(infected_periods == 1) and np.all(infected_periods < 2)
+    assert np.array_equal(map.unsafeties, map.to_probabilities(array_params['unsafeties']))
+
+
+class RecordDraws:
+    """ action recording a draw of the 'policy' random stream at each period """
+    def compile(self, map):
+        self.draws = []
+
+    def apply(self, map, params, period):
+        self.draws.append(map.rngs['policy'].random())
+
+
+def test_policy_common_random_numbers(get_array_params):
+    # the draws of the policies don't depend on the trajectory of the simulation
+    draws = []
+    for factor in [1, .2]:
+        map = Map()
+        map.from_arrays(**get_array_params(), seed=0)
+        record = RecordDraws()
+        map.run(3, N_MOVES_PER_PERIOD, tracing_rate=.5, policy=Policy([Intervention(PeriodTrigger(0), [ScaleUnsafeties(factor), record])]))
+        draws.append(record.draws)
+    assert draws[0] == draws[1] and len(set(draws[0])) == 3
+
+
+def test_vaccination(get_array_params):
+    map = Map()
+    map.from_arrays(**get_array_params(), seed=0)
+    n_agents = map.agent_ids.shape[0]
+    # the first group is vaccinated first, an agent of both groups once
+    groups = [np.arange(n_agents) < 100, np.arange(50, n_agents)]
+    policy = Policy([Intervention(PeriodTrigger(1), [Vaccinate(80, groups, efficacy=1)], duration=2)])
+    map.run(4, N_MOVES_PER_PERIOD, policy=policy)
+    vaccinated = map.immunities > 0
+    assert vaccinated.sum() == 160 and np.all(vaccinated[:100]) and np.all(map.immunity_periods[vaccinated] >= 1)
+    # vaccinated agents are not infected anymore
+    map.reset()
+    map.run(4, N_MOVES_PER_PERIOD, policy=Policy([Intervention(PeriodTrigger(2), [Vaccinate(n_agents, efficacy=1)])]))
+    infected_periods = map.get_contamination_chain()[2]
+    assert np.any(infected_periods == 1) and np.all(infected_periods < 2)
@@ -0,0 +1,37 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from datetime import datetime
+from simulation import PopulationBuilder, states2ids
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+DAY = datetime(2020, 5, 1)
+STATE_MM = {'asymptomatic': (4, 3), 'infected': (6, 4), 'asympcont': (1, 1),
+            'hosp': (8, 6), 'icu': (17, 15), 'recovercont': (2, 1)}
+
+
+def test_population_builder():
+    builder = PopulationBuilder(data_dir=DATA_DIR, seed=0)
+    n_agents, n_home_cells = 700000, 300000
+    res = builder.build(n_agents, STATE_MM, DAY, n_home_cells, avg_p_move=.1)
+    effectifs = builder.get_effectifs(n_agents)
+    n = effectifs.sum()
+    # all per-agent arrays are aligned
+    for key in ['agent_ids', 'home_cell_ids', 'p_moves', 'least_state_ids', 'current_state_ids',
+                'current_state_durations', 'transitions_ids']:
+        assert res[key].shape == (n,)
+    assert res['durations'].shape == (n, len(states2ids))
+    assert res['transitions'].shape == (9, 9, len(builder.demographies))
+    assert res['home_cell_ids'].max() < n_home_cells
+    assert np.array_equal(np.bincount(res['transitions_ids']), effectifs)
+    # infinite states keep duration -1, drawn ones are >= 1
+    assert (res['durations'][:, states2ids['healthy']] == -1).all()
+    assert (res['durations'][:, states2ids['hosp']] >= 1).all()
+    # state repartition of the day scaled to the population size, demography by demography
+    repartition = builder.repartitions[np.datetime64(DAY)]
+    for i, state in enumerate(builder.repartition_states):
+        n_expected = (repartition[:, i] * n / builder.pop_reference).astype(int).sum()
+        assert (res['current_state_ids'] == states2ids[state]).sum() == n_expected
+    asymptomatic_durations = res['current_state_durations'][res['current_state_ids'] == states2ids['asymptomatic']]
+    assert asymptomatic_durations.min() >= 1 and asymptomatic_durations.max() <= 5
+    assert abs(res['p_moves'].mean() - .1) < .01
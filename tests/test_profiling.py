@@ -0,0 +1,38 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import json
+import numpy as np
+from classes import Map
+from profiling import Profiler
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_profiler(tmp_path, get_array_params, run):
+    map = Map()
+    map.from_arrays(**get_array_params(), seed=0)
+    profiler = Profiler()
+    map.set_profiler(profiler)
+    run(map, 2, seed=0)
+    map.set_profiler(None)
+    profiler.stop()
+    n_records = len(profiler.records)
+    run(map, 1, seed=0)
+    assert len(profiler.records) == n_records
+    df = profiler.to_dataframe()
+    assert (df['name'] == 'make_move').sum() == 2 * N_MOVES_PER_PERIOD
+    assert (df['name'] == 'forward_all_cells').sum() == 2
+    assert (df['duration'] >= 0).all() and (df['peak_temp_bytes'] >= 0).all()
+    make_moves = df[df['name'] == 'make_move']
+    assert (make_moves['depth'] == 0).all() and (make_moves['n_agents'] > 0).all()
+    # nested phases: the moved agents are the ones of the enclosing move, the peak of a move covers its sub-phases
+    move_agents = df[(df['name'] == 'move_agents')]
+    assert (move_agents['depth'] == 1).all()
+    assert np.array_equal(move_agents['n_agents'].values, make_moves['n_agents'].values)
+    assert (move_agents['peak_temp_bytes'].values <= make_moves['peak_temp_bytes'].values).all()
+    summary = profiler.summary()
+    assert set(['make_move', 'move_agents', 'contaminate', 'forward_all_cells']) <= set(summary.index)
+    assert np.isclose(summary.loc[['make_move', 'forward_all_cells'], 'share'].sum(), 1)
+    profiler.to_chrome_trace(tmp_path / 'trace.json')
+    with open(tmp_path / 'trace.json') as f:
+        assert len(json.load(f)['traceEvents']) == n_records
@@ -0,0 +1,49 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import numpy as np
+from classes import Map
+
+N_MOVES_PER_PERIOD = 4
+
+
+def test_square_tree(tmp_path, get_array_params):
+    array_params = get_array_params()
+    maps = {}
+    for square_sampling in ['matrix', 'tree']:
+        maps[square_sampling] = Map()
+        maps[square_sampling].from_arrays(**array_params, seed=0, square_sampling=square_sampling)
+    map = maps['tree']
+    assert map.square_sampling_probas.size == 0
+    square_sampling_probas = np.diff(maps['matrix'].square_sampling_probas, axis=1, prepend=0)
+    n_agents = 10 ** 5
+    for square in range(0, square_sampling_probas.shape[0], 7):
+        r_squares = np.random.default_rng(square).random((n_agents, map.get_square_tree_steps()))
+        selected_squares = map.descend_square_tree(np.full(n_agents, square), r_squares)
+        frequencies = np.bincount(selected_squares, minlength=square_sampling_probas.shape[1]) / n_agents
+        assert np.abs(frequencies - square_sampling_probas[square]).sum() / 2 < .03
+    map.run(2, N_MOVES_PER_PERIOD)
+    map.save(tmp_path)
+    loaded = Map()
+    loaded.load(tmp_path)
+    assert loaded.square_sampling == 'tree' and np.array_equal(loaded.square_tree_children, map.square_tree_children)
+    map.reset(square_sampling='matrix')
+    assert map.square_sampling_probas.shape == maps['matrix'].square_sampling_probas.shape
+    assert np.array_equal(map.run(2, N_MOVES_PER_PERIOD)['states'], maps['matrix'].run(2, N_MOVES_PER_PERIOD)['states'])
+
+
+def test_adaptive_squares(get_array_params):
+    array_params = get_array_params()
+    map = Map()
+    map.from_arrays(**array_params, seed=0, square_size=2)
+    n_squares = map.coords_squares.shape[0]
+    assert np.bincount(map.square_ids_cells).max() > 1000
+    for square_sampling in ['matrix', 'tree']:
+        map.reset(max_cells_per_square=200, square_sampling=square_sampling)
+        assert map.coords_squares.shape[0] > n_squares and np.bincount(map.square_ids_cells).max() <= 200
+        # the sampling of the cells has at most one column by cell of the square
+        assert map.cell_sampling_probas.shape[1] <= 200
+        assert map.run(2, N_MOVES_PER_PERIOD)['states'][-1].sum() == map.agent_ids.shape[0]
+    map.reset(square_size=1, max_cells_per_square=None, square_sampling='matrix')
+    unit_map = Map()
+    unit_map.from_arrays(**array_params, seed=0)
+    assert np.array_equal(map.square_ids_cells, unit_map.square_ids_cells)
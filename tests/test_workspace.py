@@ -0,0 +1,31 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'propagsim', 'np'))
+import tracemalloc
+import numpy as np
+from classes import Map
+
+
+def get_move_peak_memory(map):
+    """ peak memory allocated during a few moves """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for _ in range(3):
+        map.make_move()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - start
+
+
+def test_workspace(get_array_params, run):
+    array_params = get_array_params()
+    peaks, stats = [], []
+    for with_workspace in [True, False]:
+        map = Map()
+        map.from_arrays(**array_params, seed=0)
+        if not with_workspace:
+            map.set_workspace(None)
+        stats.append(run(map, 2, seed=0))
+        peaks.append(get_move_peak_memory(map))
+    assert np.array_equal(stats[0], stats[1])
+    # once the buffers are allocated, the moves allocate little
+    assert peaks[0] < peaks[1] / 4